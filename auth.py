@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from config import STREAM_TOKEN_TTL
 
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
@@ -35,6 +36,24 @@ def verify_token(token: str, expected_purpose: str = None):
     except JWTError:
         return None
 
+def verify_session_token(token: str):
+    # Stream tokens travel in URLs, only session tokens may authenticate a user
+    return verify_token(token, expected_purpose="session")
+
+def create_stream_token(user_id: int, video_id: int):
+    return create_access_token(
+        user_id=user_id,
+        expires_delta=timedelta(seconds=STREAM_TOKEN_TTL),
+        purpose="stream",
+        extra_payload={"video_id": video_id}
+    )
+
+def verify_stream_token(token: str, user_id: int, video_id: int) -> bool:
+    payload = verify_token(token, expected_purpose="stream")
+    if not payload:
+        return False
+    return payload.get("user_id") == user_id and payload.get("video_id") == video_id
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
@@ -0,0 +1,126 @@
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Dict, Tuple
+import anyio
+from config import BLOCK_CACHE_SIZE, BLOCK_CACHE_BLOCK_SIZE, BLOCK_CACHE_STATS_INTERVAL
+
+# (path, mtime_ns, block_index), a replaced file gets a new mtime so its old
+# blocks are never served again and simply age out
+BlockKey = Tuple[str, int, int]
+
+
+def read_block(path: Path, offset: int, size: int) -> Tuple[bytes, int]:
+    with open(path, "rb") as file:
+        file.seek(offset)
+        data = file.read(size)
+        return data, Path(path).stat().st_mtime_ns
+
+
+class BlockCache:
+    def __init__(self, max_bytes: int, block_size: int):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.blocks: "OrderedDict[BlockKey, bytes]" = OrderedDict()
+        # Keys missed once, a block is only admitted on its second miss so a
+        # single viewer scanning a long video can't flush the hot set
+        self.seen: "OrderedDict[BlockKey, None]" = OrderedDict()
+        self.max_seen = max(1, max_bytes // block_size) * 4
+        self.inflight: Dict[BlockKey, asyncio.Future] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes >= self.block_size > 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "blocks": len(self.blocks),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
+
+    def admit(self, key: BlockKey, block: bytes):
+        if key not in self.seen:
+            self.seen[key] = None
+            while len(self.seen) > self.max_seen:
+                self.seen.popitem(last=False)
+            return
+
+        del self.seen[key]
+        self.blocks[key] = block
+        self.size += len(block)
+        while self.size > self.max_bytes:
+            _, evicted = self.blocks.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    async def load_block(self, key: BlockKey, path: Path, mtime_ns: int, block_index: int) -> bytes:
+        try:
+            block, current_mtime_ns = await anyio.to_thread.run_sync(
+                read_block, path, block_index * self.block_size, self.block_size
+            )
+        finally:
+            del self.inflight[key]
+        if current_mtime_ns == mtime_ns:
+            self.admit(key, block)
+        return block
+
+    async def get_block(self, path: Path, mtime_ns: int, block_index: int) -> bytes:
+        key = (str(path), mtime_ns, block_index)
+        block = self.blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return block
+
+        # Concurrent misses on the same block share a single disk read, which
+        # runs as its own task so a disconnecting viewer doesn't cancel it
+        task = self.inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self.load_block(key, path, mtime_ns, block_index))
+            self.inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def iter_range(self, path: Path, mtime_ns: int, start: int, end: int) -> AsyncIterator[bytes]:
+        position = start
+        while position <= end:
+            block_index, offset = divmod(position, self.block_size)
+            block = await self.get_block(path, mtime_ns, block_index)
+            length = min(len(block) - offset, end - position + 1)
+            if length <= 0:
+                break
+            yield block if offset == 0 and length == len(block) else block[offset:offset + length]
+            position += length
+
+    async def report(self, stop: asyncio.Event, interval: float):
+        # One log line per interval while there is traffic, a low hit ratio
+        # with steady evictions means BLOCK_CACHE_SIZE is too small for the hot set
+        reported = None
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            stats = self.stats()
+            if (stats["hits"], stats["misses"]) == reported:
+                continue
+            reported = (stats["hits"], stats["misses"])
+            print(
+                f"Block cache: {stats['hit_ratio']:.1%} hit ratio ({stats['hits']} hits, {stats['misses']} misses), "
+                f"{stats['evictions']} evictions, {stats['bytes'] / (1024 * 1024):.1f}/{stats['max_bytes'] / (1024 * 1024):.1f} MiB "
+                f"in {stats['blocks']} blocks"
+            )
+
+block_cache = BlockCache(max_bytes=BLOCK_CACHE_SIZE, block_size=BLOCK_CACHE_BLOCK_SIZE)
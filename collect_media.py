@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set
+import anyio
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal
+from crud import stream_media_blob_hashes, stream_profile_media_references, stream_video_media_references
+from media_layout import (
+    BLOBS_DIRECTORY, FLAT_FILE_DIRECTORIES, FLAT_TREE_DIRECTORIES, HLS_DIRECTORY, MEDIA_ROOT, MINIATURES_DIRECTORY,
+    PREVIEWS_DIRECTORY, PROFILES_DIRECTORY, SHARD_PATTERN, VIDEOS_DIRECTORY, legacy_children, remove_legacy_directory
+)
+from config import MEDIA_GC_MIN_AGE, STORAGE_BACKEND
+
+MEDIA_FILE_PATTERN = re.compile(r"^(\d+)(\.\w+)$")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Scratch left behind by interrupted writers: faststart rewrites, derivative
+# and HLS work directories, migration links
+TEMP_PATTERN = re.compile(r"(\.[0-9a-f]{8}\.(tmp|faststart[.\w]*)|\.migrating)$")
+
+# Only the names above are ever collected, anything else under media/
+# (default.png, media/tmp, ...) is left alone
+
+
+class References(NamedTuple):
+    # directory -> {id: extension} for media still stored under its row id
+    files: Dict[str, Dict[int, str]]
+    # directory -> ids whose derived trees are still keyed by the row id
+    trees: Dict[str, Set[int]]
+    blobs: Set[str]
+
+
+class Orphan(NamedTuple):
+    directory: str
+    path: Path
+    # "file", "tree", or "legacy" for a flat directory that may share its
+    # name with a shard directory
+    kind: str
+
+
+async def mark(db: AsyncSession) -> References:
+    files = {directory: {} for directory in FLAT_FILE_DIRECTORIES}
+    trees = {directory: set() for directory in FLAT_TREE_DIRECTORIES}
+    blobs = set()
+
+    # Content addressed media lives in blobs/ and is keyed by its hash, a file
+    # still named after the row id is a leftover from before the upload
+    async for video_id, video_extension, video_sha256, miniature_extension, miniature_sha256 in stream_video_media_references(db):
+        if not video_sha256:
+            files[VIDEOS_DIRECTORY][video_id] = video_extension.lower()
+            trees[HLS_DIRECTORY].add(video_id)
+            trees[PREVIEWS_DIRECTORY].add(video_id)
+        if not miniature_sha256:
+            files[MINIATURES_DIRECTORY][video_id] = miniature_extension.lower()
+            trees["derivatives/miniature"].add(video_id)
+
+    async for user_id, profile_extension, profile_sha256 in stream_profile_media_references(db):
+        if not profile_sha256:
+            files[PROFILES_DIRECTORY][user_id] = profile_extension.lower()
+            trees["derivatives/profile"].add(user_id)
+
+    # Rows with a zero refcount still count, sweep_media_blobs owns those
+    async for sha256 in stream_media_blob_hashes(db):
+        blobs.add(sha256)
+
+    return References(files, trees, blobs)
+
+
+def scan(path: Path) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def is_shard(entry: os.DirEntry) -> bool:
+    return bool(SHARD_PATTERN.match(entry.name)) and entry.is_dir(follow_symlinks=False)
+
+
+def iter_shard_entries(root: Path) -> Iterator[os.DirEntry]:
+    for first in scan(root):
+        if not is_shard(first):
+            continue
+        for second in scan(Path(first.path)):
+            if is_shard(second):
+                yield from scan(Path(second.path))
+
+
+def is_referenced_key(name: str, ids: Set[int], blobs: Set[str]) -> Optional[bool]:
+    if name.isdigit():
+        return int(name) in ids
+    if SHA256_PATTERN.match(name):
+        return name in blobs
+    if TEMP_PATTERN.search(name):
+        return False
+    return None
+
+
+def iter_orphans(references: References, directories: List[str], cutoff: float) -> Iterator[Orphan]:
+    def is_old(entry: os.DirEntry) -> bool:
+        return entry.stat(follow_symlinks=False).st_mtime < cutoff
+
+    for directory in directories:
+        root = MEDIA_ROOT / directory
+
+        if directory == BLOBS_DIRECTORY:
+            for entry in iter_shard_entries(root):
+                referenced = is_referenced_key(entry.name, set(), references.blobs)
+                if referenced is False and is_old(entry):
+                    yield Orphan(directory, Path(entry.path), "tree" if entry.is_dir(follow_symlinks=False) else "file")
+
+        elif directory in references.files:
+            expected = references.files[directory]
+            legacy = [entry for entry in scan(root) if entry.is_file(follow_symlinks=False)]
+            for entry in legacy + list(iter_shard_entries(root)):
+                match = MEDIA_FILE_PATTERN.match(entry.name)
+                if match:
+                    referenced = expected.get(int(match.group(1))) == match.group(2).lower()
+                elif TEMP_PATTERN.search(entry.name):
+                    referenced = False
+                else:
+                    continue
+                if not referenced and entry.is_file(follow_symlinks=False) and is_old(entry):
+                    yield Orphan(directory, Path(entry.path), "file")
+
+        else:
+            ids = references.trees[directory]
+            for entry in scan(root):
+                # Flat trees from before sharding, a two digit id is also a shard name
+                if entry.name.isdigit() and entry.is_dir(follow_symlinks=False) and int(entry.name) not in ids:
+                    if legacy_children(Path(entry.path)) and is_old(entry):
+                        yield Orphan(directory, Path(entry.path), "legacy")
+            for entry in iter_shard_entries(root):
+                if is_referenced_key(entry.name, ids, references.blobs) is False and is_old(entry):
+                    yield Orphan(directory, Path(entry.path), "tree" if entry.is_dir(follow_symlinks=False) else "file")
+
+
+def orphan_size(orphan: Orphan) -> int:
+    if orphan.kind == "file":
+        return orphan.path.stat().st_size
+    paths = legacy_children(orphan.path) if orphan.kind == "legacy" else [orphan.path]
+    size = 0
+    for path in paths:
+        if path.is_file():
+            size += path.stat().st_size
+            continue
+        for parent, _, names in os.walk(path):
+            for name in names:
+                size += os.lstat(os.path.join(parent, name)).st_size
+    return size
+
+
+def remove_orphan(orphan: Orphan, quarantine: Optional[Path]):
+    if quarantine is None:
+        if orphan.kind == "file":
+            orphan.path.unlink(missing_ok=True)
+        elif orphan.kind == "tree":
+            shutil.rmtree(orphan.path, ignore_errors=True)
+        else:
+            remove_legacy_directory(orphan.path)
+        return
+
+    # Same relative path under the quarantine, so a file can be moved back by hand
+    destination = quarantine / orphan.path.relative_to(MEDIA_ROOT)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if orphan.kind != "legacy":
+        shutil.move(str(orphan.path), str(destination))
+        return
+    destination.mkdir(exist_ok=True)
+    for child in legacy_children(orphan.path):
+        shutil.move(str(child), str(destination / child.name))
+    remove_legacy_directory(orphan.path)
+
+
+def sweep(references: References, batch_size: int, pause: float, min_age: float, dry_run: bool, quarantine: Optional[Path]) -> dict:
+    directories = list(FLAT_TREE_DIRECTORIES)
+    if STORAGE_BACKEND == "local":
+        directories = [*FLAT_FILE_DIRECTORIES, BLOBS_DIRECTORY, *directories]
+    else:
+        # Uploaded files live in the bucket, only derived media is on local disk
+        print(f"Storage backend is {STORAGE_BACKEND}, only derived media is collected")
+
+    counts, sizes = Counter(), Counter()
+    cutoff = time.time() - min_age
+    batch = 0
+
+    for orphan in iter_orphans(references, directories, cutoff):
+        try:
+            size = orphan_size(orphan)
+            if dry_run:
+                print(f"{orphan.path}{'/' if orphan.kind != 'file' else ''} ({size} bytes)")
+            else:
+                remove_orphan(orphan, quarantine)
+        except OSError as e:
+            print(f"Error collecting {orphan.path}: {e}")
+            continue
+
+        counts[orphan.directory] += 1
+        sizes[orphan.directory] += size
+        batch += 1
+        if not dry_run and batch % batch_size == 0:
+            print(f"Collected {batch} orphans")
+            time.sleep(pause)
+
+    action = "Would collect" if dry_run else "Quarantined" if quarantine else "Deleted"
+    for directory in directories:
+        if counts[directory]:
+            print(f"{action} {counts[directory]} orphans in {directory}/ ({sizes[directory] / (1024 * 1024):.1f} MiB)")
+    print(f"{action} {sum(counts.values())} orphans, {sum(sizes.values()) / (1024 * 1024):.1f} MiB in total")
+
+    return {"orphans": dict(counts), "bytes": dict(sizes)}
+
+
+async def collect(
+    batch_size: int = 500,
+    pause: float = 0.5,
+    min_age: float = MEDIA_GC_MIN_AGE,
+    dry_run: bool = False,
+    quarantine: Optional[str] = None
+) -> dict:
+    # Marking first means every row committed during the sweep is newer than
+    # min_age, its files can't be mistaken for orphans
+    async with SessionLocal() as db:
+        references = await mark(db)
+
+    return await anyio.to_thread.run_sync(
+        sweep, references, batch_size, pause, min_age, dry_run, Path(quarantine) if quarantine else None
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deletes media files and directories that no database row references anymore")
+    parser.add_argument("--batch-size", type=int, default=500, help="Orphans collected between pauses")
+    parser.add_argument("--pause", type=float, default=0.5, help="Seconds to sleep between batches")
+    parser.add_argument("--min-age", type=float, default=MEDIA_GC_MIN_AGE, help="Seconds since the last change before a file can be collected")
+    parser.add_argument("--quarantine", help="Move orphans into this directory instead of deleting them")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be collected")
+    args = parser.parse_args()
+    asyncio.run(collect(args.batch_size, args.pause, args.min_age, args.dry_run, args.quarantine))
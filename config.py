@@ -0,0 +1,132 @@
+import os
+
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))
+MAX_OPEN_RANGE_SIZE = int(os.getenv("MAX_OPEN_RANGE_SIZE", 8 * 1024 * 1024))
+MAX_RANGES_PER_REQUEST = int(os.getenv("MAX_RANGES_PER_REQUEST", 16))
+
+VIDEO_CACHE_CONTROL = os.getenv("VIDEO_CACHE_CONTROL", "private, no-cache")
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "private, max-age=3600")
+
+# "buffered" streams through Python, "sendfile" hands the file descriptor to the
+# ASGI server (zero-copy) when it advertises http.response.zerocopysend,
+# "x-accel-redirect" (nginx) and "x-sendfile" (apache, lighttpd) let the reverse
+# proxy serve the file after the app has checked permissions
+MEDIA_DELIVERY_MODE = os.getenv("MEDIA_DELIVERY_MODE", "buffered")
+
+# Internal nginx location aliased to the media/ directory
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "/protected_media/")
+
+# Hot block cache for the buffered delivery path, per worker process. Files are
+# cached in aligned BLOCK_CACHE_BLOCK_SIZE blocks up to BLOCK_CACHE_SIZE bytes,
+# 0 disables it
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", 256 * 1024 * 1024))
+BLOCK_CACHE_BLOCK_SIZE = int(os.getenv("BLOCK_CACHE_BLOCK_SIZE", 1024 * 1024))
+# Seconds between hit/miss log lines, 0 turns them off
+BLOCK_CACHE_STATS_INTERVAL = float(os.getenv("BLOCK_CACHE_STATS_INTERVAL", 300))
+
+# Stream admission and shaping for /video_stream, per worker process. Each
+# response drains through a token bucket refilled at STREAM_STARTUP_MULTIPLIER
+# times the media bitrate for the first STREAM_STARTUP_SECONDS, then at
+# STREAM_PACE_MULTIPLIER times it. Rates are in bytes per second. Files whose
+# bitrate is unknown (only MP4 durations are read) and single range responses
+# sent zero-copy in sendfile mode are not paced
+STREAM_MAX_PER_USER = int(os.getenv("STREAM_MAX_PER_USER", 4))
+STREAM_SHAPING_ENABLED = os.getenv("STREAM_SHAPING_ENABLED", "1") == "1"
+STREAM_STARTUP_SECONDS = float(os.getenv("STREAM_STARTUP_SECONDS", 10))
+STREAM_STARTUP_MULTIPLIER = float(os.getenv("STREAM_STARTUP_MULTIPLIER", 4.0))
+STREAM_PACE_MULTIPLIER = float(os.getenv("STREAM_PACE_MULTIPLIER", 1.5))
+STREAM_MIN_RATE = int(os.getenv("STREAM_MIN_RATE", 128 * 1024))
+STREAM_BUCKET_SECONDS = float(os.getenv("STREAM_BUCKET_SECONDS", 2))
+
+# "local" keeps originals (videos, miniatures, profile pictures) under media/,
+# "s3" stores them in an S3 compatible bucket and the media endpoints answer
+# with short lived presigned redirects. Derived files (HLS, previews, image
+# derivatives) stay on the local media/ directory either way
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+S3_PRESIGNED_URL_TTL = int(os.getenv("S3_PRESIGNED_URL_TTL", 300))
+
+# Content addressed blobs nobody references are deleted after this long, it
+# must outlast MEDIA_LOCATOR_TTL
+BLOB_SWEEP_GRACE = int(os.getenv("BLOB_SWEEP_GRACE", 60 * 60))
+# Files younger than this are never collected, uploads write the file before
+# the row that references it is committed
+MEDIA_GC_MIN_AGE = int(os.getenv("MEDIA_GC_MIN_AGE", 24 * 60 * 60))
+# The worker enqueues collect_orphaned_media this often, 0 disables it. With a
+# quarantine directory orphans are moved there instead of deleted
+MEDIA_GC_INTERVAL = int(os.getenv("MEDIA_GC_INTERVAL", 24 * 60 * 60))
+MEDIA_GC_QUARANTINE = os.getenv("MEDIA_GC_QUARANTINE") or None
+
+MEDIA_LOCATOR_CACHE_SIZE = int(os.getenv("MEDIA_LOCATOR_CACHE_SIZE", 10000))
+# Bounds how long another worker's stale entry can survive an upload or edit
+MEDIA_LOCATOR_TTL = int(os.getenv("MEDIA_LOCATOR_TTL", 300))
+
+CONTACTS_CACHE_SIZE = int(os.getenv("CONTACTS_CACHE_SIZE", 10000))
+# Subscription changes invalidate the local entry, other workers catch up
+# within this many seconds
+CONTACTS_CACHE_TTL = int(os.getenv("CONTACTS_CACHE_TTL", 60))
+
+# Video views are counted in memory and written in batches, a crash loses at
+# most VIEW_FLUSH_INTERVAL seconds of views
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", 5))
+VIEW_FLUSH_MAX_PENDING = int(os.getenv("VIEW_FLUSH_MAX_PENDING", 10000))
+
+# Slots per like/dislike/subscriber counter, writes land on a random slot of
+# counter_shards and the worker rolls them into the main column. 0 updates the
+# column in place
+COUNTER_SHARDS = int(os.getenv("COUNTER_SHARDS", 0))
+COUNTER_ROLLUP_INTERVAL = int(os.getenv("COUNTER_ROLLUP_INTERVAL", 30))
+# The worker enqueues reconcile_counters this often, 0 disables it
+COUNTER_RECONCILE_INTERVAL = int(os.getenv("COUNTER_RECONCILE_INTERVAL", 24 * 60 * 60))
+
+# Lifetime of the signed token /API/video hands to the player, once it expires
+# stream_video falls back to the database permission check
+STREAM_TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL", 15 * 60))
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFPROBE_BINARY = os.getenv("FFPROBE_BINARY", "ffprobe")
+HLS_ENABLED = os.getenv("HLS_ENABLED", "1") == "1"
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", 6))
+# Packaging jobs are CPU heavy, keep them from starving the web worker
+HLS_MAX_CONCURRENT_JOBS = int(os.getenv("HLS_MAX_CONCURRENT_JOBS", 1))
+HLS_CACHE_CONTROL = os.getenv("HLS_CACHE_CONTROL", "private, max-age=86400")
+
+# Seek previews: at most PREVIEW_MAX_FRAMES thumbnails per video, never closer
+# together than PREVIEW_MIN_INTERVAL seconds, tiled into sprite sheets
+PREVIEW_MAX_FRAMES = int(os.getenv("PREVIEW_MAX_FRAMES", 100))
+PREVIEW_MIN_INTERVAL = float(os.getenv("PREVIEW_MIN_INTERVAL", 2))
+PREVIEW_THUMBNAIL_WIDTH = int(os.getenv("PREVIEW_THUMBNAIL_WIDTH", 160))
+PREVIEW_TILE_COLUMNS = int(os.getenv("PREVIEW_TILE_COLUMNS", 10))
+PREVIEW_TILE_ROWS = int(os.getenv("PREVIEW_TILE_ROWS", 10))
+PREVIEW_CACHE_CONTROL = os.getenv("PREVIEW_CACHE_CONTROL", "private, max-age=604800")
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# Must be on the same filesystem as media/ so finished uploads can be renamed into place
+UPLOAD_TEMP_DIR = os.getenv("UPLOAD_TEMP_DIR", "media/tmp")
+# Multipart file parts are spooled into UPLOAD_TEMP_DIR while the form is
+# parsed, before the handler runs. Bodies are rejected up front from their
+# Content-Length, allowing this much on top of the file limits for the other fields
+UPLOAD_FORM_OVERHEAD = int(os.getenv("UPLOAD_FORM_OVERHEAD", 1024 * 1024))
+
+# Resumable uploads: largest body a single PATCH may carry, and how long an
+# unfinished session is kept on disk
+RESUMABLE_MAX_CHUNK_SIZE = int(os.getenv("RESUMABLE_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+RESUMABLE_UPLOAD_TTL = int(os.getenv("RESUMABLE_UPLOAD_TTL", 24 * 60 * 60))
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_RETRY_BASE_DELAY = int(os.getenv("JOB_RETRY_BASE_DELAY", 10))
+JOB_RETRY_MAX_DELAY = int(os.getenv("JOB_RETRY_MAX_DELAY", 60 * 60))
+# Workers refresh the lock of a running job this often, one that hasn't been
+# refreshed within JOB_LOCK_TIMEOUT belongs to a dead worker and is picked up again
+JOB_HEARTBEAT_INTERVAL = int(os.getenv("JOB_HEARTBEAT_INTERVAL", 60))
+JOB_LOCK_TIMEOUT = int(os.getenv("JOB_LOCK_TIMEOUT", 10 * 60))
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 7 * 24 * 60 * 60))
+
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", 2))
+# Decoding larger images is refused, it protects the pool from decompression bombs
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 50_000_000))
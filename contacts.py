@@ -0,0 +1,22 @@
+from typing import FrozenSet
+from sqlalchemy.ext.asyncio import AsyncSession
+from crud import get_mutual_subscription_ids
+from ttl_cache import TTLCache
+from config import CONTACTS_CACHE_SIZE, CONTACTS_CACHE_TTL
+
+# Contacts are mutual subscriptions, two users may chat once each one
+# subscribes to the other. Keyed by user id, a subscription change
+# invalidates both ends
+contact_cache = TTLCache(max_entries=CONTACTS_CACHE_SIZE, ttl=CONTACTS_CACHE_TTL)
+
+
+async def get_contact_ids(db: AsyncSession, user_id: int) -> FrozenSet[int]:
+    contact_ids = contact_cache.get(user_id)
+    if contact_ids is None:
+        contact_ids = frozenset(await get_mutual_subscription_ids(db=db, user_id=user_id))
+        contact_cache.put(user_id, contact_ids)
+    return contact_ids
+
+
+async def check_chat_permission(db: AsyncSession, user_id: int, destination_id: int) -> bool:
+    return destination_id in await get_contact_ids(db=db, user_id=user_id)
@@ -1,11 +1,15 @@
-from typing import Any, Dict, List
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import and_, desc, distinct, or_, asc, insert, delete, update
-from sqlalchemy.orm import selectinload, joinedload
-from models import FollowUp, Hashtag, User, UserPreference, Video, Comment, user_comment_favorites, user_comment_hated, user_video_favorites, user_video_hated, user_subscriptions, PrivateMessage
+from sqlalchemy import BigInteger, Integer, Table, and_, cast, column, desc, distinct, func, literal, or_, asc, insert, delete, union_all, update, values
+from sqlalchemy.orm import aliased, selectinload, joinedload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import CounterShard, FollowUp, Hashtag, MediaBlob, User, UserPreference, Video, Comment, user_comment_favorites, user_comment_hated, user_video_favorites, user_video_hated, user_subscriptions, video_hashtags, PrivateMessage
 from auth import verify_password, hash_password
 from datetime import datetime
+import random
+from config import COUNTER_SHARDS
 from functions import pretty_date
 
 async def login(db: AsyncSession, username: str, password: str):
@@ -67,13 +71,17 @@ async def get_profile_data_by_username(db: AsyncSession, user_id: int, username:
     followup = followup_result.scalars().first()
     followed_up = bool(followup)
 
+    subscribers = user.subscribers_count
+    if COUNTER_SHARDS > 0:
+        subscribers = await get_counter_value(db, User, "subscribers_count", user.id)
+
     print(followed_up)
     if user.private_account and not subscribed and user_id != user.id:
         return {
         "user": {
                 "id": user.id,
                 "username": user.username,
-                "subscribers": user.subscribers_count,
+                "subscribers": subscribers,
                 "subscribed": subscribed,
                 "followup": followed_up
             }
@@ -86,7 +94,7 @@ async def get_profile_data_by_username(db: AsyncSession, user_id: int, username:
         "user": {
             "id": user.id,
             "username": user.username,
-            "subscribers": user.subscribers_count,
+            "subscribers": subscribers,
             "subscribed": subscribed,
             "followup": followed_up
         },
@@ -95,73 +103,71 @@ async def get_profile_data_by_username(db: AsyncSession, user_id: int, username:
 
 
 async def get_video_data_by_id(db: AsyncSession, video_id: int, user_id: int):
-    result = await db.execute(
-        select(Video)
-        .where(Video.id == video_id)
-        .options(
-            selectinload(Video.owner),
-        )
+    # Video, channel and the viewer's flags in one statement, the view count
+    # is recorded by the caller after the response
+    subscribed = (
+        select(user_subscriptions.c.user_id)
+        .where(user_subscriptions.c.user_id == user_id, user_subscriptions.c.channel_id == Video.owner_id)
+        .exists()
+    )
+    liked = (
+        select(user_video_favorites.c.video_id)
+        .where(user_video_favorites.c.user_id == user_id, user_video_favorites.c.video_id == Video.id)
+        .exists()
+    )
+    disliked = (
+        select(user_video_hated.c.video_id)
+        .where(user_video_hated.c.user_id == user_id, user_video_hated.c.video_id == Video.id)
+        .exists()
     )
-    video = result.scalars().first()
-
-    owner_result = await db.execute(select(User).where(User.id == video.owner_id))
-    owner = owner_result.scalars().first()
 
     result = await db.execute(
-        select(user_subscriptions).where(
-            and_(
-                user_subscriptions.c.user_id == user_id,
-                user_subscriptions.c.channel_id == video.owner_id
-            )
+        select(
+            Video.title, Video.description, counter_value(Video, "likes"), counter_value(Video, "dislikes"), Video.hls_status,
+            User.id, User.username, User.private_account,
+            subscribed, liked, disliked
         )
+        .join(User, User.id == Video.owner_id)
+        .where(Video.id == video_id)
     )
+    row = result.first()
 
-    subscription = result.fetchone()
-    subscribed = bool(subscription)
+    if not row:
+        return {"Error": "No data"}
 
-    if owner.private_account and not subscribed and owner.id != user_id:
-        return {"error": "you dont have access to this content"}
-    
-    await db.execute(update(Video).where(Video.id == video_id).values(views=video.views + 1))
-    await db.commit()
+    (
+        title, description, likes, dislikes, hls_status,
+        owner_id, owner_username, private_account,
+        video_subscribed, video_liked, video_disliked
+    ) = row
 
-    result = await db.execute(
-        select(user_video_favorites).where(
-            and_(
-                user_video_favorites.c.user_id == user_id,
-                user_video_favorites.c.video_id == video_id
-            )
-        )
-    )
+    if private_account and not video_subscribed and owner_id != user_id:
+        return {"error": "you dont have access to this content"}
 
-    video_liked = result.fetchone()
-    liked = bool(video_liked)
+    return {
+        "title": title,
+        "description": description,
+        "owner_id": owner_id,
+        "owner_username": owner_username,
+        "likes": likes,
+        "dislikes": dislikes,
+        "liked": video_liked,
+        "disliked": video_disliked,
+        "subscribed": video_subscribed,
+        "hls_ready": hls_status == "ready"
+    }
 
-    result = await db.execute(
-        select(user_video_hated).where(
-            and_(
-                user_video_hated.c.user_id == user_id,
-                user_video_hated.c.video_id == video_id
-            )
-        )
+async def add_video_views(db: AsyncSession, views: Dict[int, int]):
+    # Rows are locked in id order first so concurrent flushes from other
+    # processes can't deadlock, then one UPDATE ... FROM (VALUES ...) for the batch
+    await db.execute(select(Video.id).where(Video.id.in_(list(views))).order_by(Video.id).with_for_update())
+    increments = values(column("id", Integer), column("views", Integer), name="increments").data(list(views.items()))
+    await db.execute(
+        update(Video)
+        .where(Video.id == increments.c.id)
+        .values(views=Video.views + increments.c.views)
     )
-    video_disliked = result.fetchone()
-    disliked = bool(video_disliked)
-
-    if video:
-        return {
-            "title": video.title,
-            "description": video.description,
-            "owner_id": video.owner.id,
-            "owner_username": video.owner.username,
-            "likes": video.likes,
-            "dislikes": video.dislikes,
-            "liked": liked,
-            "disliked": disliked,
-            "subscribed": subscribed
-        }
-
-    return {"Error": "No data"}
+    await db.commit()
 
 async def comment(db: AsyncSession, user_id: int, video_id: int, content: str):
     video_result = await db.execute(select(Video).where(Video.id == video_id))
@@ -189,26 +195,22 @@ async def comment(db: AsyncSession, user_id: int, video_id: int, content: str):
 
     return {"Success": "OK"}
 
-async def get_comments(db: AsyncSession, user_id: int, video_id: int, offset_value: int, order_by="likes"):
-
-    video_result = await db.execute(select(Video).where(Video.id == video_id))
-    video = video_result.scalars().first()
-
-    owner_result = await db.execute(select(User).where(User.id == video.owner_id))
-    owner = owner_result.scalars().first()
-
-    result = await db.execute(select(user_subscriptions)
-        .where(and_(
-            user_subscriptions.c.user_id == user_id,
-            user_subscriptions.c.channel_id == owner.id
-        ))
+def comments_visible_condition(user_id: int, video_id: int):
+    # Private channels only show their comments to subscribers and the owner
+    owner = aliased(User)
+    subscribed = (
+        select(user_subscriptions.c.user_id)
+        .where(user_subscriptions.c.user_id == user_id, user_subscriptions.c.channel_id == owner.id)
+        .exists()
+    )
+    return (
+        select(Video.id)
+        .join(owner, owner.id == Video.owner_id)
+        .where(Video.id == video_id, or_(owner.private_account.isnot(True), owner.id == user_id, subscribed))
+        .exists()
     )
 
-    subscription = result.fetchone()
-
-    if owner.private_account and not subscription and user_id != owner.id:
-        return {"error": "not allowed to see the comments"}
-
+async def get_comments(db: AsyncSession, user_id: int, video_id: int, offset_value: int, order_by="likes"):
     if order_by == "likes":
         ordering = desc(Comment.likes)
     elif order_by == "recent":
@@ -218,34 +220,52 @@ async def get_comments(db: AsyncSession, user_id: int, video_id: int, offset_val
     else:
         ordering = desc(Comment.likes)
 
+    visible = comments_visible_condition(user_id, video_id)
+    liked = (
+        select(user_comment_favorites.c.comment_id)
+        .where(user_comment_favorites.c.user_id == user_id, user_comment_favorites.c.comment_id == Comment.id)
+        .exists()
+    )
+    disliked = (
+        select(user_comment_hated.c.comment_id)
+        .where(user_comment_hated.c.user_id == user_id, user_comment_hated.c.comment_id == Comment.id)
+        .exists()
+    )
+
+    # The page, its authors, the viewer's reactions and the privacy check in a
+    # single round trip
     result = await db.execute(
-        select(Comment)
-        .options(selectinload(Comment.owner))
-        .where(Comment.video_id == video_id)
+        select(
+            Comment.id, Comment.content, counter_value(Comment, "likes"), counter_value(Comment, "dislikes"),
+            User.id, User.username, Comment.date,
+            liked, disliked
+        )
+        .join(User, User.id == Comment.owner_id)
+        .where(Comment.video_id == video_id, visible)
         .order_by(ordering)
         .offset(offset_value)
         .limit(30)
     )
+    rows = result.all()
 
-    comments = result.scalars().all()
-    comments_data = []
-
-    for comment in comments:
-        liked = bool(await check_if_liked_comment(db, user_id, comment.id))
-        disliked = bool(await check_if_disliked_comment(db, user_id, comment.id))
-        comments_data.append({
-            "id": comment.id,
-            "content": comment.content,
-            "likes": comment.likes,
-            "dislikes": comment.dislikes,
-            "owner_id": comment.owner.id,
-            "owner_username": comment.owner.username,
-            "date": comment.date,
-            "liked": liked,
-            "disliked": disliked
-        })
+    # An empty page is either the end of the comments or a private channel
+    if not rows and not (await db.execute(select(visible))).scalar():
+        return {"error": "not allowed to see the comments"}
 
-    return {"comments": comments_data}
+    return {"comments": [
+        {
+            "id": comment_id,
+            "content": content,
+            "likes": likes,
+            "dislikes": dislikes,
+            "owner_id": owner_id,
+            "owner_username": owner_username,
+            "date": date,
+            "liked": comment_liked,
+            "disliked": comment_disliked
+        }
+        for comment_id, content, likes, dislikes, owner_id, owner_username, date, comment_liked, comment_disliked in rows
+    ]}
 
 
 async def check_if_liked_comment(db: AsyncSession, user_id: int, comment_id: int):
@@ -270,100 +290,205 @@ async def check_if_disliked_comment(db: AsyncSession, user_id: int, comment_id:
     )
     return result.fetchone()
 
-async def like_unlike_comment(db: AsyncSession, user_id: int, comment_id: int):
+# Counter columns that can be sharded, with the association column their
+# true value is counted from
+COUNTER_SOURCES = {
+    ("videos", "likes"): (Video, user_video_favorites.c.video_id),
+    ("videos", "dislikes"): (Video, user_video_hated.c.video_id),
+    ("comments", "likes"): (Comment, user_comment_favorites.c.comment_id),
+    ("comments", "dislikes"): (Comment, user_comment_hated.c.comment_id),
+    ("users", "subscribers_count"): (User, user_subscriptions.c.channel_id),
+}
+
+def upsert_counter_shards(rows):
+    statement = pg_insert(CounterShard).from_select(["table_name", "row_id", "field", "slot", "delta"], rows)
+    return statement.on_conflict_do_update(
+        index_elements=[CounterShard.table_name, CounterShard.row_id, CounterShard.field, CounterShard.slot],
+        set_={"delta": CounterShard.delta + statement.excluded.delta}
+    )
 
-    comment_liked = await check_if_liked_comment(db=db, user_id=user_id, comment_id=comment_id)
-    comment_disliked = await check_if_disliked_comment(db=db, user_id=user_id, comment_id=comment_id)
+def adjust_counter(model, field: str, row_id: int, delta: int):
+    if COUNTER_SHARDS <= 0:
+        return update(model).where(model.id == row_id).values({field: getattr(model, field) + delta})
+    return upsert_counter_shards(
+        select(literal(model.__tablename__), literal(row_id), literal(field), literal(random.randrange(COUNTER_SHARDS)), literal(delta))
+    )
 
-    if comment_liked:
-        await db.execute(delete(user_comment_favorites).where(
-            and_(
-                user_comment_favorites.c.user_id == user_id,
-                user_comment_favorites.c.comment_id == comment_id
+def counter_value(model, field: str):
+    # The main column plus the deltas the rollup hasn't folded in yet
+    if COUNTER_SHARDS <= 0:
+        return getattr(model, field)
+    pending = (
+        select(func.coalesce(func.sum(CounterShard.delta), 0))
+        .where(CounterShard.table_name == model.__tablename__, CounterShard.row_id == model.id, CounterShard.field == field)
+        .scalar_subquery()
+    )
+    return cast(getattr(model, field) + pending, BigInteger)
+
+async def get_counter_value(db: AsyncSession, model, field: str, row_id: int):
+    result = await db.execute(select(counter_value(model, field)).where(model.id == row_id))
+    return result.scalar_one_or_none()
+
+async def rollup_counter_shards(db: AsyncSession, model, field: str) -> int:
+    # Deleting the shards and adding them to the column is one statement, a
+    # reader summing both never sees a delta twice or not at all
+    moved = (
+        delete(CounterShard)
+        .where(CounterShard.table_name == model.__tablename__, CounterShard.field == field)
+        .returning(CounterShard.row_id, CounterShard.delta)
+        .cte("moved")
+    )
+    totals = select(moved.c.row_id, func.sum(moved.c.delta).label("delta")).group_by(moved.c.row_id).subquery("totals")
+    result = await db.execute(
+        update(model)
+        .where(model.id == totals.c.row_id)
+        .values({field: getattr(model, field) + totals.c.delta})
+    )
+    await db.commit()
+    return result.rowcount
+
+async def get_max_row_id(db: AsyncSession, model):
+    result = await db.execute(select(func.max(model.id)))
+    return result.scalar() or 0
+
+async def reconcile_counter(db: AsyncSession, model, field: str, key_column, start_id: int, end_id: int) -> int:
+    # Recounts rows start_id <= id < end_id from the association table and adds
+    # the difference as a delta. The count, the column and the pending shards are
+    # read from the same snapshot, and a toggle committed after it is in none of
+    # them, so adding rather than overwriting keeps it counted exactly once
+    pending = (
+        select(func.coalesce(func.sum(CounterShard.delta), 0))
+        .where(CounterShard.table_name == model.__tablename__, CounterShard.row_id == model.id, CounterShard.field == field)
+        .scalar_subquery()
+    )
+    actual = select(func.count()).where(key_column == model.id).scalar_subquery()
+    drift = (
+        select(model.id.label("row_id"), cast(actual - getattr(model, field) - pending, BigInteger).label("delta"))
+        .where(model.id >= start_id, model.id < end_id)
+        .cte("drift")
+        # Computed once, a row re-read after waiting on a concurrent toggle
+        # still gets the delta from the snapshot
+        .prefix_with("MATERIALIZED")
+    )
+
+    if COUNTER_SHARDS <= 0:
+        statement = (
+            update(model)
+            .where(model.id == drift.c.row_id, drift.c.delta != 0)
+            .values({field: getattr(model, field) + drift.c.delta})
+        )
+    else:
+        statement = upsert_counter_shards(
+            select(
+                literal(model.__tablename__), drift.c.row_id, literal(field), literal(random.randrange(COUNTER_SHARDS)),
+                drift.c.delta
             )
-        ))
-        await db.execute(
-            update(Comment)
-            .where(Comment.id == comment_id)
-            .values(likes=Comment.likes - 1)
+            .where(drift.c.delta != 0)
         )
-        await db.commit()
-        return False
-    
-    elif not comment_liked:
-        await db.execute(insert(user_comment_favorites).values(
-            user_id=user_id,
-            comment_id=comment_id
-        ))
-        await db.execute(
-            update(Comment)
-            .where(Comment.id == comment_id)
-            .values(likes=Comment.likes + 1)
+    result = await db.execute(statement)
+    await db.commit()
+    return result.rowcount
+
+async def toggle_reaction(
+    db: AsyncSession,
+    model,
+    reactions: Table,
+    opposite: Table,
+    key: str,
+    target_id: int,
+    user_id: int,
+    counter: str,
+    opposite_counter: str
+):
+    # One statement: remove the reaction if present, otherwise add it and drop
+    # the opposite one, and move the counters by exactly the rows changed. The
+    # CTEs share a snapshot and row locks, so double clicks can't drift the counts
+    removed = (
+        delete(reactions)
+        .where(reactions.c.user_id == user_id, reactions.c[key] == target_id)
+        .returning(reactions.c[key])
+        .cte("removed")
+    )
+    added = (
+        pg_insert(reactions)
+        .from_select(
+            ["user_id", key],
+            select(literal(user_id), model.id).where(model.id == target_id, ~select(removed.c[key]).exists())
         )
+        .on_conflict_do_nothing()
+        .returning(reactions.c[key])
+        .cte("added")
+    )
+    cleared = (
+        delete(opposite)
+        .where(opposite.c.user_id == user_id, opposite.c[key] == target_id, select(added.c[key]).exists())
+        .returning(opposite.c[key])
+        .cte("cleared")
+    )
 
-        if comment_disliked:
-            await db.execute(delete(user_comment_hated).where(
-                and_(
-                    user_comment_hated.c.user_id == user_id,
-                    user_comment_hated.c.comment_id == comment_id
-                )
+    def changed(cte):
+        return select(func.count()).select_from(cte).scalar_subquery()
+
+    counter_delta = changed(added) - changed(removed)
+    opposite_delta = literal(0) - changed(cleared)
+
+    if COUNTER_SHARDS <= 0:
+        counted = (
+            update(model)
+            .where(model.id == target_id)
+            .values({
+                counter: getattr(model, counter) + counter_delta,
+                opposite_counter: getattr(model, opposite_counter) + opposite_delta
+            })
+            .returning(getattr(model, counter), getattr(model, opposite_counter))
+            .cte("counted")
+        )
+        statement = select(select(added.c[key]).exists(), counted.c[counter], counted.c[opposite_counter])
+    else:
+        slot = random.randrange(COUNTER_SHARDS)
+        shards = (
+            upsert_counter_shards(union_all(
+                select(literal(model.__tablename__), model.id, literal(counter), literal(slot), counter_delta).where(model.id == target_id),
+                select(literal(model.__tablename__), model.id, literal(opposite_counter), literal(slot), opposite_delta).where(model.id == target_id)
             ))
-
-            await db.execute(update(Comment)
-                .where(Comment.id == comment_id)
-                .values(dislikes=Comment.dislikes - 1)
+            .returning(CounterShard.row_id)
+            .cte("shards")
+        )
+        # counter_value reads the snapshot from before this statement, the
+        # deltas it writes are added on top
+        statement = (
+            select(
+                select(added.c[key]).exists(),
+                counter_value(model, counter) + counter_delta,
+                counter_value(model, opposite_counter) + opposite_delta
             )
+            .where(model.id == target_id, model.id.in_(select(shards.c.row_id)))
+        )
 
-        await db.commit()
-        return True
-    
-
-async def dislike_undislike_comment(db: AsyncSession, user_id: int, comment_id: int):
-    
-    comment_disliked = await check_if_disliked_comment(db=db, user_id=user_id, comment_id=comment_id)
-    comment_liked = await check_if_liked_comment(db=db, user_id=user_id, comment_id=comment_id)
+    result = await db.execute(statement)
+    row = result.first()
+    await db.commit()
+    return row
 
-    if comment_disliked:
-        await db.execute(delete(user_comment_hated).where(
-            and_(
-                user_comment_hated.c.user_id == user_id,
-                user_comment_hated.c.comment_id == comment_id
-            )
-        ))
-        await db.execute(
-            update(Comment)
-            .where(Comment.id == comment_id)
-            .values(dislikes=Comment.dislikes - 1)
-        )
-        await db.commit()
-        return False
-    
-    elif not comment_disliked:
-        await db.execute(insert(user_comment_hated).values(
-            user_id=user_id,
-            comment_id=comment_id
-        ))
-        await db.execute(
-            update(Comment)
-            .where(Comment.id == comment_id)
-            .values(dislikes=Comment.dislikes + 1)
-        )
+async def like_unlike_comment(db: AsyncSession, user_id: int, comment_id: int):
+    row = await toggle_reaction(
+        db, Comment, user_comment_favorites, user_comment_hated, "comment_id", comment_id, user_id, "likes", "dislikes"
+    )
+    if not row:
+        return {"error": "Comment not found"}
 
-        if comment_liked:
-            await db.execute(delete(user_comment_favorites).where(
-                and_(
-                    user_comment_favorites.c.user_id == user_id,
-                    user_comment_favorites.c.comment_id == comment_id
-                )
-            ))
+    liked, likes, dislikes = row
+    return {"like": liked, "likes": likes, "dislikes": dislikes}
 
-            await db.execute(update(Comment)
-                .where(Comment.id == comment_id)
-                .values(likes=Comment.likes - 1)
-            )
+async def dislike_undislike_comment(db: AsyncSession, user_id: int, comment_id: int):
+    row = await toggle_reaction(
+        db, Comment, user_comment_hated, user_comment_favorites, "comment_id", comment_id, user_id, "dislikes", "likes"
+    )
+    if not row:
+        return {"error": "Comment not found"}
 
-        await db.commit()
-        return True
+    disliked, dislikes, likes = row
+    return {"dislike": disliked, "likes": likes, "dislikes": dislikes}
 
 
 async def check_if_liked_video(db: AsyncSession, user_id: int, video_id: int):
@@ -389,102 +514,25 @@ async def check_if_disliked_video(db: AsyncSession, user_id: int, video_id: int)
     return result.fetchone()
 
 async def like_unlike_video(db: AsyncSession, user_id: int, video_id: int):
+    row = await toggle_reaction(
+        db, Video, user_video_favorites, user_video_hated, "video_id", video_id, user_id, "likes", "dislikes"
+    )
+    if not row:
+        return {"error": "Video not found"}
 
-    video_liked = await check_if_liked_video(db=db, user_id=user_id, video_id=video_id)
-    video_disliked = await check_if_disliked_video(db=db, user_id=user_id, video_id = video_id)
-
-    if video_liked:
-        await db.execute(
-            delete(user_video_favorites).where(
-                and_(
-                    user_video_favorites.c.user_id == user_id,
-                    user_video_favorites.c.video_id == video_id
-                )
-            )
-        )
-        await db.execute(update(Video)
-            .where(Video.id == video_id)
-            .values(likes=Video.likes - 1)
-        )
-        await db.commit()
-        return False
-    
-    elif not video_liked:
-        await db.execute(insert(user_video_favorites)
-            .values(
-                user_id=user_id,
-                video_id=video_id
-            )
-        )
-        await db.execute(update(Video)
-            .where(Video.id == video_id)
-            .values(likes=Video.likes + 1)
-        )
-
-        if video_disliked:
-            await db.execute(delete(user_video_hated).where(
-                and_(
-                    user_video_hated.c.user_id == user_id,
-                    user_video_hated.c.video_id == video_id
-                )
-            ))
-            await db.execute(update(Video)
-                .where(Video.id == video_id)
-                .values(dislikes=Video.dislikes - 1)
-            )
-
-        await db.commit()
-        return True
-    
+    liked, likes, dislikes = row
+    return {"like": liked, "likes": likes, "dislikes": dislikes}
 
 async def dislike_undislike_video(db: AsyncSession, user_id: int, video_id: int):
+    row = await toggle_reaction(
+        db, Video, user_video_hated, user_video_favorites, "video_id", video_id, user_id, "dislikes", "likes"
+    )
+    if not row:
+        return {"error": "Video not found"}
 
-    video_disliked = await check_if_disliked_video(db=db, user_id=user_id, video_id = video_id)
-    video_liked = await check_if_liked_video(db=db, user_id=user_id, video_id=video_id)
-    
-    if video_disliked:
-        await db.execute(
-            delete(user_video_hated).where(
-                and_(
-                    user_video_hated.c.user_id == user_id,
-                    user_video_hated.c.video_id == video_id
-                )
-            )
-        )
-        await db.execute(update(Video)
-            .where(Video.id == video_id)
-            .values(dislikes=Video.dislikes - 1)
-        )
-        await db.commit()
-        return False
-    
-    elif not video_disliked:
-        await db.execute(insert(user_video_hated)
-            .values(
-                user_id=user_id,
-                video_id=video_id
-            )
-        )
-        await db.execute(update(Video)
-            .where(Video.id == video_id)
-            .values(dislikes=Video.dislikes + 1)
-        )
-
-        if video_liked:
-            await db.execute(delete(user_video_favorites).where(
-                and_(
-                    user_video_favorites.c.user_id == user_id,
-                    user_video_favorites.c.video_id == video_id
-                )
-            ))
-            await db.execute(update(Video)
-                .where(Video.id == video_id)
-                .values(likes=Video.likes - 1)
-            )
+    disliked, dislikes, likes = row
+    return {"dislike": disliked, "likes": likes, "dislikes": dislikes}
 
-        await db.commit()
-        return True
-    
 
 async def subscribe_by_video(db: AsyncSession, user_id: int, video_id: int):
     
@@ -516,12 +564,10 @@ async def subscribe_by_video(db: AsyncSession, user_id: int, video_id: int):
             ))
         )
 
-        await db.execute(update(User).where(User.id == video_owner_id)
-            .values(subscribers_count=User.subscribers_count - 1)
-        )
+        await db.execute(adjust_counter(User, "subscribers_count", video_owner_id, -1))
 
         await db.commit()
-        return {"Success": "Dessubscribed successfully"}
+        return {"Success": "Dessubscribed successfully", "channel_id": video_owner_id, "subscribed": False}
     
     channel_result = await db.execute(select(User).where(User.id == video_owner_id))
     channel = channel_result.scalars().first()
@@ -543,13 +589,11 @@ async def subscribe_by_video(db: AsyncSession, user_id: int, video_id: int):
         .values(user_id=user_id, channel_id=video_owner_id)
     )
 
-    await db.execute(update(User).where(User.id == video_owner_id)
-        .values(subscribers_count=User.subscribers_count + 1)
-    )
+    await db.execute(adjust_counter(User, "subscribers_count", video_owner_id, 1))
 
     await db.commit()
 
-    return {"Success": "Subscribed successfully"}
+    return {"Success": "Subscribed successfully", "channel_id": video_owner_id, "subscribed": True}
 
 
 async def subscribe_by_username(db: AsyncSession, user_id: int, username: str):
@@ -583,13 +627,10 @@ async def subscribe_by_username(db: AsyncSession, user_id: int, username: str):
             ))
         )
 
-        await db.execute(update(User)
-            .where(User.id == channel_id)
-            .values(subscribers_count=User.subscribers_count - 1)
-        )
+        await db.execute(adjust_counter(User, "subscribers_count", channel_id, -1))
 
         await db.commit()
-        return {"Success": "Unsubscribed successfully"}
+        return {"Success": "Unsubscribed successfully", "channel_id": channel_id}
     
     channel_result = await db.execute(select(User).where(User.id == channel_id))
     channel = channel_result.scalars().first()
@@ -611,13 +652,10 @@ async def subscribe_by_username(db: AsyncSession, user_id: int, username: str):
         .values(user_id=user_id, channel_id=channel_id)
     )
 
-    await db.execute(update(User)
-        .where(User.id == channel_id)
-        .values(subscribers_count=User.subscribers_count + 1)
-    )
+    await db.execute(adjust_counter(User, "subscribers_count", channel_id, 1))
 
     await db.commit()
-    return {"Success": "Subscribed successfully"}
+    return {"Success": "Subscribed successfully", "channel_id": channel_id}
 
 async def upload_video(
     db: AsyncSession,
@@ -626,7 +664,9 @@ async def upload_video(
     description: str,
     video_extension: str,
     miniature_extension: str,
-    hashtags: list[str] = None
+    hashtags: list[str] = None,
+    video_sha256: Optional[str] = None,
+    miniature_sha256: Optional[str] = None
 ) -> Video:
     hashtag_objs = []
 
@@ -648,6 +688,8 @@ async def upload_video(
         description=description,
         video_extension=video_extension,
         miniature_extension=miniature_extension,
+        video_sha256=video_sha256,
+        miniature_sha256=miniature_sha256,
         owner_id=user_id,
         upload_date=datetime.now(),
         hashtags=hashtag_objs
@@ -664,6 +706,94 @@ async def upload_video(
         await db.rollback()
         raise e
 
+async def acquire_media_blob(db: AsyncSession, sha256: str, size: int) -> int:
+    # Upsert keeps the row locked until the caller commits, so a concurrent
+    # upload of the same bytes waits until the file is in place
+    result = await db.execute(
+        pg_insert(MediaBlob)
+        .values(sha256=sha256, size=size, refcount=1, created_at=datetime.now())
+        .on_conflict_do_update(
+            index_elements=[MediaBlob.sha256],
+            set_={"refcount": MediaBlob.refcount + 1, "released_at": None}
+        )
+        .returning(MediaBlob.refcount)
+    )
+    return result.scalar_one()
+
+async def replace_video_blob(db: AsyncSession, video_id: int, old_sha256: str, new_sha256: str) -> bool:
+    # Caller commits, the new blob must already be acquired
+    result = await db.execute(
+        update(Video)
+        .where(Video.id == video_id, Video.video_sha256 == old_sha256)
+        .values(video_sha256=new_sha256)
+    )
+    if result.rowcount == 0:
+        return False
+    await release_media_blob(db, old_sha256)
+    return True
+
+async def release_media_blob(db: AsyncSession, sha256: Optional[str]):
+    if not sha256:
+        return
+    await db.execute(
+        update(MediaBlob)
+        .where(MediaBlob.sha256 == sha256)
+        .values(refcount=MediaBlob.refcount - 1, released_at=datetime.now())
+    )
+
+async def get_unreferenced_media_blobs(db: AsyncSession, released_before: datetime, limit: int) -> List[str]:
+    result = await db.execute(
+        select(MediaBlob.sha256)
+        .where(MediaBlob.refcount <= 0, MediaBlob.released_at < released_before)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+async def delete_unreferenced_media_blob(db: AsyncSession, sha256: str) -> bool:
+    # Left uncommitted, the row lock holds off acquire_media_blob while the file is removed
+    result = await db.execute(
+        delete(MediaBlob)
+        .where(MediaBlob.sha256 == sha256, MediaBlob.refcount <= 0)
+        .returning(MediaBlob.sha256)
+    )
+    return result.scalar_one_or_none() is not None
+
+# Server side cursors for the media collector, the tables are read in
+# batches of batch_size rows instead of being loaded at once
+async def stream_video_media_references(db: AsyncSession, batch_size: int = 5000) -> AsyncIterator[Any]:
+    result = await db.stream(
+        select(Video.id, Video.video_extension, Video.video_sha256, Video.miniature_extension, Video.miniature_sha256)
+        .execution_options(yield_per=batch_size)
+    )
+    async for row in result:
+        yield row
+
+async def stream_profile_media_references(db: AsyncSession, batch_size: int = 5000) -> AsyncIterator[Any]:
+    result = await db.stream(
+        select(User.id, User.profile_extension, User.profile_sha256)
+        .where(or_(User.profile_extension.isnot(None), User.profile_sha256.isnot(None)))
+        .execution_options(yield_per=batch_size)
+    )
+    async for row in result:
+        yield row
+
+async def stream_media_blob_hashes(db: AsyncSession, batch_size: int = 5000) -> AsyncIterator[str]:
+    result = await db.stream_scalars(select(MediaBlob.sha256).execution_options(yield_per=batch_size))
+    async for sha256 in result:
+        yield sha256
+
+async def get_video_media_by_id(db: AsyncSession, video_id: int):
+    result = await db.execute(select(Video.video_extension, Video.video_sha256).where(Video.id == video_id))
+    return result.first()
+
+async def get_miniature_media_by_video_id(db: AsyncSession, video_id: int):
+    result = await db.execute(select(Video.miniature_extension, Video.miniature_sha256).where(Video.id == video_id))
+    return result.first()
+
+async def set_video_hls_status(db: AsyncSession, video_id: int, status: str):
+    await db.execute(update(Video).where(Video.id == video_id).values(hls_status=status))
+    await db.commit()
+
 async def get_miniature_extension_by_video_id(db: AsyncSession, video_id: int):
     result = await db.execute(select(Video).where(Video.id == video_id))
     video = result.scalars().first()
@@ -696,6 +826,7 @@ async def edit_video(
     description: str,
     miniature_extension: str,
     hashtags: list[str] = None,
+    miniature_sha256: Optional[str] = None
 ):
     video_result = await db.execute(
         select(Video).where(Video.id == video_id).options(selectinload(Video.hashtags))
@@ -711,6 +842,9 @@ async def edit_video(
     }
     if miniature_extension:
         update_data["miniature_extension"] = miniature_extension
+    if miniature_sha256:
+        await release_media_blob(db, video.miniature_sha256)
+        update_data["miniature_sha256"] = miniature_sha256
 
     await db.execute(update(Video).where(Video.id == video_id).values(**update_data))
 
@@ -749,7 +883,7 @@ async def get_profile_data_by_id(db: AsyncSession, user_id: int):
     
     return {"error": "user not found"}
 
-async def update_profile_by_id(db: AsyncSession, user_id: int, username: str, biography: str, profile_extension: str):
+async def update_profile_by_id(db: AsyncSession, user_id: int, username: str, biography: str, profile_extension: str, profile_sha256: Optional[str] = None):
     result = await db.execute(select(User).where(User.username == username))
     user_with_same_username = result.scalars().first()
 
@@ -761,13 +895,24 @@ async def update_profile_by_id(db: AsyncSession, user_id: int, username: str, bi
     if profile_extension:
         await db.execute(update(User).where(User.id == user_id).values(profile_extension=profile_extension))
 
+    if profile_sha256:
+        old_result = await db.execute(select(User.profile_sha256).where(User.id == user_id))
+        await release_media_blob(db, old_result.scalar_one_or_none())
+        await db.execute(update(User).where(User.id == user_id).values(profile_sha256=profile_sha256))
+
     await db.commit()
     return {"success": "profile updated successfully"}
 
+async def get_user_profile_media(db: AsyncSession, user_id: int):
+    result = await db.execute(select(User.profile_extension, User.profile_sha256).where(User.id == user_id))
+    return result.first()
+
 async def get_user_profile_extension(db: AsyncSession, user_id: int):
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalars().first()
-    return user.profile_extension
+    if user:
+        return user.profile_extension
+    return None
 
 async def search_videos(db: AsyncSession, search: str, filter: str, offset: int, limit: int = 20):
     search_pattern = f"%{search}%"
@@ -859,6 +1004,9 @@ async def stream_video_permission(db: AsyncSession, user_id: int, video_id: int)
     video_result = await db.execute(select(Video).where(Video.id == video_id))
     video = video_result.scalars().first()
 
+    if not video:
+        return False
+
     owner_result = await db.execute(select(User).where(User.id == video.owner_id))
     owner = owner_result.scalars().first()
 
@@ -913,6 +1061,41 @@ async def adjust_user_preferences_for_video(
 
     await db.commit()
 
+async def adjust_user_preferences_for_views(db: AsyncSession, views: List[List[int]], view_weight: float = 0.1):
+    # views holds [user_id, video_id, count], the hashtags of every video and the
+    # preferences they touch are loaded once for the whole batch
+    result = await db.execute(
+        select(video_hashtags.c.video_id, video_hashtags.c.hashtag_id)
+        .where(video_hashtags.c.video_id.in_({video_id for _, video_id, _ in views}))
+    )
+    hashtags = defaultdict(list)
+    for video_id, hashtag_id in result.all():
+        hashtags[video_id].append(hashtag_id)
+
+    increments = defaultdict(float)
+    for user_id, video_id, count in views:
+        for hashtag_id in hashtags[video_id]:
+            increments[(user_id, hashtag_id)] += view_weight * count
+    if not increments:
+        return
+
+    result = await db.execute(
+        select(UserPreference).where(
+            UserPreference.user_id.in_({user_id for user_id, _ in increments}),
+            UserPreference.hashtag_id.in_({hashtag_id for _, hashtag_id in increments})
+        )
+    )
+    for preference in result.scalars().all():
+        increment = increments.pop((preference.user_id, preference.hashtag_id), None)
+        if increment is not None:
+            preference.weight += increment
+
+    db.add_all(
+        UserPreference(user_id=user_id, hashtag_id=hashtag_id, weight=increment)
+        for (user_id, hashtag_id), increment in increments.items()
+    )
+    await db.commit()
+
 async def get_user_preferences(db: AsyncSession, user_id: int) -> List[UserPreference]:
     result = await db.execute(
         select(UserPreference).where(UserPreference.user_id == user_id).order_by(UserPreference.weight.desc())
@@ -970,6 +1153,22 @@ async def get_default_videos(db: AsyncSession, offset: int, limit: int) -> List[
 
 
 
+async def get_user_media_references(db: AsyncSession, user_id: int):
+    user_result = await db.execute(select(User.profile_extension).where(User.id == user_id))
+    profile_extension = user_result.scalar_one_or_none()
+
+    videos_result = await db.execute(
+        select(Video.id, Video.video_extension, Video.miniature_extension).where(Video.owner_id == user_id)
+    )
+
+    return {
+        "profile_extension": profile_extension,
+        "videos": [
+            {"id": video_id, "video_extension": video_extension, "miniature_extension": miniature_extension}
+            for video_id, video_extension, miniature_extension in videos_result.all()
+        ]
+    }
+
 async def delete_account(db: AsyncSession, user_id: int):
     try:
         await db.execute(delete(user_video_favorites).where(user_video_favorites.c.user_id == user_id))
@@ -982,6 +1181,13 @@ async def delete_account(db: AsyncSession, user_id: int):
 
         await db.execute(delete(UserPreference).where(UserPreference.user_id == user_id))
 
+        profile_result = await db.execute(select(User.profile_sha256).where(User.id == user_id))
+        await release_media_blob(db, profile_result.scalar_one_or_none())
+        videos_result = await db.execute(select(Video.video_sha256, Video.miniature_sha256).where(Video.owner_id == user_id))
+        for video_sha256, miniature_sha256 in videos_result.all():
+            await release_media_blob(db, video_sha256)
+            await release_media_blob(db, miniature_sha256)
+
         user = await db.get(User, user_id)
         if user:
             await db.delete(user)
@@ -1025,10 +1231,7 @@ async def accept_followup(db: AsyncSession, user_id: int, followup_id: int, foll
         .values(user_id=follower_id, channel_id=user_id)
     )
 
-    await db.execute(update(User)
-        .where(User.id == user_id)
-        .values(subscribers_count=User.subscribers_count + 1)
-    )
+    await db.execute(adjust_counter(User, "subscribers_count", user_id, 1))
     await db.commit()
     return {"success": "The followup has been accepted successfully"}
 
@@ -1039,47 +1242,48 @@ async def deny_followup(db: AsyncSession, user_id: int, followup_id: int):
     return {"success": "The followup has been denied successfully"}
 
 
-async def get_contacts(db: AsyncSession, user_id: int):
-
-    subscription_results = await db.execute(select(user_subscriptions).where(user_subscriptions.c.user_id == user_id))
-    subscriptions = subscription_results.all()
+def mutual_subscriptions(user_id: int):
+    # One self join: channels the user subscribes to that subscribe back
+    reverse = user_subscriptions.alias("reverse_subscriptions")
+    return (
+        select(user_subscriptions.c.channel_id)
+        .join(
+            reverse,
+            and_(
+                reverse.c.user_id == user_subscriptions.c.channel_id,
+                reverse.c.channel_id == user_subscriptions.c.user_id
+            )
+        )
+        .where(user_subscriptions.c.user_id == user_id)
+    )
 
-    contacts = []
+async def get_mutual_subscription_ids(db: AsyncSession, user_id: int) -> List[int]:
+    result = await db.execute(mutual_subscriptions(user_id))
+    return list(result.scalars().all())
 
-    for sub in subscriptions:
-        subscription_result = await db.execute(select(user_subscriptions).where(user_subscriptions.c.user_id == sub[1]))
-        subscription = subscription_result.scalars().first()
+async def delete_user_subscriptions(db: AsyncSession, user_id: int) -> List[int]:
+    # Ends every subscription of an account being deleted, returns the
+    # contacts it had. The caller commits
+    contact_ids = await get_mutual_subscription_ids(db=db, user_id=user_id)
+    await db.execute(delete(user_subscriptions).where(user_subscriptions.c.user_id == user_id))
+    await db.execute(delete(user_subscriptions).where(user_subscriptions.c.channel_id == user_id))
+    return contact_ids
 
-        if subscription:
-            contact_result = await db.execute(select(User).where(User.id == subscription))
-            contact = contact_result.scalars().first()
-            contacts.append(contact)
+async def get_contacts(db: AsyncSession, user_id: int):
+    contacts = mutual_subscriptions(user_id).subquery()
+    result = await db.execute(select(User.id, User.username).join(contacts, contacts.c.channel_id == User.id))
 
     return {
         "contacts" : [
             {
-                "id": contact.id,
-                "username": contact.username,
+                "id": contact_id,
+                "username": username,
             }
-            for contact in contacts
+            for contact_id, username in result.all()
         ]
     }
 
 
-async def check_chat_permission(db: AsyncSession, user_id: int, destination_id: int):
-
-    first_subscription_result = await db.execute(select(user_subscriptions).where(and_(user_subscriptions.c.user_id == user_id, user_subscriptions.c.channel_id == destination_id)))
-    first_subscription = first_subscription_result.first()
-
-    second_subscription_result = await db.execute(select(user_subscriptions).where(and_(user_subscriptions.c.user_id == destination_id, user_subscriptions.c.channel_id == user_id)))
-    second_subscription = second_subscription_result.first()
-
-    if first_subscription and second_subscription:
-        return True
-    
-    return False
-
-
 async def get_chat_data(db: AsyncSession, user_id: int, destination_id: int, offset: int):
     
     messages_result = await db.execute(
@@ -1139,24 +1343,3 @@ async def set_presence(db: AsyncSession, user_id: int, status):
 
     await db.execute(update(User).where(User.id == user_id).values(online=status, last_time_active=datetime.now()))
     await db.commit()
-
-async def get_contact_ids_list(db: AsyncSession, user_id: int):
-
-    subscription_results = await db.execute(select(user_subscriptions).where(user_subscriptions.c.user_id == user_id))
-    subscriptions = subscription_results.all()
-
-    contacts = []
-
-    for sub in subscriptions:
-        subscription_result = await db.execute(select(user_subscriptions).where(user_subscriptions.c.user_id == sub[1]))
-        subscription = subscription_result.scalars().first()
-
-        if subscription:
-            contact_result = await db.execute(select(User).where(User.id == subscription))
-            contact = contact_result.scalars().first()
-            contacts.append(contact)
-    
-    return [
-        contact.id
-        for contact in contacts
-    ]
\ No newline at end of file
@@ -1,7 +1,7 @@
-from fastapi import Cookie, Request, UploadFile
+from fastapi import Cookie, Request
 from typing import Optional
 from fastapi.responses import RedirectResponse
-from auth import verify_token
+from auth import verify_session_token
 from datetime import datetime, timedelta
 
 def require_authenticated_user():
@@ -12,7 +12,7 @@ def require_authenticated_user():
         if not session_token:
             return RedirectResponse(url="/login", status_code=302)
         
-        token_data = verify_token(session_token)
+        token_data = verify_session_token(session_token)
         if not token_data:
             return RedirectResponse(url="/login", status_code=302)
         
@@ -28,19 +28,13 @@ def redirect_if_authenticated(redirect_to="/home"):
         if not session_token:
             return None
         
-        token_data = verify_token(session_token)
+        token_data = verify_session_token(session_token)
         if token_data:
             return RedirectResponse(url=redirect_to, status_code=302)
         
         return None
     return dependency
 
-async def save_upload_file(upload_file: UploadFile, destination_path: str):
-    with open(destination_path, "wb") as out_file:
-        content = await upload_file.read()
-        out_file.write(content)
-
-
 def pretty_date(date) -> str:
     if isinstance(date, str):
         try:
@@ -0,0 +1,115 @@
+import asyncio
+import multiprocessing
+import secrets
+import shutil
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple, Union
+from PIL import Image, ImageOps, UnidentifiedImageError
+from media_layout import (
+    existing_media_directory, legacy_media_directory, media_directory, remove_legacy_directory, replace_directory
+)
+from config import IMAGE_PROCESS_WORKERS, IMAGE_MAX_PIXELS
+
+DERIVATIVE_SIZES = (64, 160, 320, 640)
+
+DERIVATIVE_MEDIA_TYPES = {
+    "webp": "image/webp",
+    "jpeg": "image/jpeg"
+}
+
+image_pool: Optional[ProcessPoolExecutor] = None
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global image_pool
+    if image_pool is None:
+        # spawn keeps the children away from the event loop and DB pool of the parent
+        image_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return image_pool
+
+
+def open_image(path: str) -> Image.Image:
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", Image.DecompressionBombWarning)
+        try:
+            image = Image.open(path)
+            image.load()
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+            raise InvalidImage(str(e)) from e
+    return image
+
+
+def decode_image(path: str) -> Tuple[int, int]:
+    with open_image(path) as image:
+        return image.size
+
+
+def render_derivatives(source_path: str, output_dir: str):
+    output = Path(output_dir)
+    output.mkdir(parents=True, exist_ok=True)
+
+    with open_image(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+        for size in DERIVATIVE_SIZES:
+            derivative = image.copy()
+            derivative.thumbnail((size, size), Image.Resampling.LANCZOS)
+            derivative.save(output / f"{size}.webp", "WEBP", quality=80, method=4)
+            if has_alpha:
+                # JPEG has no alpha channel, flatten over white
+                background = Image.new("RGB", derivative.size, (255, 255, 255))
+                background.paste(derivative, mask=derivative.getchannel("A"))
+                derivative = background
+            derivative.save(output / f"{size}.jpeg", "JPEG", quality=82, optimize=True, progressive=True)
+
+
+def derivatives_directory(kind: str, media_id: Union[int, str]) -> Path:
+    return media_directory(f"derivatives/{kind}", media_id)
+
+
+async def validate_image(path: Path):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_image_pool(), decode_image, str(path))
+
+
+async def generate_derivatives(kind: str, media_id: Union[int, str], source_path: str):
+    output_dir = derivatives_directory(kind, media_id)
+    work_dir = output_dir.with_name(f"{output_dir.name}.{secrets.token_hex(4)}.tmp")
+    await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(get_image_pool(), render_derivatives, source_path, str(work_dir))
+    except BaseException:
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+        raise
+    await asyncio.to_thread(replace_directory, work_dir, output_dir)
+
+
+async def remove_derivatives(kind: str, media_id: int):
+    await asyncio.to_thread(shutil.rmtree, derivatives_directory(kind, media_id), True)
+    await asyncio.to_thread(remove_legacy_directory, legacy_media_directory(f"derivatives/{kind}", media_id))
+
+
+def find_derivative(kind: str, media_id: Union[int, str], filename: str) -> Optional[Path]:
+    path = existing_media_directory(f"derivatives/{kind}", media_id) / filename
+    return path if path.exists() else None
+
+
+async def pick_derivative(kind: str, media_id: Union[int, str], size: int, accept: str) -> Optional[Tuple[Path, str]]:
+    # Smallest derivative that still covers the requested size
+    chosen_size = next((candidate for candidate in DERIVATIVE_SIZES if candidate >= size), DERIVATIVE_SIZES[-1])
+    image_format = "webp" if "image/webp" in accept else "jpeg"
+    path = await asyncio.to_thread(find_derivative, kind, media_id, f"{chosen_size}.{image_format}")
+    if path is None:
+        return None
+    return path, DERIVATIVE_MEDIA_TYPES[image_format]
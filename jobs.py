@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+from sqlalchemy import and_, delete, func, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from models import Job
+from config import JOB_LOCK_TIMEOUT, JOB_RETENTION, JOB_RETRY_BASE_DELAY, JOB_RETRY_MAX_DELAY
+
+JOB_HANDLERS: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+
+def job_handler(kind: str):
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+async def enqueue_job(
+    db: AsyncSession,
+    kind: str,
+    payload: dict,
+    user_id: Optional[int] = None,
+    delay: int = 0,
+    max_attempts: int = 5
+) -> Job:
+    now = datetime.now()
+    job = Job(
+        kind=kind,
+        payload=payload,
+        user_id=user_id,
+        status="queued",
+        attempts=0,
+        max_attempts=max_attempts,
+        run_at=now + timedelta(seconds=delay),
+        created_at=now
+    )
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def schedule_job(db: AsyncSession, kind: str, interval: int, payload: Optional[dict] = None) -> Optional[Job]:
+    # Periodic maintenance, enqueued unless one is pending or ran within the
+    # interval. The advisory lock keeps workers checking at the same time from
+    # both enqueueing it
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"schedule_job:{kind}"))))
+    result = await db.execute(
+        select(Job.id)
+        .where(
+            Job.kind == kind,
+            or_(Job.status.in_(["queued", "running"]), Job.created_at > datetime.now() - timedelta(seconds=interval))
+        )
+        .limit(1)
+    )
+    if result.first():
+        await db.commit()
+        return None
+    return await enqueue_job(db, kind, payload or {})
+
+
+async def claim_job(db: AsyncSession) -> Optional[Job]:
+    now = datetime.now()
+
+    # SKIP LOCKED lets any number of workers poll the same table without
+    # blocking on each other or claiming the same row
+    candidate = (
+        select(Job.id)
+        .where(
+            or_(
+                and_(Job.status == "queued", Job.run_at <= now),
+                and_(Job.status == "running", Job.locked_at < now - timedelta(seconds=JOB_LOCK_TIMEOUT))
+            )
+        )
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+
+    result = await db.execute(
+        update(Job)
+        .where(Job.id == candidate)
+        .values(status="running", locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job)
+        .execution_options(synchronize_session=False)
+    )
+    job = result.scalars().first()
+    await db.commit()
+    return job
+
+
+def owned_by(job: Job):
+    # attempts goes up with every claim, a job reclaimed after its lock timed
+    # out no longer matches the worker that claimed it before
+    return and_(Job.id == job.id, Job.status == "running", Job.attempts == job.attempts)
+
+
+async def heartbeat_job(db: AsyncSession, job: Job) -> bool:
+    result = await db.execute(
+        update(Job)
+        .where(owned_by(job))
+        .values(locked_at=datetime.now())
+        .returning(Job.id)
+    )
+    owned = result.first() is not None
+    await db.commit()
+    return owned
+
+
+async def complete_job(db: AsyncSession, job: Job) -> bool:
+    result = await db.execute(
+        update(Job)
+        .where(owned_by(job))
+        .values(status="done", locked_at=None, last_error=None, finished_at=datetime.now())
+        .returning(Job.id)
+    )
+    owned = result.first() is not None
+    await db.commit()
+    return owned
+
+
+def retry_delay(attempts: int) -> int:
+    return min(JOB_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), JOB_RETRY_MAX_DELAY)
+
+
+async def fail_job(db: AsyncSession, job: Job, error: str) -> bool:
+    now = datetime.now()
+
+    if job.attempts >= job.max_attempts:
+        values = {"status": "failed", "finished_at": now}
+    else:
+        values = {"status": "queued", "run_at": now + timedelta(seconds=retry_delay(job.attempts))}
+
+    result = await db.execute(
+        update(Job)
+        .where(owned_by(job))
+        .values(locked_at=None, last_error=error[-4000:], **values)
+        .returning(Job.id)
+    )
+    owned = result.first() is not None
+    await db.commit()
+    return owned
+
+
+async def purge_finished_jobs(db: AsyncSession):
+    await db.execute(
+        delete(Job).where(
+            and_(
+                Job.status.in_(["done", "failed"]),
+                Job.finished_at < datetime.now() - timedelta(seconds=JOB_RETENTION)
+            )
+        )
+    )
+    await db.commit()
+
+
+async def get_job_status(db: AsyncSession, job_id: int, user_id: int):
+    result = await db.execute(select(Job).where(and_(Job.id == job_id, Job.user_id == user_id)))
+    job = result.scalars().first()
+
+    if not job:
+        return {"error": "Job not found"}
+
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
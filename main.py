@@ -1,8 +1,26 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from routers import login, register, home, profile, video, default, media, dashboard, editVideo, settings, mail, chat, presence
+from routers import login, register, home, profile, video, default, media, dashboard, editVideo, settings, mail, chat, presence, resumable, jobStatus
+from view_counter import view_counter
+from block_cache import block_cache
+from config import BLOCK_CACHE_STATS_INTERVAL
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = asyncio.Event()
+    background = [asyncio.create_task(view_counter.run(stop))]
+    if block_cache.enabled and BLOCK_CACHE_STATS_INTERVAL > 0:
+        background.append(asyncio.create_task(block_cache.report(stop, BLOCK_CACHE_STATS_INTERVAL)))
+    yield
+    stop.set()
+    view_counter.wake()
+    await asyncio.gather(*background)
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -18,4 +36,6 @@ app.include_router(editVideo.router)
 app.include_router(settings.router)
 app.include_router(mail.router)
 app.include_router(chat.router)
-app.include_router(presence.router)
\ No newline at end of file
+app.include_router(presence.router)
+app.include_router(resumable.router)
+app.include_router(jobStatus.router)
\ No newline at end of file
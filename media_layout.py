@@ -0,0 +1,88 @@
+import hashlib
+import re
+import shutil
+from pathlib import Path
+from typing import List, Union
+
+MEDIA_ROOT = Path("media")
+
+VIDEOS_DIRECTORY = "videos"
+MINIATURES_DIRECTORY = "miniatures"
+PROFILES_DIRECTORY = "profiles"
+HLS_DIRECTORY = "hls"
+PREVIEWS_DIRECTORY = "previews"
+BLOBS_DIRECTORY = "blobs"
+
+SHARD_PATTERN = re.compile(r"^[0-9a-f]{2}$")
+
+# Flat directories written before sharding, the migration tool walks these
+FLAT_FILE_DIRECTORIES = (VIDEOS_DIRECTORY, MINIATURES_DIRECTORY, PROFILES_DIRECTORY)
+FLAT_TREE_DIRECTORIES = (HLS_DIRECTORY, PREVIEWS_DIRECTORY, "derivatives/miniature", "derivatives/profile")
+
+
+def shard(media_id: Union[int, str]) -> Path:
+    # Two levels of hex fan-out (65536 leaves), hashed so sequential ids spread
+    # evenly instead of filling one directory at a time
+    digest = hashlib.md5(str(media_id).encode()).hexdigest()
+    return Path(digest[:2], digest[2:4])
+
+
+def media_file(directory: str, media_id: int, extension: str) -> Path:
+    return MEDIA_ROOT / directory / shard(media_id) / f"{media_id}{extension}"
+
+
+def legacy_media_file(directory: str, media_id: int, extension: str) -> Path:
+    return MEDIA_ROOT / directory / f"{media_id}{extension}"
+
+
+def blob_file(sha256: str) -> Path:
+    # Already uniformly distributed, the digest is its own shard. No extension,
+    # the same bytes may have been uploaded under different names
+    return MEDIA_ROOT / BLOBS_DIRECTORY / sha256[:2] / sha256[2:4] / sha256
+
+
+def media_directory(directory: str, media_id: Union[int, str]) -> Path:
+    return MEDIA_ROOT / directory / shard(media_id) / str(media_id)
+
+
+def legacy_media_directory(directory: str, media_id: Union[int, str]) -> Path:
+    return MEDIA_ROOT / directory / str(media_id)
+
+
+def existing_media_directory(directory: str, media_id: Union[int, str]) -> Path:
+    # Readers fall back to the flat layout until the migration has moved it
+    path = media_directory(directory, media_id)
+    if not path.exists():
+        legacy = legacy_media_directory(directory, media_id)
+        if legacy.exists():
+            return legacy
+    return path
+
+
+def legacy_children(path: Path) -> List[Path]:
+    # A two digit id shares its name with a shard directory, anything shaped
+    # like a shard belongs to the new layout and must be left alone
+    if not path.is_dir():
+        return []
+    return [child for child in path.iterdir() if not (child.is_dir() and SHARD_PATTERN.match(child.name))]
+
+
+def replace_directory(source: Path, destination: Path):
+    # Swaps a finished work directory into place
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists():
+        shutil.rmtree(destination)
+    source.rename(destination)
+
+
+def remove_legacy_directory(path: Path):
+    for child in legacy_children(path):
+        if child.is_dir():
+            shutil.rmtree(child, ignore_errors=True)
+        else:
+            child.unlink(missing_ok=True)
+    try:
+        path.rmdir()
+    except OSError:
+        # Missing, or still holding shard directories of the new layout
+        pass
@@ -0,0 +1,148 @@
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from crud import get_miniature_media_by_video_id, get_user_profile_media, get_video_media_by_id
+from storage import storage
+from ttl_cache import TTLCache
+from media_layout import (
+    MINIATURES_DIRECTORY, PROFILES_DIRECTORY, VIDEOS_DIRECTORY, blob_file, existing_media_directory, legacy_media_file,
+    media_directory, media_file
+)
+from config import MEDIA_LOCATOR_CACHE_SIZE, MEDIA_LOCATOR_TTL
+
+VIDEO_EXTENSION_TO_MEDIA_TYPE = {
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".mkv": "video/x-matroska",
+    ".avi": "video/x-msvideo",
+    ".webm": "video/webm"
+}
+
+IMAGE_EXTENSION_TO_MEDIA_TYPE = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp"
+}
+
+DEFAULT_MINIATURE = Path("media/miniatures/default.png")
+DEFAULT_PROFILE_PICTURE = Path("media/profiles/default.jpg")
+
+
+class MediaLocation(NamedTuple):
+    path: Path
+    media_type: str
+    # Set for content addressed files, derived media (HLS, previews,
+    # derivatives) is keyed by it instead of the row id
+    sha256: Optional[str] = None
+
+
+class MediaLocator(TTLCache):
+    # Keyed by (kind, id), kind being "video", "miniature" or "profile"
+    def get(self, kind: str, media_id: int) -> Optional[MediaLocation]:
+        return super().get((kind, media_id))
+
+    def put(self, kind: str, media_id: int, location: MediaLocation):
+        super().put((kind, media_id), location)
+
+    def invalidate(self, kind: str, media_id: int):
+        super().invalidate((kind, media_id))
+
+locator = MediaLocator(max_entries=MEDIA_LOCATOR_CACHE_SIZE, ttl=MEDIA_LOCATOR_TTL)
+
+
+async def probe_blob(sha256: str, extension: Optional[str], known_types: Dict[str, str]) -> Optional[MediaLocation]:
+    media_type = known_types.get((extension or "").lower())
+    path = blob_file(sha256)
+    if not media_type or not await storage.exists(path):
+        return None
+    return MediaLocation(path, media_type, sha256)
+
+
+async def probe(directory: str, media_id: int, extension: Optional[str], known_types: Dict[str, str]) -> Optional[MediaLocation]:
+    candidates: List[str] = []
+    if extension:
+        candidates.append(extension.lower())
+    # The stored extension is the fast path, the rest only runs for rows whose
+    # file was saved under a different extension. An object store would answer
+    # each of them with a HEAD request, there the stored extension is all we try
+    if storage.cheap_lookups:
+        candidates.extend(ext for ext in known_types if ext not in candidates)
+
+    for ext in candidates:
+        media_type = known_types.get(ext)
+        if not media_type:
+            continue
+        for candidate in (media_file(directory, media_id, ext), legacy_media_file(directory, media_id, ext)):
+            if await storage.exists(candidate):
+                return MediaLocation(candidate, media_type)
+
+    return None
+
+
+async def locate_video(db: AsyncSession, video_id: int) -> Optional[MediaLocation]:
+    location = locator.get("video", video_id)
+    if location:
+        return location
+
+    media = await get_video_media_by_id(db=db, video_id=video_id)
+    if not media:
+        return None
+    extension, sha256 = media
+    if sha256:
+        location = await probe_blob(sha256, extension, VIDEO_EXTENSION_TO_MEDIA_TYPE)
+    else:
+        location = await probe(VIDEOS_DIRECTORY, video_id, extension, VIDEO_EXTENSION_TO_MEDIA_TYPE)
+    if location:
+        locator.put("video", video_id, location)
+    return location
+
+
+async def locate_video_directory(db: AsyncSession, video_id: int, directory: str) -> Path:
+    # Derived media of content addressed videos is shared by every upload of the
+    # same bytes. The hash comes from the row, the faststart job moves a video to
+    # a new blob and the cached location of another worker would still point at
+    # the old one
+    media = await get_video_media_by_id(db=db, video_id=video_id)
+    sha256 = media[1] if media else None
+    location = locator.get("video", video_id)
+    if location and location.sha256 != sha256:
+        locator.invalidate("video", video_id)
+    if sha256:
+        return media_directory(directory, sha256)
+    return existing_media_directory(directory, video_id)
+
+
+async def locate_miniature(db: AsyncSession, video_id: int) -> MediaLocation:
+    location = locator.get("miniature", video_id)
+    if location:
+        return location
+
+    media = await get_miniature_media_by_video_id(db=db, video_id=video_id)
+    extension, sha256 = media or (None, None)
+    if sha256:
+        location = await probe_blob(sha256, extension, IMAGE_EXTENSION_TO_MEDIA_TYPE)
+    else:
+        location = await probe(MINIATURES_DIRECTORY, video_id, extension or None, IMAGE_EXTENSION_TO_MEDIA_TYPE)
+    if not location:
+        location = MediaLocation(DEFAULT_MINIATURE, "image/png")
+    locator.put("miniature", video_id, location)
+    return location
+
+
+async def locate_profile_picture(db: AsyncSession, user_id: int) -> MediaLocation:
+    location = locator.get("profile", user_id)
+    if location:
+        return location
+
+    media = await get_user_profile_media(db=db, user_id=user_id)
+    extension, sha256 = media or (None, None)
+    location = None
+    if sha256:
+        location = await probe_blob(sha256, extension, IMAGE_EXTENSION_TO_MEDIA_TYPE)
+    elif extension:
+        location = await probe(PROFILES_DIRECTORY, user_id, extension, IMAGE_EXTENSION_TO_MEDIA_TYPE)
+    if not location:
+        location = MediaLocation(DEFAULT_PROFILE_PICTURE, "image/jpeg")
+    locator.put("profile", user_id, location)
+    return location
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Iterator, Tuple
+from media_layout import (
+    BLOBS_DIRECTORY, FLAT_FILE_DIRECTORIES, FLAT_TREE_DIRECTORIES, MEDIA_ROOT, SHARD_PATTERN, legacy_children,
+    media_directory, media_file, remove_legacy_directory
+)
+from config import MEDIA_LOCATOR_TTL, STORAGE_BACKEND
+
+LEGACY_FILE_PATTERN = re.compile(r"^(\d+)(\.\w+)$")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Web workers may still hold a legacy path in their locator cache, so old
+# links are only removed once every cached entry has expired
+DEFAULT_GRACE = MEDIA_LOCATOR_TTL + 60
+
+
+def iter_legacy_files() -> Iterator[Tuple[str, int, str, Path]]:
+    for directory in FLAT_FILE_DIRECTORIES:
+        root = MEDIA_ROOT / directory
+        if not root.is_dir():
+            continue
+        with os.scandir(root) as entries:
+            for entry in entries:
+                match = LEGACY_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file(follow_symlinks=False):
+                    yield directory, int(match.group(1)), match.group(2), Path(entry.path)
+
+
+def iter_legacy_trees() -> Iterator[Tuple[str, int, Path]]:
+    for directory in FLAT_TREE_DIRECTORIES:
+        root = MEDIA_ROOT / directory
+        if not root.is_dir():
+            continue
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.name.isdigit() and entry.is_dir(follow_symlinks=False):
+                    yield directory, int(entry.name), Path(entry.path)
+
+
+def link_file(source: Path, destination: Path):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    if destination.exists() and os.path.samefile(source, destination):
+        return
+    temp_path = destination.with_name(f"{destination.name}.migrating")
+    temp_path.unlink(missing_ok=True)
+    os.link(source, temp_path)
+    os.replace(temp_path, destination)
+
+
+def link_tree(source: Path, destination: Path):
+    # Hard links into a scratch directory that is renamed into place, readers
+    # see either the complete legacy tree or the complete sharded one
+    temp_dir = destination.with_name(f"{destination.name}.migrating")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True)
+    for child in legacy_children(source):
+        if child.is_dir():
+            shutil.copytree(child, temp_dir / child.name, copy_function=os.link)
+        else:
+            os.link(child, temp_dir / child.name)
+    os.rename(temp_dir, destination)
+
+
+def run_pending(pending: Deque[Tuple[float, Callable[[], None]]], wait: bool):
+    while pending:
+        deadline, remove = pending[0]
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            if not wait:
+                return
+            time.sleep(delay)
+        pending.popleft()
+        try:
+            remove()
+        except OSError as e:
+            print(f"Error removing legacy media: {e}")
+
+
+def migrate(batch_size: int, pause: float, grace: float, dry_run: bool):
+    pending: Deque[Tuple[float, Callable[[], None]]] = deque()
+    moved = 0
+
+    def throttle():
+        nonlocal moved
+        moved += 1
+        if moved % batch_size == 0:
+            print(f"Migrated {moved} items")
+            run_pending(pending, wait=False)
+            time.sleep(pause)
+
+    for directory, media_id, extension, source in iter_legacy_files():
+        destination = media_file(directory, media_id, extension)
+        if dry_run:
+            print(f"{source} -> {destination}")
+            continue
+        try:
+            link_file(source, destination)
+        except OSError as e:
+            print(f"Error migrating {source}: {e}")
+            continue
+        pending.append((time.monotonic() + grace, lambda path=source: path.unlink(missing_ok=True)))
+        throttle()
+
+    for directory, media_id, source in iter_legacy_trees():
+        destination = media_directory(directory, media_id)
+        if not legacy_children(source):
+            continue
+        if dry_run:
+            print(f"{source}/ -> {destination}/")
+            continue
+        try:
+            if not destination.exists():
+                link_tree(source, destination)
+        except OSError as e:
+            print(f"Error migrating {source}: {e}")
+            continue
+        pending.append((time.monotonic() + grace, lambda path=source: remove_legacy_directory(path)))
+        throttle()
+
+    if pending:
+        print(f"Migrated {moved} items, waiting {grace:.0f}s before removing the legacy copies")
+    run_pending(pending, wait=True)
+    print(f"Done, {moved} items migrated")
+
+
+def iter_shard_files(root: Path, pattern: re.Pattern) -> Iterator[Path]:
+    for first in sorted(root.iterdir()) if root.is_dir() else []:
+        if not SHARD_PATTERN.match(first.name) or not first.is_dir():
+            continue
+        for second in sorted(first.iterdir()):
+            if not SHARD_PATTERN.match(second.name) or not second.is_dir():
+                continue
+            for path in sorted(second.iterdir()):
+                if pattern.match(path.name) and path.is_file():
+                    yield path
+
+
+def iter_stored_files() -> Iterator[Path]:
+    # Everything the storage backend serves: originals in either layout and
+    # content addressed blobs. Derived media (HLS, previews, derivatives)
+    # always stays on local disk
+    for directory in FLAT_FILE_DIRECTORIES:
+        yield from iter_shard_files(MEDIA_ROOT / directory, LEGACY_FILE_PATTERN)
+    for _, _, _, path in iter_legacy_files():
+        yield path
+    yield from iter_shard_files(MEDIA_ROOT / BLOBS_DIRECTORY, SHA256_PATTERN)
+
+
+async def upload_to_storage(target, batch_size: int, pause: float, dry_run: bool) -> dict:
+    # Copies local media into the object store under the same keys, local
+    # files are kept until the switch to STORAGE_BACKEND=s3 is confirmed
+    uploaded = skipped = failed = 0
+    for path in iter_stored_files():
+        try:
+            if await target.exists(path):
+                skipped += 1
+                continue
+            if dry_run:
+                print(f"{path} -> {target.key(path)}")
+                continue
+            await target.put_file(path, path)
+        except Exception as e:
+            print(f"Error uploading {path}: {e}")
+            failed += 1
+            continue
+        uploaded += 1
+        if uploaded % batch_size == 0:
+            print(f"Uploaded {uploaded} files")
+            await asyncio.sleep(pause)
+
+    print(f"Done, {uploaded} files uploaded, {skipped} already in the bucket, {failed} failed")
+    return {"uploaded": uploaded, "skipped": skipped, "failed": failed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Moves media from the flat layout into hashed shard directories while the site keeps serving it")
+    parser.add_argument("--batch-size", type=int, default=500, help="Items migrated between pauses")
+    parser.add_argument("--pause", type=float, default=0.5, help="Seconds to sleep between batches")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GRACE, help="Seconds both copies stay readable before the legacy one is removed")
+    parser.add_argument("--to-storage", action="store_true", help="Upload local originals and blobs to the S3 bucket instead (STORAGE_BACKEND=s3)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if args.to_storage:
+        if STORAGE_BACKEND != "s3":
+            parser.error("--to-storage needs STORAGE_BACKEND=s3 and the S3_* settings of the target bucket")
+        from storage import storage
+        asyncio.run(upload_to_storage(storage, args.batch_size, args.pause, args.dry_run))
+    else:
+        migrate(args.batch_size, args.pause, args.grace, args.dry_run)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Float, Integer, String, ForeignKey, Boolean, DateTime, Table
+from sqlalchemy import JSON, BigInteger, Column, Float, Index, Integer, SmallInteger, String, ForeignKey, Boolean, DateTime, Table
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from database import Base
@@ -56,6 +56,7 @@ class User(Base):
     subscribers_count = Column(Integer, default=0, server_default="0", nullable=False)
     biography = Column(String)
     profile_extension = Column(String)
+    profile_sha256 = Column(String(64), ForeignKey("media_blobs.sha256"), nullable=True)
     private_account = Column(Boolean, default=False, nullable=False)
     last_time_active = Column(DateTime)
     online = Column(Boolean, default=False)
@@ -123,6 +124,9 @@ class Video(Base):
     views = Column(Integer, default=0, server_default="0", nullable=False)
     likes = Column(Integer, default=0, server_default="0", nullable=False)
     dislikes = Column(Integer, default=0, server_default="0", nullable=False)
+    hls_status = Column(String, nullable=True)
+    video_sha256 = Column(String(64), ForeignKey("media_blobs.sha256"), nullable=True)
+    miniature_sha256 = Column(String(64), ForeignKey("media_blobs.sha256"), nullable=True)
 
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="videos")
@@ -214,4 +218,53 @@ class PrivateMessage(Base):
     recipient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
 
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
-    recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
\ No newline at end of file
+    recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    status = Column(String, nullable=False, default="queued", server_default="queued")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    max_attempts = Column(Integer, nullable=False, default=5, server_default="5")
+    last_error = Column(String)
+    run_at = Column(DateTime, nullable=False)
+    locked_at = Column(DateTime)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    # Content address of an uploaded file, shared by every row that uploaded the same bytes
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, nullable=False)
+    released_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_media_blobs_refcount_released_at", "refcount", "released_at"),
+    )
+
+
+class CounterShard(Base):
+    __tablename__ = "counter_shards"
+
+    # Pending delta for one counter column (videos.likes, users.subscribers_count, ...),
+    # writers pick a random slot so a hot row isn't a single lock
+    table_name = Column(String(32), primary_key=True)
+    row_id = Column(Integer, primary_key=True)
+    field = Column(String(32), primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    delta = Column(BigInteger, nullable=False, default=0, server_default="0")
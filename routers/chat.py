@@ -5,9 +5,10 @@ from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from functions import require_authenticated_user, pretty_date
-from auth import verify_token
+from auth import verify_session_token
 from schemas import ChatId, SendMessage, ContactData
-from crud import check_chat_permission, get_chat_data, send_message, get_contact_data
+from crud import get_chat_data, send_message, get_contact_data
+from contacts import check_chat_permission
 
 router = APIRouter()
 
@@ -102,7 +103,7 @@ async def websocket_chat(websocket: WebSocket):
     if not token:
         await websocket.close(code=1008)
         return
-    user_data = verify_token(token)
+    user_data = verify_session_token(token)
     if not user_data:
         await websocket.close(code=1008)
         return
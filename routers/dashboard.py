@@ -1,17 +1,19 @@
-import os
-import re
 from fastapi import APIRouter, Depends, File, Form, UploadFile
 from fastapi.responses import JSONResponse, RedirectResponse, FileResponse
-from functions import require_authenticated_user, save_upload_file
-from crud import upload_video, get_videos_by_user_id
+from functions import require_authenticated_user
+from uploads import UploadTooLarge, discard_upload, publish_video, receive_upload, upload_route
+from images import InvalidImage, validate_image
+from crud import get_videos_by_user_id
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 
-router = APIRouter()
-
 MAX_VIDEO_SIZE = 10 * 1024 * 1024 * 1024
 MAX_IMAGE_SIZE = 200 * 1024 * 1024
 
+router = APIRouter(route_class=upload_route(
+    MAX_VIDEO_SIZE + MAX_IMAGE_SIZE, lambda request: JSONResponse({"error": 4}, status_code=413)
+))
+
 ALLOWED_VIDEO_TYPES = {"video/mp4", "video/quicktime", "video/x-matroska", "video/x-msvideo", "video/webm"}
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
 
@@ -52,30 +54,39 @@ async def post_upload_video(
     if video.content_type not in ALLOWED_VIDEO_TYPES:
         return {"error": 3}
 
-    video_bytes = await video.read()
-    if len(video_bytes) > MAX_VIDEO_SIZE:
-        return {"error": 4}
-    await video.seek(0)
-
     if miniature.content_type not in ALLOWED_IMAGE_TYPES:
         return {"error": 5}
-    image_bytes = await miniature.read()
-    if len(image_bytes) > MAX_IMAGE_SIZE:
+
+    try:
+        video_upload = await receive_upload(video, max_size=MAX_VIDEO_SIZE)
+    except UploadTooLarge:
+        return {"error": 4}
+
+    try:
+        miniature_upload = await receive_upload(miniature, max_size=MAX_IMAGE_SIZE)
+    except UploadTooLarge:
+        await discard_upload(video_upload)
         return {"error": 6}
-    await miniature.seek(0)
-    
-    video_extension = os.path.splitext(video.filename)[1]
-    miniature_extension = os.path.splitext(miniature.filename)[1]
-    title_hashtags = re.findall(r"#\w+", title)
-    description_hashtags = re.findall(r"#\w+", description)
-    hashtags = title_hashtags + description_hashtags
-    video_data =  await upload_video(db=db, user_id=user_id, title=title, description=description, video_extension=video_extension, miniature_extension=miniature_extension,
-                                     hashtags=hashtags)
 
-    await save_upload_file(video, f"media/videos/{video_data.id}{video_extension}")
-    await save_upload_file(miniature, f"media/miniatures/{video_data.id}{miniature_extension}")
+    try:
+        await validate_image(miniature_upload.path)
+    except InvalidImage:
+        await discard_upload(video_upload)
+        await discard_upload(miniature_upload)
+        return {"error": 5}
+    
+    video_data, job = await publish_video(
+        db=db,
+        user_id=user_id,
+        title=title,
+        description=description,
+        video_upload=video_upload,
+        video_filename=video.filename,
+        miniature_upload=miniature_upload,
+        miniature_filename=miniature.filename
+    )
 
-    return {"success": "The video has been uploaded successfully!"}
+    return {"success": "The video has been uploaded successfully!", "video_id": video_data.id, "job_id": job.id}
 
 @router.get("/API/my_videos")
 async def get_my_videos(data=Depends(require_authenticated_user()), db: AsyncSession=Depends(get_db)):
@@ -3,15 +3,23 @@ import re
 from typing import Optional
 from fastapi import APIRouter, Body, Depends, File, Form, UploadFile
 from fastapi.responses import RedirectResponse, FileResponse
-from functions import require_authenticated_user, save_upload_file
+from functions import require_authenticated_user
+from uploads import UploadTooLarge, discard_upload, receive_upload, store_blob, upload_route
 from schemas import VideoIdForm, EditVideoForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
+from media_locator import locator
+from media_layout import blob_file
+from images import InvalidImage, remove_derivatives, validate_image
+from jobs import enqueue_job
 from crud import check_if_user_is_video_owner_by_id, get_video_data_by_id, edit_video
 
-router = APIRouter()
-
 MAX_IMAGE_SIZE = 200 * 1024 * 1024
+
+# The edit form posts back to /edit_video?id=...
+router = APIRouter(route_class=upload_route(
+    MAX_IMAGE_SIZE, lambda request: RedirectResponse(f"/edit_video?id={request.query_params.get('id', '')}&error=4", status_code=302)
+))
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
 
 @router.get("/edit_video")
@@ -54,19 +62,24 @@ async def post_edit_video(
         return data
 
     miniature_extension = None
+    miniature_upload = None
 
     if miniature and miniature.filename:
         if miniature.content_type not in ALLOWED_IMAGE_TYPES:
             return RedirectResponse(f"/edit_video?id={form.id}&error=3", status_code=302)
         
-        image_bytes = await miniature.read()
-        if len(image_bytes) > MAX_IMAGE_SIZE:
+        try:
+            miniature_upload = await receive_upload(miniature, max_size=MAX_IMAGE_SIZE)
+        except UploadTooLarge:
             return RedirectResponse(f"/edit_video?id={form.id}&error=4", status_code=302)
-        
-        await miniature.seek(0)
-        miniature_extension = os.path.splitext(miniature.filename)[1]
 
-        await save_upload_file(miniature, f"media/miniatures/{form.id}{miniature_extension}")
+        try:
+            await validate_image(miniature_upload.path)
+        except InvalidImage:
+            await discard_upload(miniature_upload)
+            return RedirectResponse(f"/edit_video?id={form.id}&error=3", status_code=302)
+
+        miniature_extension = os.path.splitext(miniature.filename)[1]
 
     user_id = data["user_id"]
 
@@ -74,15 +87,38 @@ async def post_edit_video(
     description_hashtags = re.findall(r"#\w+", form.description)
     hashtags = title_hashtags + description_hashtags
 
-    result = await edit_video(
-        db=db,
-        user_id=user_id,
-        video_id=form.id,
-        title=form.title,
-        description=form.description,
-        miniature_extension=miniature_extension,
-        hashtags=hashtags
-    )
+    miniature_sha256 = None
+    try:
+        if miniature_upload:
+            miniature_sha256 = await store_blob(db, miniature_upload)
+        result = await edit_video(
+            db=db,
+            user_id=user_id,
+            video_id=form.id,
+            title=form.title,
+            description=form.description,
+            miniature_extension=miniature_extension,
+            hashtags=hashtags,
+            miniature_sha256=miniature_sha256
+        )
+    except Exception:
+        await db.rollback()
+        if miniature_upload:
+            await discard_upload(miniature_upload)
+        raise
+
+    if not result:
+        # Not the owner, the blob reference is dropped with the transaction
+        await db.rollback()
+    elif miniature_sha256:
+        locator.invalidate("miniature", form.id)
+        await remove_derivatives("miniature", form.id)
+        await enqueue_job(
+            db,
+            "generate_image_derivatives",
+            {"kind": "miniature", "media_id": miniature_sha256, "source_path": str(blob_file(miniature_sha256))},
+            user_id=user_id
+        )
 
     if result:
         return RedirectResponse("/dashboard", status_code=302)
\ No newline at end of file
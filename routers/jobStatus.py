@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from functions import require_authenticated_user
+from jobs import get_job_status
+
+router = APIRouter()
+
+@router.get("/API/jobs/{job_id}")
+async def get_job(job_id: int, data=Depends(require_authenticated_user()), db: AsyncSession=Depends(get_db)):
+
+    if isinstance(data, RedirectResponse):
+        return data
+    
+    user_id = data["user_id"]
+
+    return await get_job_status(db=db, job_id=job_id, user_id=user_id)
@@ -3,6 +3,7 @@ from fastapi.responses import RedirectResponse, FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from functions import require_authenticated_user
+from contacts import contact_cache
 from crud import get_contacts, mail_data, accept_followup, deny_followup
 from schemas import AcceptFollower, DenyFollower
 
@@ -44,9 +45,12 @@ async def post_accept_follow(
     
     user_id = data["user_id"]
 
-    return await accept_followup(db=db, user_id=user_id,
+    result = await accept_followup(db=db, user_id=user_id,
                                 followup_id=followup_data.id,
                                 follower_id=followup_data.follower_id)
+    contact_cache.invalidate(user_id, followup_data.follower_id)
+
+    return result
 
 @router.post("/deny_follow")
 async def post_deny_follow(
@@ -1,76 +1,117 @@
-from fastapi import APIRouter, Depends, Request, Response, Header
-from fastapi.responses import FileResponse, RedirectResponse
+import re
+from typing import Optional, Union
+import anyio
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from crud import get_user_profile_extension, stream_video_permission
+from crud import stream_video_permission
 from functions import require_authenticated_user
-from pathlib import Path as SysPath
+from auth import verify_stream_token
+from streaming import media_response
+from stream_scheduler import StreamLimitExceeded, stream_scheduler
+from media_locator import (
+    DEFAULT_MINIATURE, DEFAULT_PROFILE_PICTURE, MediaLocation, locate_miniature, locate_profile_picture, locate_video,
+    locate_video_directory
+)
+from storage import storage
+from images import pick_derivative
+from transcode import HLS_RENDITIONS, sign_playlist, sign_thumbnail_track
+from media_layout import HLS_DIRECTORY, PREVIEWS_DIRECTORY
+from config import IMAGE_CACHE_CONTROL, VIDEO_CACHE_CONTROL, HLS_CACHE_CONTROL, PREVIEW_CACHE_CONTROL, S3_PRESIGNED_URL_TTL
 
 router = APIRouter()
 
-EXTENSION_TO_MEDIA_TYPE = {
-    ".jpg": "image/jpeg",
-    ".jpeg": "image/jpeg",
-    ".png": "image/png",
-    ".webp": "image/webp"
-}
+HLS_FILENAME_PATTERN = re.compile(r"^[\w-]+\.(m3u8|m4s|mp4)$")
+PREVIEW_FILENAME_PATTERN = re.compile(r"^(thumbnails\.vtt|sprite_\d{3,}\.jpg)$")
+
+
+async def check_stream_permission(db: AsyncSession, user_id: int, video_id: int, token: Optional[str]):
+    if token and verify_stream_token(token, user_id=user_id, video_id=video_id):
+        return True
+    return await stream_video_permission(db=db, user_id=user_id, video_id=video_id)
+
+
+def presigned_redirect(location: MediaLocation) -> Optional[Response]:
+    # The bundled defaults are never uploaded to the object store
+    if location.path in (DEFAULT_MINIATURE, DEFAULT_PROFILE_PICTURE):
+        return None
+    url = storage.presigned_url(location.path, location.media_type)
+    if not url:
+        return None
+    # Reused by the browser only while the signature is still valid
+    return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={S3_PRESIGNED_URL_TTL // 2}"})
+
+
+async def derivative_response(request: Request, kind: str, media_id: Union[int, str], size: int):
+    derivative = await pick_derivative(kind, media_id, size, request.headers.get("accept", ""))
+    if not derivative:
+        return None
+    path, media_type = derivative
+    return media_response(
+        request,
+        path,
+        media_type=media_type,
+        headers={"Cache-Control": IMAGE_CACHE_CONTROL, "Vary": "Accept"}
+    )
+
 
 @router.get("/profile_picture/{user_id}")
-async def get_profile_picture(user_id: int, redirect=Depends(require_authenticated_user()), db: AsyncSession=Depends(get_db)):
+async def get_profile_picture(user_id: int, request: Request, size: Optional[int] = Query(None, ge=1), redirect=Depends(require_authenticated_user()), db: AsyncSession=Depends(get_db)):
 
     if isinstance(redirect, RedirectResponse):
         return redirect
 
-    extension = await get_user_profile_extension(db=db, user_id=user_id)
-    image_path = SysPath(f"media/profiles/{user_id}{extension}")
+    location = await locate_profile_picture(db=db, user_id=user_id)
+
+    if size:
+        response = await derivative_response(request, "profile", location.sha256 or user_id, size)
+        if response:
+            return response
 
-    if not image_path.exists():
-        image_path = SysPath("media/profiles/default.jpg")
-        media_type = "image/jpeg"
-    else:
-        media_type = EXTENSION_TO_MEDIA_TYPE.get(extension.lower(), "application/octet-stream")
+    presigned = presigned_redirect(location)
+    if presigned:
+        return presigned
 
-    return FileResponse(image_path, media_type=media_type)
+    return media_response(
+        request,
+        location.path,
+        media_type=location.media_type,
+        headers={"Cache-Control": IMAGE_CACHE_CONTROL}
+    )
 
 
 @router.get("/video_miniature/{video_id}")
-def get_miniature(video_id: int, redirect=Depends(require_authenticated_user())):
+async def get_miniature(video_id: int, request: Request, size: Optional[int] = Query(None, ge=1), redirect=Depends(require_authenticated_user()), db: AsyncSession=Depends(get_db)):
 
     if isinstance(redirect, RedirectResponse):
         return redirect
-    
-    allowed_extensions = ["jpg", "jpeg", "png", "webp"]
 
-    image_path = None
-    found_ext = None
+    location = await locate_miniature(db=db, video_id=video_id)
 
-    for ext in allowed_extensions:
-        candidate = SysPath(f"media/miniatures/{video_id}.{ext}")
-        if candidate.exists():
-            image_path = candidate
-            found_ext = ext
-            break
+    if size:
+        response = await derivative_response(request, "miniature", location.sha256 or video_id, size)
+        if response:
+            return response
 
-    if not image_path:
-        image_path = SysPath("media/miniatures/default.png")
-        found_ext = "png"
-    
-    mime_types = {
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "webp": "image/webp"
-    }
+    presigned = presigned_redirect(location)
+    if presigned:
+        return presigned
 
-    return FileResponse(image_path, media_type=mime_types.get(found_ext, "application/octet-stream"))
+    return media_response(
+        request,
+        location.path,
+        media_type=location.media_type,
+        headers={"Cache-Control": IMAGE_CACHE_CONTROL}
+    )
 
 
 @router.get("/video_stream/{video_id}")
 async def stream_video(
     video_id: int,
     request: Request,
+    token: Optional[str] = Query(None),
     data=Depends(require_authenticated_user()),
-    range: str = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
     if isinstance(data, RedirectResponse):
@@ -78,65 +119,122 @@ async def stream_video(
     
     user_id = data["user_id"]
 
-    allowed = await stream_video_permission(db=db, user_id=user_id, video_id=video_id)
+    allowed = await check_stream_permission(db=db, user_id=user_id, video_id=video_id, token=token)
+
+    if not allowed:
+        return {"error": "Not allowed to watch this content"}
+
+    location = await locate_video(db=db, video_id=video_id)
+
+    if not location:
+        return Response(status_code=404, content="Video no encontrado")
+
+    # The object store serves the bytes, nothing to admit or pace here
+    presigned = presigned_redirect(location)
+    if presigned:
+        return presigned
+
+    try:
+        stream_scheduler.admit(user_id)
+    except StreamLimitExceeded:
+        return Response(status_code=429, content="Too many streams", headers={"Retry-After": "5"})
+
+    try:
+        response = media_response(
+            request,
+            location.path,
+            media_type=location.media_type,
+            headers={"Cache-Control": VIDEO_CACHE_CONTROL}
+        )
+        return await stream_scheduler.schedule(user_id, response, location.path)
+    except BaseException:
+        stream_scheduler.release(user_id)
+        raise
+
+
+@router.get("/video_hls/{video_id}/{hls_path:path}")
+async def stream_hls(
+    video_id: int,
+    hls_path: str,
+    request: Request,
+    token: Optional[str] = Query(None),
+    data=Depends(require_authenticated_user()),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(data, RedirectResponse):
+        return data
+
+    user_id = data["user_id"]
+
+    allowed = await check_stream_permission(db=db, user_id=user_id, video_id=video_id, token=token)
 
     if not allowed:
         return {"error": "Not allowed to watch this content"}
 
-    ALLOWED_VIDEO_TYPES = {
-        "video/mp4", "video/quicktime", "video/x-matroska",
-        "video/x-msvideo", "video/webm"
-    }
-    mime_to_extensions = {
-        "video/mp4": ["mp4"],
-        "video/quicktime": ["mov"],
-        "video/x-matroska": ["mkv"],
-        "video/x-msvideo": ["avi"],
-        "video/webm": ["webm"]
-    }
-
-    video_path = None
-    found_ext = None
-    found_mime = None
-
-    for mime_type in ALLOWED_VIDEO_TYPES:
-        for ext in mime_to_extensions[mime_type]:
-            candidate = SysPath(f"media/videos/{video_id}.{ext}")
-            if candidate.exists():
-                video_path = candidate
-                found_ext = ext
-                found_mime = mime_type
-                break
-        if video_path:
-            break
-
-    if not video_path:
+    parts = hls_path.split("/")
+    valid_path = parts == ["master.m3u8"] or (
+        len(parts) == 2 and parts[0] in HLS_RENDITIONS and HLS_FILENAME_PATTERN.match(parts[1])
+    )
+    file_path = (await locate_video_directory(db=db, video_id=video_id, directory=HLS_DIRECTORY)).joinpath(*parts)
+
+    if not valid_path or not await anyio.Path(file_path).is_file():
         return Response(status_code=404, content="Video no encontrado")
 
-    file_size = video_path.stat().st_size
-    start = 0
-    end = file_size - 1
-
-    if range:
-        bytes_range = range.strip().lower().replace("bytes=", "")
-        if "-" in bytes_range:
-            start_str, end_str = bytes_range.split("-")
-            if start_str.strip():
-                start = int(start_str)
-            if end_str.strip():
-                end = int(end_str)
-
-    chunk_size = (end - start) + 1
-    with open(video_path, "rb") as video_file:
-        video_file.seek(start)
-        data = video_file.read(chunk_size)
-
-    headers = {
-        "Content-Range": f"bytes {start}-{end}/{file_size}",
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(chunk_size),
-        "Content-Type": found_mime or "application/octet-stream",
-        "Cache-Control": "no-store"
-    }
-
-    return Response(content=data, status_code=206, headers=headers)
+    if file_path.suffix == ".m3u8":
+        playlist = await anyio.Path(file_path).read_text()
+        if token:
+            playlist = sign_playlist(playlist, token)
+        return Response(
+            content=playlist,
+            media_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": VIDEO_CACHE_CONTROL}
+        )
+
+    return media_response(
+        request,
+        file_path,
+        media_type="video/mp4",
+        headers={"Cache-Control": HLS_CACHE_CONTROL}
+    )
+
+
+@router.get("/video_previews/{video_id}/{filename}")
+async def get_video_preview(
+    video_id: int,
+    filename: str,
+    request: Request,
+    token: Optional[str] = Query(None),
+    data=Depends(require_authenticated_user()),
+    db: AsyncSession = Depends(get_db)
+):
+    if isinstance(data, RedirectResponse):
+        return data
+
+    user_id = data["user_id"]
+
+    allowed = await check_stream_permission(db=db, user_id=user_id, video_id=video_id, token=token)
+
+    if not allowed:
+        return {"error": "Not allowed to watch this content"}
+
+    file_path = await locate_video_directory(db=db, video_id=video_id, directory=PREVIEWS_DIRECTORY) / filename
+
+    if not PREVIEW_FILENAME_PATTERN.match(filename) or not await anyio.Path(file_path).is_file():
+        return Response(status_code=404, content="Preview not found")
+
+    if file_path.suffix == ".vtt":
+        track = await anyio.Path(file_path).read_text()
+        if token:
+            track = sign_thumbnail_track(track, token)
+        return Response(
+            content=track,
+            media_type="text/vtt",
+            headers={"Cache-Control": VIDEO_CACHE_CONTROL}
+        )
+
+    return media_response(
+        request,
+        file_path,
+        media_type="image/jpeg",
+        headers={"Cache-Control": PREVIEW_CACHE_CONTROL}
+    )
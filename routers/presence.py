@@ -1,9 +1,10 @@
 from typing import Dict, List
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
 from fastapi.responses import RedirectResponse
-from auth import verify_token
+from auth import verify_session_token
 from functions import require_authenticated_user
-from crud import set_presence, get_contact_ids_list
+from crud import set_presence
+from contacts import get_contact_ids
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 
@@ -58,12 +59,12 @@ async def websocket_presence(websocket: WebSocket, db: AsyncSession=Depends(get_
     if not token:
         await websocket.close(code=1008)
         return
-    user_data = verify_token(token)
+    user_data = verify_session_token(token)
     if not user_data:
         await websocket.close(code=1008)
         return
     user_id = user_data["user_id"]
-    contacts = await get_contact_ids_list(db=db, user_id=user_id)
+    contacts = list(await get_contact_ids(db=db, user_id=user_id))
     await manager.connect(user_id, websocket, contacts)
     await set_presence(db=db, user_id=user_id, status=True)
     await manager.send_presence(status=True, user_id=user_id)
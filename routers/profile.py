@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from schemas import UsernameForm
 from functions import require_authenticated_user
+from contacts import contact_cache
 
 router = APIRouter()
 
@@ -48,4 +49,8 @@ async def post_subscribe_by_user(
 
     user_id = data["user_id"]
 
-    return await subscribe_by_username(db=db, user_id=user_id, username=username.username)
+    result = await subscribe_by_username(db=db, user_id=user_id, username=username.username)
+    if "channel_id" in result:
+        contact_cache.invalidate(user_id, result["channel_id"])
+
+    return result
@@ -0,0 +1,154 @@
+from fastapi import APIRouter, Body, Depends, File, Form, Header, Request, UploadFile
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+from starlette.requests import ClientDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+from functions import require_authenticated_user
+from schemas import CreateUploadForm
+from uploads import (
+    ChunkOutOfBounds, UploadTooLarge, close_upload_session, complete_upload_session, contiguous_offset,
+    create_upload_session, discard_upload, load_upload_session, publish_video, receive_upload, received_ranges,
+    reopen_upload_session, upload_route, write_upload_chunk
+)
+from images import InvalidImage, validate_image
+from routers.dashboard import ALLOWED_IMAGE_TYPES, ALLOWED_VIDEO_TYPES, MAX_IMAGE_SIZE, MAX_VIDEO_SIZE
+from config import RESUMABLE_MAX_CHUNK_SIZE
+
+# Only finalize takes a multipart body, the miniature
+router = APIRouter(route_class=upload_route(
+    MAX_IMAGE_SIZE, lambda request: JSONResponse({"error": 6}, status_code=413)
+))
+
+@router.post("/API/uploads")
+async def post_create_upload(form: CreateUploadForm = Body(...), data=Depends(require_authenticated_user())):
+
+    if isinstance(data, RedirectResponse):
+        return data
+    
+    user_id = data["user_id"]
+
+    if form.content_type not in ALLOWED_VIDEO_TYPES:
+        return {"error": 3}
+
+    if form.size > MAX_VIDEO_SIZE:
+        return {"error": 4}
+
+    upload_id = await create_upload_session(user_id=user_id, filename=form.filename, content_type=form.content_type, size=form.size)
+
+    return {"upload_id": upload_id, "offset": 0, "max_chunk_size": RESUMABLE_MAX_CHUNK_SIZE}
+
+@router.head("/API/uploads/{upload_id}")
+@router.get("/API/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str, data=Depends(require_authenticated_user())):
+
+    if isinstance(data, RedirectResponse):
+        return data
+    
+    session = await load_upload_session(upload_id, user_id=data["user_id"])
+    if not session:
+        return JSONResponse({"error": "Upload not found"}, status_code=404)
+
+    ranges = await received_ranges(session)
+    offset = contiguous_offset(ranges)
+
+    return JSONResponse(
+        {"offset": offset, "size": session.size, "ranges": ranges},
+        headers={
+            "Upload-Offset": str(offset),
+            "Upload-Length": str(session.size),
+            "Cache-Control": "no-store"
+        }
+    )
+
+@router.patch("/API/uploads/{upload_id}")
+async def patch_upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    data=Depends(require_authenticated_user())):
+
+    if isinstance(data, RedirectResponse):
+        return data
+    
+    session = await load_upload_session(upload_id, user_id=data["user_id"])
+    if not session:
+        return JSONResponse({"error": "Upload not found"}, status_code=404)
+
+    try:
+        await write_upload_chunk(session, offset=upload_offset, stream=request.stream(), max_length=RESUMABLE_MAX_CHUNK_SIZE)
+    except ChunkOutOfBounds:
+        return JSONResponse({"error": "Chunk outside of the upload"}, status_code=409)
+    except ClientDisconnect:
+        return Response(status_code=400)
+
+    offset = contiguous_offset(await received_ranges(session))
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+@router.post("/API/uploads/{upload_id}/finalize")
+async def post_finalize_upload(
+    upload_id: str,
+    title: str = Form(...),
+    description: str = Form(...),
+    miniature: UploadFile = File(...),
+    data=Depends(require_authenticated_user()),
+    db: AsyncSession = Depends(get_db)):
+
+    if isinstance(data, RedirectResponse):
+        return data
+    
+    if not 4 <= len(title) <= 24:
+        return {"error": 1}
+    
+    if not 5 <= len(description) <= 400:
+        return {"error": 2}
+    
+    user_id = data["user_id"]
+
+    if miniature.content_type not in ALLOWED_IMAGE_TYPES:
+        return {"error": 5}
+
+    session = await load_upload_session(upload_id, user_id=user_id)
+    if not session:
+        return JSONResponse({"error": "Upload not found"}, status_code=404)
+
+    offset = contiguous_offset(await received_ranges(session))
+    if offset < session.size:
+        return JSONResponse({"error": "Upload incomplete", "offset": offset}, status_code=409)
+
+    try:
+        miniature_upload = await receive_upload(miniature, max_size=MAX_IMAGE_SIZE)
+    except UploadTooLarge:
+        return {"error": 6}
+
+    try:
+        await validate_image(miniature_upload.path)
+    except InvalidImage:
+        await discard_upload(miniature_upload)
+        return {"error": 5}
+
+    try:
+        video_upload = await complete_upload_session(session)
+    except FileNotFoundError:
+        # Another request finalized this session first
+        await discard_upload(miniature_upload)
+        return JSONResponse({"error": "Upload not found"}, status_code=404)
+
+    try:
+        video_data, job = await publish_video(
+            db=db,
+            user_id=user_id,
+            title=title,
+            description=description,
+            video_upload=video_upload,
+            video_filename=session.filename,
+            miniature_upload=miniature_upload,
+            miniature_filename=miniature.filename
+        )
+    except Exception:
+        # The received chunks are kept, the client can finalize again
+        await reopen_upload_session(session)
+        raise
+
+    await close_upload_session(session)
+
+    return {"success": "The video has been uploaded successfully!", "video_id": video_data.id, "job_id": job.id}
@@ -1,19 +1,27 @@
 import os
 from typing import Optional
 from fastapi import APIRouter, Depends, Form, UploadFile
-from fastapi.responses import RedirectResponse, FileResponse
-from functions import require_authenticated_user, save_upload_file
-from crud import get_profile_data_by_id, update_profile_by_id, change_password, check_account_privacity_by_id, change_privacity_settings_by_id, delete_account
+from fastapi.responses import JSONResponse, RedirectResponse, FileResponse
+from functions import require_authenticated_user
+from uploads import UploadTooLarge, discard_upload, receive_upload, store_blob, upload_route
+from crud import get_profile_data_by_id, update_profile_by_id, change_password, check_account_privacity_by_id, change_privacity_settings_by_id, delete_user_subscriptions
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
+from media_locator import locator
+from contacts import contact_cache
+from media_layout import blob_file
+from images import InvalidImage, remove_derivatives, validate_image
+from jobs import enqueue_job
 from schemas import UpdateProfileForm, ChangePasswordForm, PrivacityChangeRequest
 
 
-router = APIRouter()
-
 ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png"}
 MAX_IMAGE_SIZE = 100 * 1024 * 1024
 
+router = APIRouter(route_class=upload_route(
+    MAX_IMAGE_SIZE, lambda request: JSONResponse({"error": "Image too large"}, status_code=413)
+))
+
 @router.get("/settings")
 def get_settings(redirect=Depends(require_authenticated_user())):
 
@@ -52,21 +60,46 @@ async def post_update_profile(
     user_id = data["user_id"]
 
     extension = None
+    profile_upload = None
     print(profile_picture)
     if profile_picture:
         if profile_picture.content_type not in ALLOWED_IMAGE_TYPES:
             return {"error": "Invalid image type"}
-        image_bytes = await profile_picture.read()
-        if len(image_bytes) > MAX_IMAGE_SIZE:
+        try:
+            profile_upload = await receive_upload(profile_picture, max_size=MAX_IMAGE_SIZE)
+        except UploadTooLarge:
             return {"error": "Image too large"}
-        await profile_picture.seek(0)
+
+        try:
+            await validate_image(profile_upload.path)
+        except InvalidImage:
+            await discard_upload(profile_upload)
+            return {"error": "Invalid image type"}
 
         filename = profile_picture.filename
         extension = os.path.splitext(filename)[1]
 
-        await save_upload_file(profile_picture, f"media/profiles/{user_id}{extension}")
-
-    return await update_profile_by_id(db=db, user_id=user_id, username=form.username, biography=form.biography, profile_extension=extension)
+    profile_sha256 = None
+    try:
+        if profile_upload:
+            profile_sha256 = await store_blob(db, profile_upload)
+        result = await update_profile_by_id(db=db, user_id=user_id, username=form.username, biography=form.biography, profile_extension=extension, profile_sha256=profile_sha256)
+    except Exception:
+        await db.rollback()
+        if profile_upload:
+            await discard_upload(profile_upload)
+        raise
+
+    if profile_sha256:
+        locator.invalidate("profile", user_id)
+        await remove_derivatives("profile", user_id)
+        await enqueue_job(
+            db,
+            "generate_image_derivatives",
+            {"kind": "profile", "media_id": profile_sha256, "source_path": str(blob_file(profile_sha256))},
+            user_id=user_id
+        )
+    return result
 
 @router.post("/change_password")
 async def post_change_password(
@@ -115,5 +148,10 @@ async def get_delete_account(data=Depends(require_authenticated_user()), db: Asy
     
     user_id = data["user_id"]
 
-    return await delete_account(db=db, user_id=user_id)
+    # Contacts end right away rather than when the job runs, committed together
+    # with the job so nobody can cache the account as a contact again meanwhile
+    contact_ids = await delete_user_subscriptions(db=db, user_id=user_id)
+    job = await enqueue_job(db, "delete_account", {"user_id": user_id}, user_id=user_id)
+    contact_cache.invalidate(user_id, *contact_ids)
+    return {"success": "Your account will be deleted shortly", "job_id": job.id}
     
\ No newline at end of file
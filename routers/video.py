@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Request, Depends, Body
 from fastapi.responses import RedirectResponse, FileResponse
-from crud import adjust_user_preferences_for_video, get_video_data_by_id, comment, get_comments, like_unlike_comment, dislike_undislike_comment, like_unlike_video, dislike_undislike_video, subscribe_by_video
+from crud import get_video_data_by_id, comment, get_comments, like_unlike_comment, dislike_undislike_comment, like_unlike_video, dislike_undislike_video, subscribe_by_video
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from schemas import VideoIdForm, CommentForm, GetCommentsForm, LikeComment
 from functions import require_authenticated_user
+from auth import create_stream_token
+from jobs import enqueue_job
+from view_counter import view_counter
+from contacts import contact_cache
 
 router = APIRouter()
 
+
 @router.get("/video")
 def get_video(redirect=Depends(require_authenticated_user())):
     
@@ -36,7 +41,11 @@ async def post_get_video(
     
     video_data = await get_video_data_by_id(db=db, video_id=video_id.id, user_id=user_id)
 
-    await adjust_user_preferences_for_video(db=db, user_id=user_id, video_id=video_id.id, liked=False)
+    if "error" not in video_data and "Error" not in video_data:
+        video_data["stream_token"] = create_stream_token(user_id=user_id, video_id=video_id.id)
+        # The view and the viewer's preference update are only counted here,
+        # view_counter writes both in a batch
+        view_counter.add(video_id.id, user_id=user_id)
 
     return video_data
 
@@ -84,8 +93,7 @@ async def post_like_comment(
     user_id = data["user_id"]
     comment_id = comment_id.comment_id
 
-    result = await like_unlike_comment(db=db, user_id=user_id, comment_id= comment_id)
-    return {"like": result}
+    return await like_unlike_comment(db=db, user_id=user_id, comment_id=comment_id)
 
 @router.post("/API/dislike_comment")
 async def post_dislike_comment(
@@ -99,8 +107,7 @@ async def post_dislike_comment(
     user_id = data["user_id"]
     comment_id = comment_id.comment_id
 
-    result = await dislike_undislike_comment(db=db, user_id=user_id, comment_id= comment_id)
-    return {"dislike": result}
+    return await dislike_undislike_comment(db=db, user_id=user_id, comment_id=comment_id)
 
 @router.post("/API/like_video")
 async def post_like_video(
@@ -113,9 +120,13 @@ async def post_like_video(
     
     user_id = data["user_id"]
 
-    await adjust_user_preferences_for_video(db=db, user_id=user_id, video_id=video_id.id, liked=True)
+    result = await like_unlike_video(db=db, user_id=user_id, video_id=video_id.id)
+
+    # Only a new like moves the preferences, unliking leaves them alone
+    if result.get("like"):
+        await enqueue_job(db, "adjust_user_preferences", {"user_id": user_id, "video_id": video_id.id, "liked": True}, user_id=user_id)
 
-    return await like_unlike_video(db=db, user_id=user_id, video_id=video_id.id)
+    return result
 
 
 @router.post("/API/dislike_video")
@@ -143,4 +154,8 @@ async def post_subscribe_by_video(
     user_id = data["user_id"]
     video_id = video_id.id
 
-    return await subscribe_by_video(db=db, user_id=user_id, video_id=video_id)
+    result = await subscribe_by_video(db=db, user_id=user_id, video_id=video_id)
+    if "channel_id" in result:
+        contact_cache.invalidate(user_id, result["channel_id"])
+
+    return result
@@ -247,4 +247,25 @@ class SendMessage(BaseModel):
         return v
 
 class ContactData(BaseModel):
-    id: int
\ No newline at end of file
+    id: int
+
+
+class CreateUploadForm(BaseModel):
+    filename: str
+    content_type: str
+    size: int
+
+    @field_validator("filename")
+    def filename_must_not_be_empty(cls, v):
+        v = v.strip()
+        if len(v) == 0:
+            raise ValueError("filename must not be empty")
+        if len(v) > 255:
+            raise ValueError("filename must be at most 255 characters")
+        return v
+
+    @field_validator("size")
+    def size_must_be_positive(cls, v):
+        if v <= 0:
+            raise ValueError("size must be a positive integer")
+        return v
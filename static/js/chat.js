@@ -42,7 +42,7 @@ const update_contact_data = () => {
     .then(data => {
         contactUsername = data.username;
         document.getElementById("chat-header").innerHTML = `
-        <div id="chat-pfp" style="background-image: url(/profile_picture/${contactId})"></div>
+        <div id="chat-pfp" style="background-image: url(/profile_picture/${contactId}?size=160)"></div>
         <div id="chat-contact-info">
             <h3>${contactUsername}</h3>
             <p id="active">Last time active ${data.active}</p>
@@ -59,7 +59,7 @@ socket.onmessage = function(event) {
     if (data.author == contactId) {
         chat.innerHTML += `
         <div class="message received">
-            <div class="msg-pfp" style="background-image: url('/profile_picture/${contactId}')"></div>
+            <div class="msg-pfp" style="background-image: url('/profile_picture/${contactId}?size=160')"></div>
             <div class="msg-content">
                 <p>${data.content}</p>
                 <span class="msg-time">${data.date}</span>
@@ -114,7 +114,7 @@ const get_chat = async () => {
             } else {
                 currentHTML = `
                 <div class="message received">
-                    <div class="msg-pfp" style="background-image: url('/profile_picture/${contactId}')"></div>
+                    <div class="msg-pfp" style="background-image: url('/profile_picture/${contactId}?size=160')"></div>
                     <div class="msg-content">
                         <p>${message.content}</p>
                         <span class="msg-time">${message.date}</span>
@@ -204,7 +204,7 @@ const showManageVideosOption = () => {
             data.videos.forEach((video) => {
                 html += `
                 <div class="video-card">
-                    <div class="miniature" style="background-image: url('/video_miniature/${video.id}');"></div>
+                    <div class="miniature" style="background-image: url('/video_miniature/${video.id}?size=320');"></div>
 
                     <div class="video-info">
                     <p class="video-title">${video.title}</p>
@@ -41,7 +41,7 @@ fetch("/API/get_video_edit_form", {
 .then(data => {
     document.getElementById("title-input").value = data.title;
     document.getElementById("description-input").value = data.description;
-    document.getElementById("miniature-input-label").style.backgroundImage = `url("/video_miniature/${videoId}")`;
+    document.getElementById("miniature-input-label").style.backgroundImage = `url("/video_miniature/${videoId}?size=320")`;
     document.getElementById("id-input").value = videoId;
 })
 .catch(err => console.log(err));
\ No newline at end of file
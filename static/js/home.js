@@ -27,7 +27,7 @@ function loadHomeVideos() {
         videos.forEach(video => {
             html += `
                 <div class="video-card" data-id="${video.id}">
-                    <img src="/video_miniature/${video.id}" alt="Video Title" class="thumbnail">
+                    <img src="/video_miniature/${video.id}?size=320" alt="Video Title" class="thumbnail">
                     <div class="video-info">
                         <h3 class="video-title">${video.title}</h3>
                         <p class="video-channel">${video.owner}</p>
@@ -18,7 +18,7 @@ fetch("/get_mail_data", {
         followups.forEach((followup) => {
             mailContent += `
             <div class="mail">
-                <div class="followup-pfp" data-id="${followup.follower_username}" style="background-image: url('/profile_picture/${followup.follower_id}')"></div>
+                <div class="followup-pfp" data-id="${followup.follower_username}" style="background-image: url('/profile_picture/${followup.follower_id}?size=160')"></div>
                 <div class="info-container">
                     <p>The user ${followup.follower_username} wants to follow you</p>
                     <p style="color: blueviolet;">${followup.date}</p>
@@ -50,7 +50,7 @@ fetch("/get_chats", {
         contacts.forEach((contact) => {
             contactsContent += `
             <div class="contact" data-id="${contact.id}">
-                <div class="contact-pfp" style="background-image: url('/profile_picture/${contact.id}')"></div>
+                <div class="contact-pfp" style="background-image: url('/profile_picture/${contact.id}?size=160')"></div>
                 <div class="contact-info">
                     <p class="contact-username">${contact.username}</p>
                     <p class="contact-last-message">Último mensaje aquí...</p>
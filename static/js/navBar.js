@@ -35,7 +35,7 @@ fetch("/API/home", {
     return res.json();
 })
 .then(data => {
-    document.getElementById("profile-picture").style.backgroundImage = `url(/profile_picture/${data.user_id})`;
+    document.getElementById("profile-picture").style.backgroundImage = `url(/profile_picture/${data.user_id}?size=160)`;
     username = data.username;
 })
 .catch(err => alert(err));
@@ -72,7 +72,7 @@ const search = () => {
             data.videos.forEach((video) => {
                 html += `
                 <div class="video-card" data-id="${video.id}">
-                    <img src="/video_miniature/${video.id}" alt="Video Title" class="thumbnail">
+                    <img src="/video_miniature/${video.id}?size=320" alt="Video Title" class="thumbnail">
                     <div class="video-info">
                         <h3 class="video-title">${video.title}</h3>
                         <p class="video-channel">${video.owner}</p>
@@ -89,7 +89,7 @@ const search = () => {
             data.channels.forEach((channel) => {
                 html += `
                 <div class="channel-card" data-username="${channel.username}">
-                    <img src="/profile_picture/${channel.id}" alt="${channel.username}" class="channel-picture">
+                    <img src="/profile_picture/${channel.id}?size=160" alt="${channel.username}" class="channel-picture">
                     <div class="channel-info">
                         <h3 class="channel-name">${channel.username}</h3>
                         <p class="channel-subs">${channel.subscribers_count} subscribers</p>
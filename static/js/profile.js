@@ -20,7 +20,7 @@ const get_profile_data = () => {
         return res.json();
     })
     .then(data => {
-        document.getElementById("user-image").style.backgroundImage = `url(profile_picture/${data.user.id})`;
+        document.getElementById("user-image").style.backgroundImage = `url(/profile_picture/${data.user.id}?size=320)`;
         document.getElementById("username").innerText = data.user.username;
         document.getElementById("subscribers").innerText = `${data.user.subscribers} Subs`;
         document.getElementById("videos-container").innerHTML = "";
@@ -28,7 +28,7 @@ const get_profile_data = () => {
         try{
             data.videos.forEach((video) => {
                 document.getElementById("videos-container").innerHTML += `
-                <div class="video-card" data-id="${video.id}" style="background-image: url(/video_miniature/${video.id})"><p class="video-card-title">${video.title}</p></div>
+                <div class="video-card" data-id="${video.id}" style="background-image: url(/video_miniature/${video.id}?size=320)"><p class="video-card-title">${video.title}</p></div>
                 `
             });
         } catch (error) {
@@ -39,7 +39,7 @@ const showAndManageProfileSettings = () => {
     .then(data => {
         document.getElementById("username-input").value = data.username;
         document.getElementById("biography-input").value = data.biography;
-        document.getElementById("profile-image").style.backgroundImage = `url("/profile_picture/${data.user_id}")`;
+        document.getElementById("profile-image").style.backgroundImage = `url("/profile_picture/${data.user_id}?size=320")`;
         document.getElementById("profile-image").addEventListener("click", () => {
             document.getElementById("file-input").click();
         });
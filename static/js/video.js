@@ -14,8 +14,8 @@ let offset = 0;
 let isLoading = false;
 let commentsEnded = false;
 
-// We load the video from local storage (simulation)
-document.getElementById("video").src = `/video_stream/${videoId}`;
+const videoElement = document.getElementById("video");
+let streamLoaded = false;
 
 // This function renders the comments
 function renderCommentForm() {
@@ -37,6 +37,106 @@ const escapeHTML = (str) => str
     .replace(/"/g, "&quot;")
     .replace(/'/g, "&#039;");
 
+// The stream token lets every range request skip the permission queries,
+// packaged videos play through HLS so the player can adapt the bitrate
+const loadStream = (data) => {
+    const query = data.stream_token ? `?token=${encodeURIComponent(data.stream_token)}` : "";
+    const hlsSource = `/video_hls/${videoId}/master.m3u8${query}`;
+
+    if (data.hls_ready && videoElement.canPlayType("application/vnd.apple.mpegurl")) {
+        videoElement.src = hlsSource;
+    } else if (data.hls_ready && window.Hls && Hls.isSupported()) {
+        const hls = new Hls();
+        hls.loadSource(hlsSource);
+        hls.attachMedia(videoElement);
+    } else {
+        videoElement.src = `/video_stream/${videoId}${query}`;
+    }
+
+    // Seek preview thumbnails, each cue points at a tile of a sprite sheet
+    const previews = document.createElement("track");
+    previews.kind = "metadata";
+    previews.label = "thumbnails";
+    previews.src = `/video_previews/${videoId}/thumbnails.vtt${query}`;
+    videoElement.appendChild(previews);
+    // Hidden tracks are still loaded, disabled ones (the default) are not
+    previews.track.mode = "hidden";
+    thumbnailTrack = previews;
+};
+
+// Height of the native controls, hovering there previews the timeline
+const SEEK_BAR_HEIGHT = 40;
+const seekPreview = document.getElementById("seek-preview");
+let thumbnailTrack = null;
+
+const findThumbnailCue = (time) => {
+    const cues = thumbnailTrack ? thumbnailTrack.track.cues : null;
+    if (!cues) {
+        return null;
+    }
+    for (const cue of cues) {
+        if (time >= cue.startTime && time < cue.endTime) {
+            return cue;
+        }
+    }
+    return null;
+};
+
+videoElement.addEventListener("mousemove", (e) => {
+    const rect = videoElement.getBoundingClientRect();
+    const x = e.clientX - rect.left;
+    const cue = videoElement.duration && rect.bottom - e.clientY <= SEEK_BAR_HEIGHT
+        ? findThumbnailCue(x / rect.width * videoElement.duration)
+        : null;
+
+    // sprite_001.jpg?token=...#xywh=x,y,w,h, relative to the track
+    const [path, fragment] = cue ? cue.text.trim().split("#xywh=") : [];
+    if (!fragment) {
+        seekPreview.style.display = "none";
+        return;
+    }
+
+    const [tileX, tileY, width, height] = fragment.split(",").map(Number);
+    const sprite = new URL(path, thumbnailTrack.src);
+
+    seekPreview.style.width = `${width}px`;
+    seekPreview.style.height = `${height}px`;
+    seekPreview.style.backgroundImage = `url("${sprite}")`;
+    seekPreview.style.backgroundPosition = `-${tileX}px -${tileY}px`;
+    seekPreview.style.left = `${Math.min(Math.max(x - width / 2, 0), rect.width - width)}px`;
+    seekPreview.style.display = "block";
+});
+
+videoElement.addEventListener("mouseleave", () => {
+    seekPreview.style.display = "none";
+});
+
+const renderSubscription = (subscribed) => {
+    if (subscribed) {
+        subscribe_button.innerText = "Subscribed";
+        subscribe_button.style.backgroundColor = "#A9B0B3";
+    } else {
+        subscribe_button.innerText = "Subscribe";
+        subscribe_button.style.backgroundColor = "#791F1F";
+    }
+};
+
+const renderReactions = (likes, dislikes, liked, disliked) => {
+    video_like_button.innerText = likes
+    video_dislike_button.innerText = dislikes
+    if (liked) {
+        video_like_button.classList.add("like");
+    } else {
+        video_like_button.classList.remove("like");
+    }
+    
+    if (disliked) {
+        video_dislike_button.classList.add("dislike");
+    } else {
+        video_dislike_button.classList.remove("dislike");
+    }
+};
+
 // Here we fetch basic data
 const get_video_data = () => {
     fetch("/API/video", {
@@ -54,32 +154,17 @@ const get_video_data = () => {
         return res.json();
     })
     .then(data => {
+        if (!streamLoaded) {
+            loadStream(data);
+            streamLoaded = true;
+        }
         document.getElementById("video-title").innerText = data.title;
-        document.getElementById("channel-image").style.backgroundImage = `url(/profile_picture/${data.owner_id})`;
+        document.getElementById("channel-image").style.backgroundImage = `url(/profile_picture/${data.owner_id}?size=160)`;
         channel_name = data.owner_username;
         document.getElementById("channel-name").innerText = channel_name;
         document.getElementById("description").innerText = data.description;
-        if (data.subscribed) {
-            subscribe_button.innerText = "Subscribed";
-            subscribe_button.style.backgroundColor = "#A9B0B3";
-        } else {
-            subscribe_button.innerText = "Subscribe";
-            subscribe_button.style.backgroundColor = "#791F1F";
-        }
-
-        video_like_button.innerText = data.likes
-        video_dislike_button.innerText = data.dislikes
-        if (data.liked) {
-            video_like_button.classList.add("like");
-        } else {
-            video_like_button.classList.remove("like");
-        }
-        
-        if (data.disliked) {
-            video_dislike_button.classList.add("dislike");
-        } else {
-            video_dislike_button.classList.remove("dislike");
-        }
+        renderSubscription(data.subscribed);
+        renderReactions(data.likes, data.dislikes, data.liked, data.disliked);
     })
     .catch(err => alert(err));
 };
@@ -105,8 +190,10 @@ video_like_button.addEventListener("click", () => {
         return res.json();
     })
     .then(data => {
-        console.log(data);
-        get_video_data();
+        // The toggle returns the new counts, refetching would count another view
+        if (!data.error) {
+            renderReactions(data.likes, data.dislikes, data.like, false);
+        }
     })
     .catch(err => alert(err));
 });
@@ -129,8 +216,9 @@ video_dislike_button.addEventListener("click", () => {
         return res.json();
     })
     .then(data => {
-        console.log(data);
-        get_video_data();
+        if (!data.error) {
+            renderReactions(data.likes, data.dislikes, false, data.dislike);
+        }
     })
     .catch(err => alert(err));
 });
@@ -159,8 +247,11 @@ document.getElementById("subscribe-button").addEventListener("click", () => {
         return res.json();
     })
     .then(data => {
-        console.log(data);
-        get_video_data();
+        if ("subscribed" in data) {
+            renderSubscription(data.subscribed);
+        } else if (data.info) {
+            alert(data.info);
+        }
     })
     .catch(err => alert(err));
 });
@@ -300,7 +391,7 @@ const get_comments = (order) => {
             if (comment.liked) {
                 html += `
                 <div class="comment-container">
-                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id})" data-username="${comment.owner_username}"></div>
+                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id}?size=160)" data-username="${comment.owner_username}"></div>
                     <p class="user-username">${comment.owner_username}</p>
                     <p class="comment-text">${safeContent}</p>
                     <i class="bi bi-hand-thumbs-up comment-like-button like" data-id="${comment.id}">${comment.likes}</i>
@@ -310,7 +401,7 @@ const get_comments = (order) => {
             } else if (comment.disliked) {
                 html += `
                 <div class="comment-container">
-                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id})" data-username="${comment.owner_username}"></div>
+                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id}?size=160)" data-username="${comment.owner_username}"></div>
                     <p class="user-username">${comment.owner_username}</p>
                     <p class="comment-text">${safeContent}</p>
                     <i class="bi bi-hand-thumbs-up comment-like-button" data-id="${comment.id}">${comment.likes}</i>
@@ -322,7 +413,7 @@ const get_comments = (order) => {
             else {
                 html += `
                 <div class="comment-container">
-                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id})" data-username="${comment.owner_username}"></div>
+                    <div class="user-image" style="background-image: url(/profile_picture/${comment.owner_id}?size=160)" data-username="${comment.owner_username}"></div>
                     <p class="user-username">${comment.owner_username}</p>
                     <p class="comment-text">${safeContent}</p>
                     <i class="bi bi-hand-thumbs-up comment-like-button" data-id="${comment.id}">${comment.likes}</i>
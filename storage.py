@@ -0,0 +1,121 @@
+import mimetypes
+import os
+import secrets
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import anyio
+from media_layout import MEDIA_ROOT
+from config import (
+    STORAGE_BACKEND, S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY,
+    S3_PRESIGNED_URL_TTL, UPLOAD_TEMP_DIR
+)
+
+# Backends address media by its layout path (media/videos/c2/0a/12.mp4), the
+# object key is that path relative to media/
+
+
+class LocalStorage:
+    # A lookup is a stat, cheap enough to try every known extension
+    cheap_lookups = True
+
+    async def save(self, source: Path, path: Path):
+        # Moves a local file into the store
+        await anyio.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        await anyio.to_thread.run_sync(os.replace, source, path)
+
+    async def put_file(self, source: Path, path: Path):
+        # Copies a local file into the store, the source is kept
+        if Path(source).resolve() == Path(path).resolve():
+            return
+        await anyio.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        await anyio.to_thread.run_sync(shutil.copyfile, source, path)
+
+    async def exists(self, path: Path) -> bool:
+        return await anyio.Path(path).is_file()
+
+    async def delete(self, path: Path):
+        await anyio.Path(path).unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def local_copy(self, path: Path) -> AsyncIterator[Path]:
+        yield Path(path)
+
+    def presigned_url(self, path: Path, media_type: str) -> Optional[str]:
+        return None
+
+
+class S3Storage:
+    # Every lookup is a HEAD request
+    cheap_lookups = False
+
+    def __init__(self, bucket: str):
+        # Only needed with STORAGE_BACKEND=s3
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.client_error = ClientError
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY,
+            config=Config(signature_version="s3v4")
+        )
+
+    @staticmethod
+    def key(path: Path) -> str:
+        return Path(path).relative_to(MEDIA_ROOT).as_posix()
+
+    async def save(self, source: Path, path: Path):
+        await self.put_file(source, path)
+        await anyio.Path(source).unlink(missing_ok=True)
+
+    async def put_file(self, source: Path, path: Path):
+        content_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+        await anyio.to_thread.run_sync(
+            lambda: self.client.upload_file(str(source), self.bucket, self.key(path), ExtraArgs={"ContentType": content_type})
+        )
+
+    async def exists(self, path: Path) -> bool:
+        try:
+            await anyio.to_thread.run_sync(lambda: self.client.head_object(Bucket=self.bucket, Key=self.key(path)))
+        except self.client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def delete(self, path: Path):
+        await anyio.to_thread.run_sync(lambda: self.client.delete_object(Bucket=self.bucket, Key=self.key(path)))
+
+    @asynccontextmanager
+    async def local_copy(self, path: Path) -> AsyncIterator[Path]:
+        # Background jobs need a real file for ffmpeg and Pillow
+        await anyio.Path(UPLOAD_TEMP_DIR).mkdir(parents=True, exist_ok=True)
+        temp_path = Path(UPLOAD_TEMP_DIR) / f"{secrets.token_hex(16)}{Path(path).suffix}"
+        try:
+            await anyio.to_thread.run_sync(lambda: self.client.download_file(self.bucket, self.key(path), str(temp_path)))
+            yield temp_path
+        finally:
+            await anyio.Path(temp_path).unlink(missing_ok=True)
+
+    def presigned_url(self, path: Path, media_type: str) -> Optional[str]:
+        # Signed locally, no request to the object store
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key(path), "ResponseContentType": media_type},
+            ExpiresIn=S3_PRESIGNED_URL_TTL
+        )
+
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET)
+    return LocalStorage()
+
+storage = create_storage()
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import struct
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+import anyio
+from fastapi.responses import Response, StreamingResponse
+from transcode import read_mp4_duration
+from config import (
+    STREAM_MAX_PER_USER, STREAM_SHAPING_ENABLED, STREAM_STARTUP_SECONDS, STREAM_STARTUP_MULTIPLIER,
+    STREAM_PACE_MULTIPLIER, STREAM_MIN_RATE, STREAM_BUCKET_SECONDS, MEDIA_DELIVERY_MODE
+)
+
+BITRATE_CACHE_SIZE = 1024
+
+
+class StreamLimitExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def consume(self, amount: int):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # Chunks larger than the bucket are allowed through, the debt is paid
+        # by sleeping before the next one
+        self.tokens -= amount
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class ScheduledResponse(Response):
+    # Wraps the media response so the stream slot is released however the
+    # response ends: drained, client disconnect or error
+
+    def __init__(self, response: Response, release):
+        self.response = response
+        self.release = release
+        self.status_code = response.status_code
+        self.raw_headers = response.raw_headers
+
+    @property
+    def background(self):
+        return self.response.background
+
+    @background.setter
+    def background(self, value):
+        self.response.background = value
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.release()
+
+
+class StreamScheduler:
+    def __init__(self, max_per_user: int):
+        self.max_per_user = max_per_user
+        self.active: Dict[int, int] = {}
+        self.bitrates: "OrderedDict[Tuple[str, int], Optional[float]]" = OrderedDict()
+
+    def admit(self, user_id: int):
+        if self.active.get(user_id, 0) >= self.max_per_user:
+            raise StreamLimitExceeded(user_id)
+        self.active[user_id] = self.active.get(user_id, 0) + 1
+
+    def release(self, user_id: int):
+        remaining = self.active.get(user_id, 0) - 1
+        if remaining > 0:
+            self.active[user_id] = remaining
+        else:
+            self.active.pop(user_id, None)
+
+    def read_bitrate(self, path: Path) -> Optional[float]:
+        stat_result = os.stat(path)
+        key = (str(path), stat_result.st_mtime_ns)
+        if key not in self.bitrates:
+            # Only MP4 carries a duration we can read cheaply, WebM, MKV and
+            # AVI stay unknown rather than being paced at a guessed rate
+            try:
+                duration = read_mp4_duration(path)
+            except (OSError, IndexError, ValueError, struct.error):
+                duration = None
+            self.bitrates[key] = stat_result.st_size / duration if duration else None
+            while len(self.bitrates) > BITRATE_CACHE_SIZE:
+                self.bitrates.popitem(last=False)
+        self.bitrates.move_to_end(key)
+        return self.bitrates[key]
+
+    async def media_bitrate(self, path: Path) -> Optional[float]:
+        try:
+            return await anyio.to_thread.run_sync(self.read_bitrate, path)
+        except OSError:
+            return None
+
+    @staticmethod
+    async def pace(body: AsyncIterator[bytes], bitrate: float) -> AsyncIterator[bytes]:
+        startup_rate = max(STREAM_MIN_RATE, bitrate * STREAM_STARTUP_MULTIPLIER)
+        steady_rate = max(STREAM_MIN_RATE, bitrate * STREAM_PACE_MULTIPLIER)
+        bucket = TokenBucket(startup_rate, startup_rate * STREAM_BUCKET_SECONDS)
+        started = time.monotonic()
+
+        async for chunk in body:
+            if bucket.rate != steady_rate and time.monotonic() - started >= STREAM_STARTUP_SECONDS:
+                bucket.rate = steady_rate
+                bucket.capacity = steady_rate * STREAM_BUCKET_SECONDS
+            yield chunk
+            await bucket.consume(len(chunk))
+
+    async def schedule(self, user_id: int, response: Response, path: Path) -> Response:
+        if not isinstance(response, StreamingResponse):
+            # 304, 404 and 416 carry no body, the slot isn't needed
+            self.release(user_id)
+            return response
+
+        if STREAM_SHAPING_ENABLED:
+            bitrate = await self.media_bitrate(path)
+            if bitrate is not None:
+                # Only the body going through Python is paced, a single range
+                # the server sends zero-copy never reads it
+                response.body_iterator = self.pace(response.body_iterator, bitrate)
+
+        return ScheduledResponse(response, lambda: self.release(user_id))
+
+stream_scheduler = StreamScheduler(max_per_user=STREAM_MAX_PER_USER)
+
+if STREAM_SHAPING_ENABLED and MEDIA_DELIVERY_MODE == "sendfile":
+    print("Stream shaping is enabled in sendfile mode, single range responses sent zero-copy are not paced")
@@ -0,0 +1,279 @@
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+import anyio
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from block_cache import block_cache
+from media_layout import MEDIA_ROOT
+from config import STREAM_CHUNK_SIZE, MAX_OPEN_RANGE_SIZE, MAX_RANGES_PER_REQUEST, MEDIA_DELIVERY_MODE, MEDIA_ACCEL_REDIRECT_PREFIX
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_spec(spec: str, file_size: int) -> Optional[Tuple[int, int]]:
+    start_str, separator, end_str = spec.partition("-")
+    start_str, end_str = start_str.strip(), end_str.strip()
+
+    if not separator or not (start_str or end_str):
+        raise RangeNotSatisfiable(spec)
+    if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+        raise RangeNotSatisfiable(spec)
+
+    if not start_str:
+        # Suffix range: "bytes=-500" means the last 500 bytes
+        suffix_length = int(end_str)
+        if suffix_length == 0 or file_size == 0:
+            return None
+        return max(0, file_size - suffix_length), file_size - 1
+
+    start = int(start_str)
+    if start >= file_size:
+        return None
+
+    if end_str:
+        end = int(end_str)
+        if end < start:
+            raise RangeNotSatisfiable(spec)
+        return start, min(end, file_size - 1)
+
+    # Open-ended range: serve a bounded window, the player asks for the rest
+    return start, min(start + MAX_OPEN_RANGE_SIZE, file_size) - 1
+
+
+def parse_ranges(range_header: str, file_size: int) -> List[Tuple[int, int]]:
+    units, _, specs = range_header.strip().partition("=")
+    if units.strip().lower() != "bytes" or not specs.strip():
+        raise RangeNotSatisfiable(range_header)
+
+    ranges = []
+    for spec in specs.split(","):
+        byte_range = parse_range_spec(spec.strip(), file_size)
+        if byte_range:
+            ranges.append(byte_range)
+
+    if not ranges:
+        raise RangeNotSatisfiable(range_header)
+
+    # Coalesce overlapping and adjacent ranges so a client can't make us read
+    # the same bytes over and over
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES_PER_REQUEST:
+        raise RangeNotSatisfiable(range_header)
+
+    return merged
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(header_value: str, etag: str, weak: bool = True) -> bool:
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_http_date(value: str) -> Optional[int]:
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_not_modified(request: Request, etag: str, modified_time: int) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and modified_time <= since
+
+    return False
+
+
+def if_range_matches(request: Request, etag: str, modified_time: int) -> bool:
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return etag_matches(if_range, etag, weak=False)
+
+    return parse_http_date(if_range) == modified_time
+
+
+async def iter_file_range(path: Path, start: int, end: int, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    file = await anyio.open_file(path, "rb")
+    try:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await file.aclose()
+
+
+def iter_media_range(path: Path, start: int, end: int, mtime_ns: Optional[int] = None) -> AsyncIterator[bytes]:
+    if mtime_ns is not None and block_cache.enabled:
+        return block_cache.iter_range(path, mtime_ns, start, end)
+    return iter_file_range(path, start, end)
+
+
+class FileRangeResponse(StreamingResponse):
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, media_type: str, headers: dict, mtime_ns: Optional[int] = None):
+        self.path = path
+        self.start = start
+        self.end = end
+        super().__init__(
+            iter_media_range(path, start, end, mtime_ns),
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers
+        )
+
+    async def __call__(self, scope, receive, send):
+        if supports_zerocopy(scope):
+            await self.zerocopy_send(send)
+        else:
+            await super().__call__(scope, receive, send)
+
+    async def zerocopy_send(self, send):
+        file = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers
+            })
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": self.start,
+                "count": self.end - self.start + 1,
+                "more_body": False
+            })
+        finally:
+            await anyio.to_thread.run_sync(file.close)
+
+
+class MultipartRangeResponse(StreamingResponse):
+
+    def __init__(self, path: Path, ranges: List[Tuple[int, int]], file_size: int, media_type: str, headers: dict, mtime_ns: Optional[int] = None):
+        boundary = secrets.token_hex(16)
+        part_headers = [
+            f"--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{end}/{file_size}\r\n\r\n".encode()
+            for start, end in ranges
+        ]
+        closing = f"--{boundary}--\r\n".encode()
+
+        content_length = len(closing) + sum(
+            len(part_header) + (end - start + 1) + 2
+            for part_header, (start, end) in zip(part_headers, ranges)
+        )
+        response_headers = dict(headers)
+        response_headers["Content-Length"] = str(content_length)
+
+        super().__init__(
+            self.iter_parts(path, ranges, part_headers, closing, mtime_ns),
+            status_code=206,
+            media_type=f"multipart/byteranges; boundary={boundary}",
+            headers=response_headers
+        )
+
+    @staticmethod
+    async def iter_parts(path: Path, ranges: List[Tuple[int, int]], part_headers: List[bytes], closing: bytes, mtime_ns: Optional[int]) -> AsyncIterator[bytes]:
+        for part_header, (start, end) in zip(part_headers, ranges):
+            yield part_header
+            async for chunk in iter_media_range(path, start, end, mtime_ns):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+
+def supports_zerocopy(scope) -> bool:
+    if MEDIA_DELIVERY_MODE != "sendfile" or not hasattr(os, "sendfile"):
+        return False
+    return "http.response.zerocopysend" in scope.get("extensions", {})
+
+
+def offload_response(path: Path, media_type: str, headers: Optional[dict] = None) -> Response:
+    response_headers = dict(headers or {})
+
+    if MEDIA_DELIVERY_MODE == "x-accel-redirect":
+        relative_path = path.relative_to(MEDIA_ROOT).as_posix()
+        response_headers["X-Accel-Redirect"] = MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path
+    else:
+        response_headers["X-Sendfile"] = str(path.resolve())
+
+    return Response(media_type=media_type, headers=response_headers)
+
+
+def media_response(request: Request, path: Path, media_type: str, headers: Optional[dict] = None) -> Response:
+    if MEDIA_DELIVERY_MODE in ("x-accel-redirect", "x-sendfile"):
+        # The proxy handles Range and conditional headers itself
+        return offload_response(path, media_type, headers)
+
+    try:
+        stat_result = path.stat()
+    except FileNotFoundError:
+        return Response(status_code=404)
+    file_size = stat_result.st_size
+    modified_time = int(stat_result.st_mtime)
+    etag = file_etag(stat_result)
+
+    response_headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_time, usegmt=True)
+    }
+    if headers:
+        response_headers.update(headers)
+
+    if is_not_modified(request, etag, modified_time):
+        return Response(status_code=304, headers=response_headers)
+
+    range_header = request.headers.get("range")
+    if range_header is None or not if_range_matches(request, etag, modified_time):
+        response_headers["Content-Length"] = str(file_size)
+        return FileRangeResponse(path, 0, file_size - 1, status_code=200, media_type=media_type, headers=response_headers, mtime_ns=stat_result.st_mtime_ns)
+
+    try:
+        ranges = parse_ranges(range_header, file_size)
+    except RangeNotSatisfiable:
+        response_headers["Content-Range"] = f"bytes */{file_size}"
+        return Response(status_code=416, headers=response_headers)
+
+    if len(ranges) > 1:
+        return MultipartRangeResponse(path, ranges, file_size, media_type=media_type, headers=response_headers, mtime_ns=stat_result.st_mtime_ns)
+
+    start, end = ranges[0]
+    response_headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    response_headers["Content-Length"] = str(end - start + 1)
+    return FileRangeResponse(path, start, end, status_code=206, media_type=media_type, headers=response_headers, mtime_ns=stat_result.st_mtime_ns)
@@ -0,0 +1,200 @@
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional, Union
+import anyio
+from database import SessionLocal
+from jobs import enqueue_job, job_handler
+from crud import (
+    COUNTER_SOURCES, adjust_user_preferences_for_video, adjust_user_preferences_for_views, delete_account, delete_unreferenced_media_blob, get_max_row_id,
+    get_unreferenced_media_blobs, get_user_media_references, get_video_media_by_id, reconcile_counter, replace_video_blob,
+    rollup_counter_shards, set_video_hls_status
+)
+from transcode import apply_faststart, generate_previews, hls_directory, package_hls, previews_directory, remux_faststart
+from uploads import IngestedUpload, discard_upload, hash_file, store_blob
+from images import derivatives_directory, generate_derivatives
+from storage import storage
+from collect_media import collect
+from media_layout import (
+    HLS_DIRECTORY, MINIATURES_DIRECTORY, PREVIEWS_DIRECTORY, PROFILES_DIRECTORY, VIDEOS_DIRECTORY,
+    blob_file, legacy_media_directory, legacy_media_file, media_directory, media_file, remove_legacy_directory
+)
+from config import BLOB_SWEEP_GRACE
+
+
+@job_handler("process_video_upload")
+async def process_video_upload(video_id: int, video_path: str, video_sha256: Optional[str] = None, video_extension: Optional[str] = None):
+    if video_sha256:
+        video_sha256 = await faststart_video_blob(video_id, video_sha256, video_extension)
+        if video_sha256 is None:
+            return
+        video_path = str(blob_file(video_sha256))
+        await enqueue_video_previews(video_id, video_path, video_sha256)
+
+    if video_sha256 and await anyio.Path(hls_directory(video_sha256) / "master.m3u8").exists():
+        # Same bytes were uploaded before, HLS is already done
+        async with SessionLocal() as db:
+            await set_video_hls_status(db=db, video_id=video_id, status="ready")
+        return
+
+    async with storage.local_copy(Path(video_path)) as local_path:
+        if not video_sha256 and await apply_faststart(video_id, str(local_path), video_extension):
+            await storage.put_file(local_path, Path(video_path))
+        await package_hls(video_id, str(local_path), video_sha256)
+
+
+async def faststart_video_blob(video_id: int, video_sha256: str, video_extension: Optional[str]) -> Optional[str]:
+    # A blob is never rewritten in place, it would stop matching its hash. The
+    # remuxed file becomes a blob of its own and the row is moved onto it, the
+    # original is released and swept once nothing else references it
+    async with SessionLocal() as db:
+        media = await get_video_media_by_id(db=db, video_id=video_id)
+    if not media:
+        return None
+    if media[1] != video_sha256:
+        # A retried job, the row was already moved onto the faststart blob
+        return media[1]
+
+    async with storage.local_copy(blob_file(video_sha256)) as local_path:
+        remuxed = await remux_faststart(video_id, str(local_path), video_extension)
+        if remuxed is None:
+            return video_sha256
+
+        sha256 = await anyio.to_thread.run_sync(hash_file, remuxed)
+        upload = IngestedUpload(remuxed, remuxed.stat().st_size, sha256)
+        async with SessionLocal() as db:
+            try:
+                new_sha256 = await store_blob(db, upload)
+                if not await replace_video_blob(db, video_id, video_sha256, new_sha256):
+                    # Deleted meanwhile, the stored copy is left to collect_media
+                    await db.rollback()
+                    return None
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                await discard_upload(upload)
+                raise
+
+    return new_sha256
+
+
+async def enqueue_video_previews(video_id: int, video_path: str, video_sha256: str):
+    async with SessionLocal() as db:
+        await enqueue_job(db, "generate_video_previews", {"video_id": video_id, "video_path": video_path, "video_sha256": video_sha256})
+
+
+@job_handler("generate_video_previews")
+async def generate_video_previews(video_id: int, video_path: str, video_sha256: Optional[str] = None):
+    if video_sha256 and await anyio.Path(previews_directory(video_sha256) / "thumbnails.vtt").exists():
+        return
+
+    async with storage.local_copy(Path(video_path)) as local_path:
+        await generate_previews(video_id, str(local_path), video_sha256)
+
+
+@job_handler("generate_image_derivatives")
+async def generate_image_derivatives(kind: str, media_id: Union[int, str], source_path: str):
+    if isinstance(media_id, str) and await anyio.Path(derivatives_directory(kind, media_id)).exists():
+        return
+
+    async with storage.local_copy(Path(source_path)) as local_path:
+        await generate_derivatives(kind, media_id, str(local_path))
+
+
+async def sweep_media_blobs(limit: int = 500):
+    # Content that no row references anymore, kept for BLOB_SWEEP_GRACE so
+    # cached locations in the web workers expire first
+    released_before = datetime.now() - timedelta(seconds=BLOB_SWEEP_GRACE)
+    async with SessionLocal() as db:
+        unreferenced = await get_unreferenced_media_blobs(db, released_before=released_before, limit=limit)
+
+    for sha256 in unreferenced:
+        async with SessionLocal() as db:
+            try:
+                if not await delete_unreferenced_media_blob(db, sha256):
+                    continue
+                await storage.delete(blob_file(sha256))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                print(f"Error removing media blob {sha256}: {e}")
+                continue
+
+        for directory in (HLS_DIRECTORY, PREVIEWS_DIRECTORY, "derivatives/miniature", "derivatives/profile"):
+            await anyio.to_thread.run_sync(shutil.rmtree, media_directory(directory, sha256), True)
+
+
+@job_handler("collect_orphaned_media")
+async def collect_orphaned_media(dry_run: bool = False, quarantine: Optional[str] = None):
+    await collect(dry_run=dry_run, quarantine=quarantine)
+
+
+async def rollup_counters():
+    for (_, field), (model, _) in COUNTER_SOURCES.items():
+        async with SessionLocal() as db:
+            await rollup_counter_shards(db=db, model=model, field=field)
+
+
+@job_handler("reconcile_counters")
+async def reconcile_counters(batch_size: int = 1000):
+    # Recounts likes, dislikes and subscribers from the association tables in
+    # id ranges, each range is its own short transaction
+    for (table_name, field), (model, key_column) in COUNTER_SOURCES.items():
+        async with SessionLocal() as db:
+            max_id = await get_max_row_id(db=db, model=model)
+
+        fixed = 0
+        for start_id in range(0, max_id + 1, batch_size):
+            async with SessionLocal() as db:
+                fixed += await reconcile_counter(
+                    db=db, model=model, field=field, key_column=key_column, start_id=start_id, end_id=start_id + batch_size
+                )
+        print(f"Reconciled {fixed} {table_name}.{field} counters")
+
+
+@job_handler("adjust_user_preferences")
+async def adjust_user_preferences(user_id: int, video_id: int, liked: bool = False):
+    async with SessionLocal() as db:
+        await adjust_user_preferences_for_video(db=db, user_id=user_id, video_id=video_id, liked=liked)
+
+
+@job_handler("adjust_view_preferences")
+async def adjust_view_preferences(views: list):
+    async with SessionLocal() as db:
+        await adjust_user_preferences_for_views(db=db, views=views)
+
+
+def remove_media_directories(user_id: int, media: dict):
+    directories = [("derivatives/profile", user_id)]
+    for video in media["videos"]:
+        directories.append((HLS_DIRECTORY, video["id"]))
+        directories.append((PREVIEWS_DIRECTORY, video["id"]))
+        directories.append(("derivatives/miniature", video["id"]))
+
+    for directory, media_id in directories:
+        shutil.rmtree(media_directory(directory, media_id), ignore_errors=True)
+        remove_legacy_directory(legacy_media_directory(directory, media_id))
+
+
+@job_handler("delete_account")
+async def delete_account_job(user_id: int):
+    async with SessionLocal() as db:
+        media = await get_user_media_references(db=db, user_id=user_id)
+        result = await delete_account(db=db, user_id=user_id)
+
+    if "error" in result:
+        raise RuntimeError(result["error"])
+
+    files = []
+    if media["profile_extension"]:
+        files.append((PROFILES_DIRECTORY, user_id, media["profile_extension"]))
+    for video in media["videos"]:
+        files.append((VIDEOS_DIRECTORY, video["id"], video["video_extension"]))
+        files.append((MINIATURES_DIRECTORY, video["id"], video["miniature_extension"]))
+
+    # Both layouts, the account may predate the sharding migration
+    for directory, media_id, extension in files:
+        await storage.delete(media_file(directory, media_id, extension))
+        await storage.delete(legacy_media_file(directory, media_id, extension))
+
+    await anyio.to_thread.run_sync(remove_media_directories, user_id, media)
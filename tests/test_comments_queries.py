@@ -0,0 +1,101 @@
+import asyncio
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from database import Base
+from models import Comment, User, Video, user_comment_favorites, user_subscriptions
+from crud import get_comments
+
+# Runs against a scratch Postgres database, everything happens inside one
+# transaction that is rolled back at the end
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+async def count_statements(scenario):
+    engine = create_async_engine(TEST_DATABASE_URL)
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    try:
+        async with engine.connect() as conn:
+            transaction = await conn.begin()
+            await conn.run_sync(Base.metadata.create_all)
+            db = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+
+            users = (await db.execute(
+                insert(User).returning(User.id),
+                [
+                    {"username": name, "email": f"{name}@example.com", "password_hash": "x", "private_account": name == "private"}
+                    for name in ("public", "private", "viewer", "subscriber")
+                ]
+            )).scalars().all()
+            public, private, viewer, subscriber = users
+            await db.execute(insert(user_subscriptions).values(user_id=subscriber, channel_id=private))
+
+            videos = {}
+            for owner in (public, private):
+                videos[owner] = (await db.execute(
+                    insert(Video).values(
+                        title="video", video_extension=".mp4", miniature_extension=".png",
+                        upload_date=datetime.now(), owner_id=owner
+                    ).returning(Video.id)
+                )).scalar_one()
+                comment_ids = (await db.execute(
+                    insert(Comment).returning(Comment.id),
+                    [
+                        {"content": f"comment {i}", "owner_id": viewer, "video_id": videos[owner], "date": datetime.now()}
+                        for i in range(40)
+                    ]
+                )).scalars().all()
+                await db.execute(insert(user_comment_favorites).values(user_id=viewer, comment_id=comment_ids[0]))
+            await db.flush()
+
+            event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+            try:
+                result = await scenario(db, users, videos)
+            finally:
+                event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+            await db.close()
+            await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+    return result, statements
+
+
+@pytest.mark.parametrize("order_by", ["likes", "recent", "old"])
+def test_comments_page_is_one_statement(order_by):
+    async def scenario(db, users, videos):
+        public = users[0]
+        return await get_comments(db=db, user_id=users[2], video_id=videos[public], offset_value=0, order_by=order_by)
+
+    result, statements = asyncio.run(count_statements(scenario))
+
+    assert len(result["comments"]) == 30
+    assert sum(comment["liked"] for comment in result["comments"]) <= 1
+    assert len(statements) <= 2, statements
+
+
+def test_private_channel_comments_stay_within_budget():
+    async def scenario(db, users, videos):
+        public, private, viewer, subscriber = users
+        return (
+            await get_comments(db=db, user_id=viewer, video_id=videos[private], offset_value=0),
+            await get_comments(db=db, user_id=subscriber, video_id=videos[private], offset_value=0),
+            await get_comments(db=db, user_id=subscriber, video_id=videos[private], offset_value=60)
+        )
+
+    (denied, allowed, past_end), statements = asyncio.run(count_statements(scenario))
+
+    assert denied == {"error": "not allowed to see the comments"}
+    assert len(allowed["comments"]) == 30
+    assert past_end == {"comments": []}
+    # Two statements for each empty page, one for the page with comments
+    assert len(statements) <= 2 + 1 + 2, statements
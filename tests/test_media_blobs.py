@@ -0,0 +1,68 @@
+import asyncio
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from database import Base
+from models import MediaBlob, User, Video
+from crud import acquire_media_blob, replace_video_blob
+
+# Same setup as test_comments_queries, a scratch Postgres database and one
+# transaction rolled back at the end
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+OLD_SHA256 = "a" * 64
+NEW_SHA256 = "b" * 64
+
+
+async def rekey(current_sha256: str):
+    engine = create_async_engine(TEST_DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            transaction = await conn.begin()
+            await conn.run_sync(Base.metadata.create_all)
+            db = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+
+            await acquire_media_blob(db, OLD_SHA256, 10)
+            user_id = (await db.execute(
+                insert(User).values(username="owner", email="owner@example.com", password_hash="x").returning(User.id)
+            )).scalar_one()
+            video_id = (await db.execute(
+                insert(Video).values(
+                    title="video", video_extension=".mp4", miniature_extension=".png", upload_date=datetime.now(),
+                    owner_id=user_id, video_sha256=current_sha256
+                ).returning(Video.id)
+            )).scalar_one()
+
+            await acquire_media_blob(db, NEW_SHA256, 10)
+            replaced = await replace_video_blob(db, video_id, OLD_SHA256, NEW_SHA256)
+
+            row_sha256 = (await db.execute(select(Video.video_sha256).where(Video.id == video_id))).scalar_one()
+            refcounts = dict((await db.execute(select(MediaBlob.sha256, MediaBlob.refcount))).all())
+
+            await db.close()
+            await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+    return replaced, row_sha256, refcounts
+
+
+def test_replace_video_blob_rekeys_the_row_and_releases_the_old_blob():
+    replaced, row_sha256, refcounts = asyncio.run(rekey(OLD_SHA256))
+
+    assert replaced
+    assert row_sha256 == NEW_SHA256
+    assert refcounts == {OLD_SHA256: 0, NEW_SHA256: 1}
+
+
+def test_replace_video_blob_leaves_a_row_that_already_moved():
+    # A retried job whose row was re-keyed by an earlier attempt
+    replaced, row_sha256, refcounts = asyncio.run(rekey(NEW_SHA256))
+
+    assert not replaced
+    assert row_sha256 == NEW_SHA256
+    assert refcounts == {OLD_SHA256: 1, NEW_SHA256: 1}
@@ -0,0 +1,21 @@
+from collections import Counter
+from media_layout import HLS_DIRECTORY, MEDIA_ROOT, SHARD_PATTERN, VIDEOS_DIRECTORY, blob_file, media_directory, media_file, shard
+
+
+def test_shard_is_stable_and_two_levels():
+    assert shard(42) == shard("42") == shard(42)
+    assert all(SHARD_PATTERN.match(part) for part in shard(42).parts)
+    assert len(shard(42).parts) == 2
+
+
+def test_sequential_ids_spread_out():
+    first_levels = Counter(shard(media_id).parts[0] for media_id in range(1, 4097))
+
+    assert len(first_levels) > 200
+    assert max(first_levels.values()) < 40
+
+
+def test_paths_use_the_shard():
+    assert media_file(VIDEOS_DIRECTORY, 7, ".mp4") == MEDIA_ROOT / VIDEOS_DIRECTORY / shard(7) / "7.mp4"
+    assert media_directory(HLS_DIRECTORY, 7) == MEDIA_ROOT / HLS_DIRECTORY / shard(7) / "7"
+    assert blob_file("ab" + "cd" + "e" * 60) == MEDIA_ROOT / "blobs" / "ab" / "cd" / ("abcd" + "e" * 60)
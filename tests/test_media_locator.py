@@ -0,0 +1,36 @@
+import asyncio
+from pathlib import Path
+import media_locator
+from media_locator import MediaLocation, locate_video_directory, locator
+from media_layout import HLS_DIRECTORY, PREVIEWS_DIRECTORY, blob_file, media_directory
+
+OLD_SHA256 = "a" * 64
+NEW_SHA256 = "b" * 64
+
+
+def test_derived_directories_follow_a_rekeyed_blob(monkeypatch):
+    # Cached before the faststart job moved the row to a new blob
+    locator.put("video", 7, MediaLocation(blob_file(OLD_SHA256), "video/mp4", OLD_SHA256))
+
+    async def get_video_media_by_id(db, video_id):
+        return (".mp4", NEW_SHA256)
+
+    monkeypatch.setattr(media_locator, "get_video_media_by_id", get_video_media_by_id)
+
+    hls = asyncio.run(locate_video_directory(db=None, video_id=7, directory=HLS_DIRECTORY))
+    previews = asyncio.run(locate_video_directory(db=None, video_id=7, directory=PREVIEWS_DIRECTORY))
+
+    assert hls == media_directory(HLS_DIRECTORY, NEW_SHA256)
+    assert previews == media_directory(PREVIEWS_DIRECTORY, NEW_SHA256)
+    # The stale location is dropped so /video_stream picks up the new blob too
+    assert locator.get("video", 7) is None
+
+
+def test_derived_directories_of_legacy_videos_use_the_row_id(monkeypatch):
+    async def get_video_media_by_id(db, video_id):
+        return (".mp4", None)
+
+    monkeypatch.setattr(media_locator, "get_video_media_by_id", get_video_media_by_id)
+    monkeypatch.setattr(media_locator, "existing_media_directory", lambda directory, media_id: Path(directory) / str(media_id))
+
+    assert asyncio.run(locate_video_directory(db=None, video_id=8, directory=HLS_DIRECTORY)) == Path(HLS_DIRECTORY) / "8"
@@ -0,0 +1,118 @@
+import asyncio
+from pathlib import Path
+import boto3
+import pytest
+from moto import mock_aws
+import media_locator
+import migrate_media
+from media_layout import MINIATURES_DIRECTORY, VIDEOS_DIRECTORY, blob_file, legacy_media_file, media_file
+from media_locator import IMAGE_EXTENSION_TO_MEDIA_TYPE, VIDEO_EXTENSION_TO_MEDIA_TYPE, probe
+from storage import S3Storage
+
+BUCKET = "streaming-web-test"
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    # media/ paths are relative, every test gets its own media root
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET)
+
+
+def write(path: Path, content: bytes = b"data") -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def test_put_exists_delete(s3):
+    source = write(Path("upload.part"))
+    path = media_file(VIDEOS_DIRECTORY, 12, ".mp4")
+
+    assert not asyncio.run(s3.exists(path))
+    asyncio.run(s3.put_file(source, path))
+    assert asyncio.run(s3.exists(path))
+    assert source.exists()
+
+    head = s3.client.head_object(Bucket=BUCKET, Key=s3.key(path))
+    assert head["ContentType"] == "video/mp4"
+
+    asyncio.run(s3.delete(path))
+    assert not asyncio.run(s3.exists(path))
+
+
+def test_save_moves_the_source(s3):
+    source = write(Path("upload.part"))
+    path = blob_file("c" * 64)
+
+    asyncio.run(s3.save(source, path))
+
+    assert not source.exists()
+    assert asyncio.run(s3.exists(path))
+
+
+def test_local_copy_is_removed_afterwards(s3):
+    path = media_file(VIDEOS_DIRECTORY, 3, ".mp4")
+    asyncio.run(s3.put_file(write(Path("upload.part"), b"video bytes"), path))
+
+    async def read():
+        async with s3.local_copy(path) as copy:
+            return copy, copy.read_bytes()
+
+    copy, content = asyncio.run(read())
+    assert content == b"video bytes"
+    assert not copy.exists()
+
+
+def test_presigned_url_points_at_the_key(s3):
+    path = media_file(VIDEOS_DIRECTORY, 5, ".mp4")
+    url = s3.presigned_url(path, "video/mp4")
+
+    assert s3.key(path) in url
+    assert "X-Amz-Signature" in url
+
+
+def test_probe_only_heads_the_stored_extension(s3, monkeypatch):
+    heads = []
+    head_object = s3.client.head_object
+
+    def counting_head_object(**kwargs):
+        heads.append(kwargs["Key"])
+        return head_object(**kwargs)
+
+    monkeypatch.setattr(s3.client, "head_object", counting_head_object)
+    monkeypatch.setattr(media_locator, "storage", s3)
+
+    assert asyncio.run(probe(VIDEOS_DIRECTORY, 9, ".mkv", VIDEO_EXTENSION_TO_MEDIA_TYPE)) is None
+    # The sharded and the flat key of the stored extension, nothing else
+    assert heads == [s3.key(media_file(VIDEOS_DIRECTORY, 9, ".mkv")), s3.key(legacy_media_file(VIDEOS_DIRECTORY, 9, ".mkv"))]
+
+    asyncio.run(s3.put_file(write(Path("miniature.part")), legacy_media_file(MINIATURES_DIRECTORY, 9, ".png")))
+    location = asyncio.run(probe(MINIATURES_DIRECTORY, 9, ".PNG", IMAGE_EXTENSION_TO_MEDIA_TYPE))
+    assert location.path == legacy_media_file(MINIATURES_DIRECTORY, 9, ".png")
+    assert location.media_type == "image/png"
+
+
+def test_upload_to_storage_copies_local_media(s3):
+    files = [
+        write(media_file(VIDEOS_DIRECTORY, 1, ".mp4")),
+        write(legacy_media_file(MINIATURES_DIRECTORY, 2, ".jpg")),
+        write(blob_file("d" * 64)),
+    ]
+    # Not served by the storage backend
+    write(Path("media/miniatures/default.png"))
+    write(Path("media/videos/3.mp4.migrating"))
+
+    first = asyncio.run(migrate_media.upload_to_storage(s3, batch_size=100, pause=0, dry_run=False))
+    again = asyncio.run(migrate_media.upload_to_storage(s3, batch_size=100, pause=0, dry_run=False))
+
+    assert first == {"uploaded": 3, "skipped": 0, "failed": 0}
+    assert again == {"uploaded": 0, "skipped": 3, "failed": 0}
+    keys = {item["Key"] for item in s3.client.list_objects_v2(Bucket=BUCKET)["Contents"]}
+    assert keys == {s3.key(path) for path in files}
+    assert all(path.exists() for path in files)
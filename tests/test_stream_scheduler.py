@@ -0,0 +1,31 @@
+import asyncio
+import stream_scheduler
+from stream_scheduler import TokenBucket
+
+
+def test_token_bucket_paces_to_its_rate(monkeypatch):
+    now = [100.0]
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(stream_scheduler.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(stream_scheduler.asyncio, "sleep", sleep)
+
+    async def scenario():
+        bucket = TokenBucket(rate=1000, capacity=500)
+        # The burst is free, then every chunk waits for its own tokens
+        await bucket.consume(500)
+        await bucket.consume(250)
+        await bucket.consume(1000)
+        # Idle time refills the bucket, up to its capacity
+        now[0] += 60
+        await bucket.consume(500)
+        return bucket
+
+    bucket = asyncio.run(scenario())
+
+    assert sleeps == [0.25, 1.0]
+    assert bucket.tokens == 0
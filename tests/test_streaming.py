@@ -0,0 +1,78 @@
+import pytest
+from starlette.requests import Request
+from streaming import RangeNotSatisfiable, if_range_matches, parse_ranges
+from config import MAX_OPEN_RANGE_SIZE, MAX_RANGES_PER_REQUEST
+
+ETAG = '"5f3a-400"'
+# Sun, 06 Nov 1994 08:49:37 GMT
+MODIFIED_TIME = 784111777
+
+
+def request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", [(0, 99)]),
+    ("bytes=-100", [(900, 999)]),
+    ("bytes=-5000", [(0, 999)]),
+    ("bytes=500-5000", [(500, 999)]),
+    ("BYTES = 10-19", [(10, 19)]),
+    # Overlapping and adjacent ranges are coalesced, in order
+    ("bytes=200-299,0-99,100-149,250-399", [(0, 149), (200, 399)]),
+    ("bytes=0-99,0-99,0-99", [(0, 99)]),
+    # Unsatisfiable specs are dropped as long as one is left
+    ("bytes=0-9,2000-3000", [(0, 9)]),
+])
+def test_parse_ranges(header, expected):
+    assert parse_ranges(header, 1000) == expected
+
+
+def test_open_ended_range_is_capped():
+    size = MAX_OPEN_RANGE_SIZE * 3
+    assert parse_ranges("bytes=0-", size) == [(0, MAX_OPEN_RANGE_SIZE - 1)]
+    assert parse_ranges(f"bytes={size - 10}-", size) == [(size - 10, size - 1)]
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=2000-3000", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=-10", 0),
+    ("bytes=20-10", 1000),
+    ("bytes=a-b", 1000),
+    ("bytes=-", 1000),
+    ("bytes=", 1000),
+    ("items=0-10", 1000),
+])
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_ranges(header, size)
+
+
+def test_too_many_ranges():
+    within = ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES_PER_REQUEST))
+    assert len(parse_ranges(f"bytes={within}", 100000)) == MAX_RANGES_PER_REQUEST
+
+    over = ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES_PER_REQUEST + 1))
+    with pytest.raises(RangeNotSatisfiable):
+        parse_ranges(f"bytes={over}", 100000)
+
+    # Counted after coalescing, touching ranges are one
+    touching = ",".join(f"{i * 10}-{i * 10 + 9}" for i in range(MAX_RANGES_PER_REQUEST * 2))
+    assert parse_ranges(f"bytes={touching}", 100000) == [(0, MAX_RANGES_PER_REQUEST * 20 - 1)]
+
+
+def test_if_range_matches():
+    assert if_range_matches(request(), ETAG, MODIFIED_TIME)
+    assert if_range_matches(request(if_range=ETAG), ETAG, MODIFIED_TIME)
+    assert not if_range_matches(request(if_range='"other"'), ETAG, MODIFIED_TIME)
+    # Weak validators never match, If-Range needs a strong comparison
+    assert not if_range_matches(request(if_range=f"W/{ETAG}"), ETAG, MODIFIED_TIME)
+    assert if_range_matches(request(if_range="Sun, 06 Nov 1994 08:49:37 GMT"), ETAG, MODIFIED_TIME)
+    assert not if_range_matches(request(if_range="Sun, 06 Nov 1994 08:49:38 GMT"), ETAG, MODIFIED_TIME)
+    assert not if_range_matches(request(if_range="not a date"), ETAG, MODIFIED_TIME)
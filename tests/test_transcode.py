@@ -0,0 +1,71 @@
+import struct
+from transcode import is_faststart, read_mp4_duration, sign_playlist, sign_thumbnail_track
+
+
+def box(box_type: bytes, payload: bytes = b"", large: bool = False) -> bytes:
+    if large:
+        return struct.pack(">I4sQ", 1, box_type, len(payload) + 16) + payload
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    if version == 1:
+        times = struct.pack(">QQIQ", 0, 0, timescale, duration)
+    else:
+        times = struct.pack(">IIII", 0, 0, timescale, duration)
+    return box(b"mvhd", bytes([version, 0, 0, 0]) + times + bytes(80))
+
+
+def mp4(tmp_path, *boxes: bytes):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(box(b"ftyp", b"isom\x00\x00\x02\x00") + b"".join(boxes))
+    return path
+
+
+def test_is_faststart(tmp_path):
+    moov = box(b"moov", mvhd(1000, 5000))
+    mdat = box(b"mdat", bytes(64))
+
+    assert is_faststart(mp4(tmp_path, moov, mdat))
+    assert not is_faststart(mp4(tmp_path, mdat, moov))
+    assert not is_faststart(mp4(tmp_path, box(b"free", bytes(16)), box(b"mdat", bytes(64), large=True), moov))
+    # Truncated or malformed files are left alone
+    assert is_faststart(mp4(tmp_path, struct.pack(">I4s", 0, b"free")))
+
+
+def test_read_mp4_duration(tmp_path):
+    assert read_mp4_duration(mp4(tmp_path, box(b"moov", mvhd(1000, 12500)), box(b"mdat", bytes(64)))) == 12.5
+    assert read_mp4_duration(mp4(tmp_path, box(b"mdat", bytes(64)), box(b"moov", box(b"trak") + mvhd(600, 1800, version=1)))) == 3.0
+    assert read_mp4_duration(mp4(tmp_path, box(b"moov", mvhd(0, 1800)))) is None
+    assert read_mp4_duration(mp4(tmp_path, box(b"moov", box(b"trak")))) is None
+    assert read_mp4_duration(mp4(tmp_path, box(b"mdat", bytes(64)))) is None
+
+
+def test_sign_playlist():
+    playlist = "\n".join([
+        "#EXTM3U",
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360",
+        "360p/index.m3u8",
+        '#EXT-X-MAP:URI="init.mp4"',
+        "#EXTINF:4.0,",
+        "segment0.m4s",
+        "",
+        "#EXT-X-ENDLIST",
+    ])
+
+    assert sign_playlist(playlist, "abc").splitlines() == [
+        "#EXTM3U",
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360",
+        "360p/index.m3u8?token=abc",
+        '#EXT-X-MAP:URI="init.mp4?token=abc"',
+        "#EXTINF:4.0,",
+        "segment0.m4s?token=abc",
+        "",
+        "#EXT-X-ENDLIST",
+    ]
+
+
+def test_sign_thumbnail_track():
+    track = "WEBVTT\n\n00:00.000 --> 00:05.000\nsprite0.jpg#xywh=0,0,160,90\n"
+
+    assert sign_thumbnail_track(track, "abc") == "WEBVTT\n\n00:00.000 --> 00:05.000\nsprite0.jpg?token=abc#xywh=0,0,160,90\n"
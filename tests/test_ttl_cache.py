@@ -0,0 +1,47 @@
+import ttl_cache
+from ttl_cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    cache = TTLCache(max_entries=10, ttl=30)
+
+    cache.put("user", {"id": 1})
+    clock.now += 29
+    assert cache.get("user") == {"id": 1}
+    clock.now += 2
+    assert cache.get("user") is None
+    assert "user" not in cache.entries
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_entries=2, ttl=60)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_invalidate():
+    cache = TTLCache(max_entries=10, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    cache.invalidate("a", "missing")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
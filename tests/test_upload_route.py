@@ -0,0 +1,46 @@
+import hashlib
+import os
+from fastapi import APIRouter, FastAPI, File, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+import uploads
+from uploads import receive_upload, upload_route
+
+
+def client(monkeypatch, tmp_path, spools):
+    monkeypatch.setattr(uploads, "UPLOAD_TEMP_DIR", str(tmp_path))
+    router = APIRouter(route_class=upload_route(1000, lambda request: JSONResponse({"error": 4}, status_code=413)))
+
+    @router.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        spools.append(file.file.name)
+        ingested = await receive_upload(file, max_size=1000)
+        return {"path": str(ingested.path), "size": ingested.size, "sha256": ingested.sha256}
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_spooled_part_is_moved_into_place(monkeypatch, tmp_path):
+    spools = []
+    content = os.urandom(800)
+
+    result = client(monkeypatch, tmp_path, spools).post("/upload", files={"file": ("video.mp4", content)}).json()
+
+    assert result["size"] == 800
+    assert result["sha256"] == hashlib.sha256(content).hexdigest()
+    assert open(result["path"], "rb").read() == content
+    assert spools[0].startswith(str(tmp_path))
+    assert os.listdir(tmp_path) == [os.path.basename(result["path"])]
+
+
+def test_oversized_body_is_rejected_before_parsing(monkeypatch, tmp_path):
+    spools = []
+
+    response = client(monkeypatch, tmp_path, spools).post("/upload", files={"file": ("video.mp4", os.urandom(2 * 1024 * 1024))})
+
+    assert response.status_code == 413
+    assert response.json() == {"error": 4}
+    assert spools == []
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,28 @@
+from uploads import contiguous_offset, read_received_ranges
+
+
+def received(tmp_path, *markers: str):
+    (tmp_path / "ranges").mkdir()
+    for marker in markers:
+        (tmp_path / "ranges" / marker).touch()
+    return read_received_ranges(tmp_path)
+
+
+def test_chunks_received_in_order(tmp_path):
+    ranges = received(tmp_path, "0-100", "100-200", "200-250")
+
+    assert ranges == [(0, 250)]
+    assert contiguous_offset(ranges) == 250
+
+
+def test_retried_and_out_of_order_chunks(tmp_path):
+    # A retried chunk overlaps the first one, the third arrived before the second
+    ranges = received(tmp_path, "0-100", "50-150", "300-400")
+
+    assert ranges == [(0, 150), (300, 400)]
+    assert contiguous_offset(ranges) == 150
+
+
+def test_nothing_from_the_start(tmp_path):
+    assert contiguous_offset(received(tmp_path)) == 0
+    assert contiguous_offset([(100, 200)]) == 0
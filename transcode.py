@@ -0,0 +1,369 @@
+import asyncio
+import math
+import os
+import re
+import secrets
+import shutil
+import struct
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple, Union
+from database import SessionLocal
+from crud import set_video_hls_status
+from media_locator import locator
+from media_layout import HLS_DIRECTORY, PREVIEWS_DIRECTORY, media_directory, replace_directory
+from config import (
+    FFMPEG_BINARY, FFPROBE_BINARY, HLS_ENABLED, HLS_SEGMENT_SECONDS, HLS_MAX_CONCURRENT_JOBS,
+    PREVIEW_MAX_FRAMES, PREVIEW_MIN_INTERVAL, PREVIEW_THUMBNAIL_WIDTH, PREVIEW_TILE_COLUMNS, PREVIEW_TILE_ROWS
+)
+
+# name, height, video bitrate, audio bitrate (bits per second)
+HLS_LADDER = [
+    ("240p", 240, 400_000, 64_000),
+    ("360p", 360, 800_000, 96_000),
+    ("480p", 480, 1_400_000, 128_000),
+    ("720p", 720, 2_800_000, 128_000),
+    ("1080p", 1080, 5_000_000, 192_000)
+]
+
+HLS_RENDITIONS = {name for name, _, _, _ in HLS_LADDER}
+
+FASTSTART_EXTENSIONS = {".mp4", ".m4v", ".mov"}
+
+# Shared by every ffmpeg encode (HLS ladders and preview sprites)
+transcode_semaphore = asyncio.Semaphore(HLS_MAX_CONCURRENT_JOBS)
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def hls_directory(video_id: Union[int, str]) -> Path:
+    return media_directory(HLS_DIRECTORY, video_id)
+
+
+def previews_directory(video_id: Union[int, str]) -> Path:
+    return media_directory(PREVIEWS_DIRECTORY, video_id)
+
+
+async def run_command(*args: str) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise TranscodeError(stderr.decode(errors="replace")[-2000:])
+    return stdout
+
+
+async def probe_dimensions(source_path: Path) -> Tuple[int, int]:
+    output = await run_command(
+        FFPROBE_BINARY, "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height",
+        "-of", "csv=p=0:s=x",
+        str(source_path)
+    )
+    lines = output.decode().strip().splitlines()
+    if not lines:
+        raise TranscodeError(f"No video stream in {source_path}")
+    width, height = (int(value) for value in lines[0].split("x")[:2])
+    if width <= 0 or height <= 0:
+        raise TranscodeError(f"Invalid dimensions {width}x{height} in {source_path}")
+    return width, height
+
+
+async def probe_duration(source_path: Path) -> float:
+    output = await run_command(
+        FFPROBE_BINARY, "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "csv=p=0",
+        str(source_path)
+    )
+    try:
+        duration = float(output.decode().strip())
+    except ValueError:
+        raise TranscodeError(f"Unknown duration for {source_path}")
+    if duration <= 0:
+        raise TranscodeError(f"Invalid duration {duration} for {source_path}")
+    return duration
+
+
+def is_faststart(path: Path) -> bool:
+    # Walks the top level ISO BMFF boxes, the file is faststart when the moov
+    # index comes before the mdat payload
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                return True
+            size, box_type = struct.unpack(">I4s", header)
+            header_size = 8
+            if size == 1:
+                size = struct.unpack(">Q", file.read(8))[0]
+                header_size = 16
+            if box_type == b"moov":
+                return True
+            if box_type == b"mdat":
+                return False
+            if size < header_size:
+                # Box runs to the end of the file or is malformed, leave it alone
+                return True
+            file.seek(size - header_size, os.SEEK_CUR)
+
+
+def find_box(file: BinaryIO, box_type: bytes, start: int, end: int) -> Optional[Tuple[int, int]]:
+    # Returns the payload bounds of the first box of that type between start and end
+    position = start
+    while position + 8 <= end:
+        file.seek(position)
+        size, current_type = struct.unpack(">I4s", file.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", file.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            return None
+        if current_type == box_type:
+            return position + header_size, min(position + size, end)
+        position += size
+    return None
+
+
+def read_mp4_duration(path: Path) -> Optional[float]:
+    with open(path, "rb") as file:
+        moov = find_box(file, b"moov", 0, os.fstat(file.fileno()).st_size)
+        if moov is None:
+            return None
+        mvhd = find_box(file, b"mvhd", *moov)
+        if mvhd is None:
+            return None
+        file.seek(mvhd[0])
+        version = file.read(4)[0]
+        if version == 1:
+            file.seek(16, os.SEEK_CUR)
+            timescale, duration = struct.unpack(">IQ", file.read(12))
+        else:
+            file.seek(8, os.SEEK_CUR)
+            timescale, duration = struct.unpack(">II", file.read(8))
+    if not timescale or not duration:
+        return None
+    return duration / timescale
+
+
+async def remux_faststart(video_id: int, source_path: str, extension: Optional[str] = None) -> Optional[Path]:
+    # Writes a faststart copy next to the source and returns it, None when the
+    # source already has its index first or can't be remuxed. Content addressed
+    # files carry no extension, the caller passes the uploaded one
+    path = Path(source_path)
+    extension = (extension or path.suffix).lower()
+    if extension not in FASTSTART_EXTENSIONS:
+        return None
+
+    temp_path = path.with_name(f"{path.name}.{secrets.token_hex(4)}.faststart{extension}")
+    try:
+        if await asyncio.to_thread(is_faststart, path):
+            return None
+
+        if shutil.which(FFMPEG_BINARY) is None:
+            raise TranscodeError(f"{FFMPEG_BINARY} not found")
+
+        # Stream copy only, ffmpeg rewrites the container with the index first
+        await run_command(
+            FFMPEG_BINARY, "-y", "-v", "error",
+            "-i", str(path),
+            "-map", "0:v", "-map", "0:a?",
+            "-c", "copy",
+            "-movflags", "+faststart",
+            str(temp_path)
+        )
+        return temp_path
+    except (TranscodeError, OSError) as e:
+        print(f"Error applying faststart to video {video_id}: {e}")
+        await asyncio.to_thread(temp_path.unlink, True)
+        return None
+
+
+async def apply_faststart(video_id: int, source_path: str, extension: Optional[str] = None) -> bool:
+    # In place, only for files stored under the row id. Content addressed
+    # blobs must keep matching their hash, see process_video_upload
+    temp_path = await remux_faststart(video_id, source_path, extension)
+    if temp_path is None:
+        return False
+    try:
+        await asyncio.to_thread(os.replace, temp_path, source_path)
+    except OSError as e:
+        print(f"Error applying faststart to video {video_id}: {e}")
+        await asyncio.to_thread(temp_path.unlink, True)
+        return False
+    locator.invalidate("video", video_id)
+    return True
+
+
+def select_renditions(source_height: int) -> List[Tuple[str, int, int, int]]:
+    # Never upscale, but always produce at least the lowest rung
+    renditions = [rung for rung in HLS_LADDER if rung[1] <= source_height]
+    return renditions or HLS_LADDER[:1]
+
+
+async def encode_rendition(source_path: Path, output_dir: Path, height: int, video_bitrate: int, audio_bitrate: int):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    await run_command(
+        FFMPEG_BINARY, "-y", "-v", "error",
+        "-i", str(source_path),
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:{height}",
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main",
+        "-b:v", str(video_bitrate),
+        "-maxrate", str(video_bitrate * 107 // 100),
+        "-bufsize", str(video_bitrate * 2),
+        # Keyframes on segment boundaries so every rendition switches cleanly
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-c:a", "aac", "-b:a", str(audio_bitrate), "-ac", "2",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", str(output_dir / "segment_%05d.m4s"),
+        str(output_dir / "index.m3u8")
+    )
+
+
+def write_master_playlist(output_dir: Path, renditions: List[Tuple[str, int, int, int]], aspect_ratio: float):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for name, height, video_bitrate, audio_bitrate in renditions:
+        width = round(height * aspect_ratio / 2) * 2
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={video_bitrate + audio_bitrate},RESOLUTION={width}x{height}")
+        lines.append(f"{name}/index.m3u8")
+    (output_dir / "master.m3u8").write_text("\n".join(lines) + "\n")
+
+
+async def package_hls(video_id: int, source_path: str, sha256: Optional[str] = None):
+    if not HLS_ENABLED:
+        return
+
+    async with SessionLocal() as db:
+        await set_video_hls_status(db=db, video_id=video_id, status="pending")
+
+    output_dir = hls_directory(sha256 or video_id)
+    work_dir = output_dir.with_name(f"{output_dir.name}.{secrets.token_hex(4)}.tmp")
+
+    try:
+        async with transcode_semaphore:
+            async with SessionLocal() as db:
+                await set_video_hls_status(db=db, video_id=video_id, status="processing")
+
+            if shutil.which(FFMPEG_BINARY) is None:
+                raise TranscodeError(f"{FFMPEG_BINARY} not found")
+
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+            width, height = await probe_dimensions(Path(source_path))
+            renditions = select_renditions(height)
+
+            for name, rendition_height, video_bitrate, audio_bitrate in renditions:
+                await encode_rendition(Path(source_path), work_dir / name, rendition_height, video_bitrate, audio_bitrate)
+
+            write_master_playlist(work_dir, renditions, width / height)
+            await asyncio.to_thread(replace_directory, work_dir, output_dir)
+    except (TranscodeError, OSError, ValueError) as e:
+        print(f"Error packaging video {video_id} [HLS]: {e}")
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+        async with SessionLocal() as db:
+            await set_video_hls_status(db=db, video_id=video_id, status="failed")
+        # Let the job queue retry with backoff
+        raise
+
+    async with SessionLocal() as db:
+        await set_video_hls_status(db=db, video_id=video_id, status="ready")
+
+
+def format_vtt_timestamp(seconds: float) -> str:
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}.{milliseconds:03}"
+
+
+def write_thumbnail_track(output_dir: Path, duration: float, interval: float, frames: int, tile_width: int, tile_height: int):
+    per_sheet = PREVIEW_TILE_COLUMNS * PREVIEW_TILE_ROWS
+    lines = ["WEBVTT", ""]
+    for frame in range(frames):
+        sheet, position = divmod(frame, per_sheet)
+        row, column = divmod(position, PREVIEW_TILE_COLUMNS)
+        start = frame * interval
+        end = min(start + interval, duration)
+        lines.append(f"{format_vtt_timestamp(start)} --> {format_vtt_timestamp(end)}")
+        lines.append(f"sprite_{sheet + 1:03}.jpg#xywh={column * tile_width},{row * tile_height},{tile_width},{tile_height}")
+        lines.append("")
+    (output_dir / "thumbnails.vtt").write_text("\n".join(lines))
+
+
+async def generate_previews(video_id: int, source_path: str, sha256: Optional[str] = None):
+    output_dir = previews_directory(sha256 or video_id)
+    work_dir = output_dir.with_name(f"{output_dir.name}.{secrets.token_hex(4)}.tmp")
+
+    try:
+        async with transcode_semaphore:
+            if shutil.which(FFMPEG_BINARY) is None:
+                raise TranscodeError(f"{FFMPEG_BINARY} not found")
+
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+            work_dir.mkdir(parents=True)
+
+            width, height = await probe_dimensions(Path(source_path))
+            duration = await probe_duration(Path(source_path))
+            interval = max(PREVIEW_MIN_INTERVAL, duration / PREVIEW_MAX_FRAMES)
+            tile_width = PREVIEW_THUMBNAIL_WIDTH
+            tile_height = max(2, round(tile_width * height / width / 2) * 2)
+
+            # Only keyframes are decoded, previews snap to the nearest one but
+            # extraction costs a fraction of a full decode
+            await run_command(
+                FFMPEG_BINARY, "-y", "-v", "error",
+                "-skip_frame", "nokey",
+                "-i", str(source_path),
+                "-map", "0:v:0",
+                "-vf", f"fps=1/{interval},scale={tile_width}:{tile_height},tile={PREVIEW_TILE_COLUMNS}x{PREVIEW_TILE_ROWS}",
+                "-fps_mode", "passthrough",
+                "-q:v", "5",
+                str(work_dir / "sprite_%03d.jpg")
+            )
+
+            sheets = len(list(work_dir.glob("sprite_*.jpg")))
+            frames = min(math.ceil(duration / interval), sheets * PREVIEW_TILE_COLUMNS * PREVIEW_TILE_ROWS)
+            write_thumbnail_track(work_dir, duration, interval, frames, tile_width, tile_height)
+            await asyncio.to_thread(replace_directory, work_dir, output_dir)
+    except (TranscodeError, OSError, ValueError) as e:
+        print(f"Error generating previews for video {video_id}: {e}")
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+        raise
+
+
+def sign_thumbnail_track(track: str, token: str) -> str:
+    # Same reason as sign_playlist, the token goes before the #xywh fragment
+    lines = []
+    for line in track.splitlines():
+        if "#xywh=" in line:
+            path, fragment = line.split("#", 1)
+            line = f"{path}?token={token}#{fragment}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def sign_playlist(playlist: str, token: str) -> str:
+    # Relative URIs drop the query string, so the stream token is appended to
+    # every variant, init segment and media segment the playlist references
+    query = f"?token={token}"
+    lines = []
+    for line in playlist.splitlines():
+        if line and not line.startswith("#"):
+            line += query
+        elif line.startswith("#EXT-X-MAP:"):
+            line = re.sub(r'URI="([^"]+)"', lambda match: f'URI="{match.group(1)}{query}"', line)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,401 @@
+import hashlib
+import io
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional, Tuple, Type
+import anyio
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from starlette.formparsers import MultiPartException, MultiPartParser
+from python_multipart.multipart import parse_options_header
+from sqlalchemy.ext.asyncio import AsyncSession
+from crud import acquire_media_blob, upload_video
+from media_locator import locator
+from storage import storage
+from media_layout import blob_file
+from jobs import enqueue_job
+from config import UPLOAD_CHUNK_SIZE, UPLOAD_FORM_OVERHEAD, UPLOAD_TEMP_DIR, RESUMABLE_UPLOAD_TTL
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class ChunkOutOfBounds(Exception):
+    pass
+
+
+class IngestedUpload(NamedTuple):
+    path: Path
+    size: int
+    sha256: str
+
+
+class UploadSession(NamedTuple):
+    id: str
+    directory: Path
+    user_id: int
+    filename: str
+    content_type: str
+    size: int
+    created_at: float
+
+
+class UploadSpoolFile(io.FileIO):
+    # Where a multipart file part is written while the form is parsed, instead
+    # of Starlette's anonymous temporary file. It is named and hashed as it is
+    # written, so receive_upload only has to rename it into place
+
+    def __init__(self):
+        os.makedirs(UPLOAD_TEMP_DIR, exist_ok=True)
+        super().__init__(os.path.join(UPLOAD_TEMP_DIR, f"{secrets.token_hex(16)}.spool"), "x+")
+        self.digest = hashlib.sha256()
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        while view:
+            view = view[super().write(view):]
+        self.digest.update(data)
+        return len(data)
+
+    def close(self):
+        # A part that was never received (or failed validation) goes away with
+        # the request, one moved by receive_upload is already gone
+        super().close()
+        try:
+            os.unlink(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class SpoolingMultiPartParser(MultiPartParser):
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None:
+            self._files_to_close_on_error.pop().close()
+            upload.file = UploadSpoolFile()
+            self._files_to_close_on_error.append(upload.file)
+
+
+class UploadRequest(Request):
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000, max_part_size=1024 * 1024):
+        if self._form is None:
+            content_type, _ = parse_options_header(self.headers.get("Content-Type"))
+            if content_type == b"multipart/form-data":
+                parser = SpoolingMultiPartParser(
+                    self.headers, self.stream(), max_files=max_files, max_fields=max_fields, max_part_size=max_part_size
+                )
+                try:
+                    self._form = await parser.parse()
+                except MultiPartException as exc:
+                    raise HTTPException(status_code=400, detail=exc.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields, max_part_size=max_part_size)
+
+
+def upload_route(max_size: int, too_large: Callable[[Request], Response]) -> Type[APIRoute]:
+    # Route class for routers that take file uploads. A multipart body whose
+    # Content-Length is over max_size (plus the form fields) gets too_large
+    # before anything is read, file parts are spooled into UPLOAD_TEMP_DIR
+    class UploadRoute(APIRoute):
+
+        def get_route_handler(self) -> Callable:
+            handler = super().get_route_handler()
+
+            async def upload_handler(request: Request) -> Response:
+                content_type, _ = parse_options_header(request.headers.get("Content-Type"))
+                if content_type == b"multipart/form-data":
+                    length = request.headers.get("Content-Length")
+                    if length is None or not length.isdigit():
+                        return Response(status_code=411)
+                    if int(length) > max_size + UPLOAD_FORM_OVERHEAD:
+                        return too_large(request)
+                return await handler(UploadRequest(request.scope, request.receive))
+
+            return upload_handler
+
+    return UploadRoute
+
+
+async def receive_upload(upload_file: UploadFile, max_size: int) -> IngestedUpload:
+    # Starlette knows the size of the spooled part, reject before copying anything
+    if upload_file.size is not None and upload_file.size > max_size:
+        raise UploadTooLarge(upload_file.filename)
+
+    temp_path = Path(UPLOAD_TEMP_DIR) / f"{secrets.token_hex(16)}.part"
+
+    if isinstance(upload_file.file, UploadSpoolFile):
+        # Already on disk next to the destination and hashed, a rename is enough
+        spool = upload_file.file
+        await anyio.to_thread.run_sync(os.replace, spool.name, temp_path)
+        return IngestedUpload(temp_path, upload_file.size, spool.digest.hexdigest())
+
+    # Parts parsed by a plain Request are in Starlette's own temporary file
+    temp_dir = anyio.Path(UPLOAD_TEMP_DIR)
+    await temp_dir.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(temp_path, "wb") as out_file:
+            while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(upload_file.filename)
+                digest.update(chunk)
+                await out_file.write(chunk)
+    except BaseException:
+        await anyio.Path(temp_path).unlink(missing_ok=True)
+        raise
+
+    return IngestedUpload(temp_path, size, digest.hexdigest())
+
+
+async def store_blob(db: AsyncSession, upload: IngestedUpload) -> str:
+    # Takes a reference on the content address of the upload, the bytes are
+    # only moved into the store the first time they are seen. The caller
+    # commits, or rolls back and discards the upload
+    await acquire_media_blob(db, upload.sha256, upload.size)
+    path = blob_file(upload.sha256)
+    if await storage.exists(path):
+        await discard_upload(upload)
+    else:
+        await storage.save(upload.path, path)
+    return upload.sha256
+
+
+async def discard_upload(upload: IngestedUpload):
+    await anyio.Path(upload.path).unlink(missing_ok=True)
+
+
+async def publish_video(
+    db: AsyncSession,
+    user_id: int,
+    title: str,
+    description: str,
+    video_upload: IngestedUpload,
+    video_filename: str,
+    miniature_upload: IngestedUpload,
+    miniature_filename: str
+):
+    video_extension = os.path.splitext(video_filename)[1]
+    miniature_extension = os.path.splitext(miniature_filename)[1]
+    title_hashtags = re.findall(r"#\w+", title)
+    description_hashtags = re.findall(r"#\w+", description)
+    hashtags = title_hashtags + description_hashtags
+
+    try:
+        video_sha256 = await store_blob(db, video_upload)
+        miniature_sha256 = await store_blob(db, miniature_upload)
+        video_data = await upload_video(db=db, user_id=user_id, title=title, description=description, video_extension=video_extension, miniature_extension=miniature_extension,
+                                        hashtags=hashtags, video_sha256=video_sha256, miniature_sha256=miniature_sha256)
+    except Exception:
+        await db.rollback()
+        await discard_upload(video_upload)
+        await discard_upload(miniature_upload)
+        raise
+
+    video_path = str(blob_file(video_sha256))
+    locator.invalidate("video", video_data.id)
+    locator.invalidate("miniature", video_data.id)
+
+    # Duplicates are enqueued too, the jobs find the derived media of the
+    # same content already in place and only mark the row ready. Previews are
+    # enqueued by process_video_upload once faststart settled the blob
+    job = await enqueue_job(
+        db,
+        "process_video_upload",
+        {"video_id": video_data.id, "video_path": video_path, "video_sha256": video_sha256, "video_extension": video_extension},
+        user_id=user_id
+    )
+    await enqueue_job(
+        db,
+        "generate_image_derivatives",
+        {"kind": "miniature", "media_id": miniature_sha256, "source_path": str(blob_file(miniature_sha256))},
+        user_id=user_id
+    )
+
+    return video_data, job
+
+
+# Resumable uploads live in {UPLOAD_TEMP_DIR}/sessions/{id}/: session.json holds
+# the metadata, data.part is preallocated to the declared size and every chunk
+# written leaves an empty "{start}-{end}" marker in ranges/. Markers are never
+# rewritten, so chunks can arrive in parallel from any worker.
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def sessions_directory() -> Path:
+    return Path(UPLOAD_TEMP_DIR) / "sessions"
+
+
+def create_session_files(directory: Path, metadata: dict):
+    (directory / "ranges").mkdir(parents=True)
+    with open(directory / "data.part", "wb") as data_file:
+        data_file.truncate(metadata["size"])
+    (directory / "session.json").write_text(json.dumps(metadata))
+
+
+async def create_upload_session(user_id: int, filename: str, content_type: str, size: int) -> str:
+    await purge_expired_upload_sessions()
+
+    session_id = secrets.token_hex(16)
+    metadata = {
+        "user_id": user_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "created_at": time.time()
+    }
+    await anyio.to_thread.run_sync(create_session_files, sessions_directory() / session_id, metadata)
+    return session_id
+
+
+async def load_upload_session(session_id: str, user_id: int) -> Optional[UploadSession]:
+    if not SESSION_ID_PATTERN.match(session_id):
+        return None
+
+    directory = sessions_directory() / session_id
+    try:
+        metadata = json.loads(await anyio.Path(directory / "session.json").read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if metadata["user_id"] != user_id:
+        return None
+
+    return UploadSession(
+        id=session_id,
+        directory=directory,
+        user_id=metadata["user_id"],
+        filename=metadata["filename"],
+        content_type=metadata["content_type"],
+        size=metadata["size"],
+        created_at=metadata["created_at"]
+    )
+
+
+def read_received_ranges(directory: Path) -> List[Tuple[int, int]]:
+    ranges = []
+    for marker in os.listdir(directory / "ranges"):
+        start, _, end = marker.partition("-")
+        ranges.append((int(start), int(end)))
+
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def received_ranges(session: UploadSession) -> List[Tuple[int, int]]:
+    return await anyio.to_thread.run_sync(read_received_ranges, session.directory)
+
+
+def contiguous_offset(ranges: List[Tuple[int, int]]) -> int:
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+    return 0
+
+
+async def write_upload_chunk(session: UploadSession, offset: int, stream: AsyncIterator[bytes], max_length: int) -> int:
+    if offset < 0 or offset >= session.size:
+        raise ChunkOutOfBounds(offset)
+
+    limit = min(session.size, offset + max_length)
+    position = offset
+    buffer = bytearray()
+
+    fd = await anyio.to_thread.run_sync(os.open, session.directory / "data.part", os.O_WRONLY)
+    try:
+        async for chunk in stream:
+            if position + len(buffer) + len(chunk) > limit:
+                raise ChunkOutOfBounds(offset)
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                await anyio.to_thread.run_sync(os.pwrite, fd, bytes(buffer), position)
+                position += len(buffer)
+                buffer.clear()
+
+        if buffer:
+            await anyio.to_thread.run_sync(os.pwrite, fd, bytes(buffer), position)
+            position += len(buffer)
+    finally:
+        await anyio.to_thread.run_sync(os.close, fd)
+        # Whatever reached the disk counts, so a dropped connection resumes
+        # from the last flushed byte instead of the start of the chunk
+        if position > offset:
+            await anyio.Path(session.directory / "ranges" / f"{offset}-{position}").touch()
+
+    return position - offset
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_claimed_upload(claimed: Path, path: Path):
+    path.unlink(missing_ok=True)
+    os.link(claimed, path)
+
+
+async def complete_upload_session(session: UploadSession) -> IngestedUpload:
+    # Claims the assembled file so the session can't be finalized twice. The
+    # upload is a hard link to it, the session keeps its own until the video is
+    # published (close_upload_session) or publishing fails (reopen_upload_session)
+    claimed = session.directory / "data.finalizing"
+    path = Path(UPLOAD_TEMP_DIR) / f"{session.id}.part"
+    await anyio.to_thread.run_sync(os.replace, session.directory / "data.part", claimed)
+    try:
+        await anyio.to_thread.run_sync(link_claimed_upload, claimed, path)
+        sha256 = await anyio.to_thread.run_sync(hash_file, path)
+    except BaseException:
+        await anyio.Path(path).unlink(missing_ok=True)
+        await reopen_upload_session(session)
+        raise
+    return IngestedUpload(path, session.size, sha256)
+
+
+async def reopen_upload_session(session: UploadSession):
+    try:
+        await anyio.to_thread.run_sync(os.replace, session.directory / "data.finalizing", session.directory / "data.part")
+    except FileNotFoundError:
+        pass
+
+
+async def close_upload_session(session: UploadSession):
+    await anyio.to_thread.run_sync(shutil.rmtree, session.directory, True)
+
+
+def remove_expired_sessions(directory: Path, max_age: int):
+    if not directory.exists():
+        return
+    deadline = time.time() - max_age
+    for session_dir in directory.iterdir():
+        # ranges/ changes with every chunk, so active uploads stay alive
+        try:
+            last_activity = (session_dir / "ranges").stat().st_mtime
+        except FileNotFoundError:
+            last_activity = 0
+        if last_activity < deadline:
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+
+async def purge_expired_upload_sessions():
+    await anyio.to_thread.run_sync(remove_expired_sessions, sessions_directory(), RESUMABLE_UPLOAD_TTL)
@@ -0,0 +1,74 @@
+import asyncio
+from collections import Counter
+from typing import Optional
+from database import SessionLocal
+from crud import add_video_views
+from jobs import enqueue_job
+from config import VIEW_FLUSH_INTERVAL, VIEW_FLUSH_MAX_PENDING
+
+
+class ViewCounter:
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        # Distinct videos waiting before a flush is started early
+        self.max_pending = max_pending
+        self.pending: Counter = Counter()
+        # (user_id, video_id) views for the preference adjustment, one job per flush
+        self.viewers: Counter = Counter()
+        self.lock = asyncio.Lock()
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def add(self, video_id: int, user_id: Optional[int] = None, count: int = 1):
+        self.pending[video_id] += count
+        if user_id is not None:
+            self.viewers[(user_id, video_id)] += count
+        if len(self.pending) >= self.max_pending or len(self.viewers) >= self.max_pending:
+            self.wake()
+
+    def wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def flush(self) -> int:
+        async with self.lock:
+            views, self.pending = self.pending, Counter()
+            viewers, self.viewers = self.viewers, Counter()
+            flushed = 0
+
+            if views:
+                try:
+                    async with SessionLocal() as db:
+                        await add_video_views(db=db, views=views)
+                    flushed = len(views)
+                except Exception as e:
+                    # Kept for the next flush, views added meanwhile are merged in
+                    print(f"Error flushing views for {len(views)} videos: {e}")
+                    self.pending.update(views)
+
+            if viewers:
+                try:
+                    async with SessionLocal() as db:
+                        await enqueue_job(
+                            db, "adjust_view_preferences",
+                            {"views": [[user_id, video_id, count] for (user_id, video_id), count in viewers.items()]}
+                        )
+                except Exception as e:
+                    print(f"Error enqueueing preference updates for {len(viewers)} views: {e}")
+                    self.viewers.update(viewers)
+
+            return flushed
+
+    async def run(self, stop: asyncio.Event):
+        self.wakeup = asyncio.Event()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+        # Shutdown, whatever is still pending goes out before the process exits
+        await self.flush()
+
+
+view_counter = ViewCounter(flush_interval=VIEW_FLUSH_INTERVAL, max_pending=VIEW_FLUSH_MAX_PENDING)
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import signal
+import traceback
+from database import SessionLocal
+from jobs import JOB_HANDLERS, claim_job, complete_job, fail_job, heartbeat_job, purge_finished_jobs, schedule_job
+from config import (
+    JOB_WORKER_CONCURRENCY, JOB_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, COUNTER_ROLLUP_INTERVAL, COUNTER_RECONCILE_INTERVAL, MEDIA_GC_INTERVAL,
+    MEDIA_GC_QUARANTINE
+)
+import tasks  # registers the job handlers
+
+
+async def heartbeat(job):
+    # Keeps locked_at fresh while the handler runs, so a long job isn't taken
+    # for one whose worker died
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            async with SessionLocal() as db:
+                owned = await heartbeat_job(db, job)
+        except Exception as e:
+            print(f"Error refreshing the lock of job {job.id}: {e}")
+            continue
+        if not owned:
+            print(f"Job {job.id} ({job.kind}) was reclaimed by another worker")
+            return
+
+
+async def run_next_job() -> bool:
+    async with SessionLocal() as db:
+        job = await claim_job(db)
+
+    if not job:
+        return False
+
+    handler = JOB_HANDLERS.get(job.kind)
+    beat = asyncio.create_task(heartbeat(job))
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind {job.kind}")
+        await handler(**job.payload)
+    except Exception as e:
+        print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {e}")
+        async with SessionLocal() as db:
+            owned = await fail_job(db, job, traceback.format_exc())
+    else:
+        async with SessionLocal() as db:
+            owned = await complete_job(db, job)
+    finally:
+        beat.cancel()
+
+    if not owned:
+        # Another worker claimed it after the lock timed out, its result wins
+        print(f"Job {job.id} ({job.kind}) is no longer owned by this worker, result dropped")
+
+    return True
+
+
+async def work(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            ran_job = await run_next_job()
+        except Exception as e:
+            print(f"Error polling jobs: {e}")
+            ran_job = False
+
+        if not ran_job:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def schedule_maintenance():
+    if COUNTER_RECONCILE_INTERVAL > 0:
+        async with SessionLocal() as db:
+            await schedule_job(db, "reconcile_counters", COUNTER_RECONCILE_INTERVAL)
+    if MEDIA_GC_INTERVAL > 0:
+        async with SessionLocal() as db:
+            await schedule_job(db, "collect_orphaned_media", MEDIA_GC_INTERVAL, {"quarantine": MEDIA_GC_QUARANTINE})
+
+
+async def purge(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            async with SessionLocal() as db:
+                await purge_finished_jobs(db)
+        except Exception as e:
+            print(f"Error purging finished jobs: {e}")
+        try:
+            await tasks.sweep_media_blobs()
+        except Exception as e:
+            print(f"Error sweeping media blobs: {e}")
+        try:
+            await schedule_maintenance()
+        except Exception as e:
+            print(f"Error scheduling maintenance jobs: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=60 * 60)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def rollup(stop: asyncio.Event):
+    # Also runs with COUNTER_SHARDS=0, so shards left from before it was
+    # turned off still reach the main columns
+    while not stop.is_set():
+        try:
+            await tasks.rollup_counters()
+        except Exception as e:
+            print(f"Error rolling up counters: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=COUNTER_ROLLUP_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(concurrency: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Jobs in progress finish, no new ones are claimed
+        loop.add_signal_handler(sig, stop.set)
+
+    await asyncio.gather(purge(stop), rollup(stop), *(work(stop) for _ in range(concurrency)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs queued background jobs")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))